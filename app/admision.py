@@ -0,0 +1,181 @@
+# admision.py
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from app.config import env
+
+# =========
+# Config (lazy)
+# =========
+class AdmisionConfig:
+    """
+    Presupuesto por clase de ruta: cuántos requests en curso a la vez y cuánto
+    puede esperar uno en cola. Límite 0 = sin control. Los webhooks de
+    Agilpagos no se limitan por defecto: lo que se acota es lo que compite con
+    ellos (lecturas por hilos y conexiones de BD, proxy SG por su timeout).
+    """
+
+    def __init__(self):
+        self.habilitada = env("ADMISION_HABILITADA", "1") == "1"
+        hilos = int(env("API_HILOS", "40"))
+        self.limites = {
+            "webhook": int(env("ADMISION_WEBHOOK_LIMITE", "0")),
+            "sg": int(env("ADMISION_SG_LIMITE", "50")),
+            "lectura": int(env("ADMISION_LECTURA_LIMITE", str(max(1, hilos // 4)))),
+        }
+        self.esperas = {
+            "webhook": float(env("ADMISION_WEBHOOK_ESPERA_MS", "5000")) / 1000,
+            "sg": float(env("ADMISION_SG_ESPERA_MS", "500")) / 1000,
+            "lectura": float(env("ADMISION_LECTURA_ESPERA_MS", "1000")) / 1000,
+        }
+
+
+def clasificar(metodo: str, path: str) -> Optional[str]:
+    """Clase de la ruta, o None si no pasa por admisión (salud, admin, streams, docs)."""
+    if path.startswith("/transacciones"):
+        return "webhook" if metodo == "POST" else "lectura"
+    if path.startswith("/sg/"):
+        return "sg"
+    if path.startswith("/reportes"):
+        return "lectura"
+    return None
+
+
+# =========
+# Presupuesto de una clase (un event loop por proceso: sin locks)
+# =========
+class Presupuesto:
+    """
+    Semáforo FIFO con plazo. Si el lugar en la cola haría esperar más que
+    `espera_max` (estimado con el promedio móvil de duración de los requests
+    de la clase) se rechaza enseguida, sin ocupar memoria ni conexiones; si la
+    estimación falla y el plazo vence en la cola, se rechaza igual.
+    """
+
+    def __init__(self, limite: int, espera_max: float):
+        self.limite = limite
+        self.espera_max = espera_max
+        self.en_curso = 0
+        self._cola: Deque[asyncio.Future] = deque()
+        self._duracion: Optional[float] = None  # EWMA en segundos
+        self.admitidos = 0
+        self.rechazados = 0
+
+    def espera_estimada(self) -> float:
+        if self._duracion is None:
+            return 0.0
+        return math.ceil((len(self._cola) + 1) / self.limite) * self._duracion
+
+    async def entrar(self) -> Optional[float]:
+        """None = admitido (llamar a `salir`); si no, segundos sugeridos para Retry-After."""
+        if self.limite <= 0 or (self.en_curso < self.limite and not self._cola):
+            self.en_curso += 1
+            self.admitidos += 1
+            return None
+        estimada = self.espera_estimada()
+        if estimada > self.espera_max:
+            self.rechazados += 1
+            return estimada
+        futuro = asyncio.get_running_loop().create_future()
+        self._cola.append(futuro)
+        try:
+            await asyncio.wait_for(futuro, self.espera_max)
+        except asyncio.TimeoutError:
+            self.rechazados += 1
+            return max(estimada, self.espera_max)
+        except asyncio.CancelledError:
+            # Cliente desconectado: si ya le habían pasado el lugar, se devuelve
+            if futuro.done() and not futuro.cancelled():
+                self.salir(None)
+            raise
+        finally:
+            if futuro in self._cola:
+                self._cola.remove(futuro)
+        self.admitidos += 1
+        return None
+
+    def salir(self, duracion: Optional[float]) -> None:
+        if duracion is not None:
+            self._duracion = duracion if self._duracion is None else 0.8 * self._duracion + 0.2 * duracion
+        if self.limite <= 0:
+            self.en_curso -= 1
+            return
+        # El lugar pasa directo al primero de la cola (en_curso no cambia)
+        while self._cola:
+            futuro = self._cola.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.en_curso -= 1
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            "limite": self.limite,
+            "en_curso": self.en_curso,
+            "en_cola": len(self._cola),
+            "duracion_ms": round(self._duracion * 1000, 1) if self._duracion is not None else None,
+            "admitidos": self.admitidos,
+            "rechazados": self.rechazados,
+        }
+
+
+class ControlAdmision:
+    def __init__(self, cfg: AdmisionConfig):
+        self.habilitada = cfg.habilitada
+        self.presupuestos = {c: Presupuesto(cfg.limites[c], cfg.esperas[c]) for c in cfg.limites}
+
+    def resumen(self) -> Dict[str, Any]:
+        return {"habilitada": self.habilitada, **{c: p.resumen() for c, p in self.presupuestos.items()}}
+
+
+_control: Optional[ControlAdmision] = None
+
+
+def get_admision() -> ControlAdmision:
+    global _control
+    if _control is None:
+        _control = ControlAdmision(AdmisionConfig())
+    return _control
+
+
+# =========
+# Middleware ASGI
+# =========
+class AdmisionMiddleware:
+    """
+    Antes de la firma, Pydantic y la sesión de BD: un request de clase
+    saturada se corta con 503 + Retry-After sin consumir hilos ni conexiones.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        control = get_admision()
+        clase = clasificar(scope["method"], scope["path"]) if control.habilitada else None
+        if clase is None:
+            await self.app(scope, receive, send)
+            return
+        presupuesto = control.presupuestos[clase]
+        reintentar = await presupuesto.entrar()
+        if reintentar is not None:
+            respuesta = JSONResponse(
+                {"status": "error", "mensaje": f"Servicio saturado ({clase}), reintentar"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(reintentar)))},
+            )
+            await respuesta(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            presupuesto.salir(time.perf_counter() - t0)
@@ -0,0 +1,151 @@
+# archivo.py
+import os
+import csv
+import gzip
+import logging
+from datetime import datetime
+from typing import Dict, Iterator, Tuple
+
+from sqlalchemy import text
+
+from app.database import get_engine
+
+# Columnas de transacciones_agilpagos en el orden en que se exportan
+COLUMNAS = (
+    "id_transaccion", "tipo", "numero_cuenta", "importe",
+    "fecha_operacion", "cvu", "observaciones", "fecha_registro",
+    "id_transaccion_anulada", "id_transaccion_originante", "estado",
+)
+
+
+def _meses(desde: datetime, hasta: datetime) -> Iterator[Tuple[datetime, datetime]]:
+    """Rangos [inicio, fin) mes a mes entre desde y hasta."""
+    inicio = desde.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while inicio < hasta:
+        fin = inicio.replace(year=inicio.year + 1, month=1) if inicio.month == 12 else inicio.replace(month=inicio.month + 1)
+        yield inicio, min(fin, hasta)
+        inicio = fin
+
+
+def mantener_particiones(meses_adelante: int = 3) -> None:
+    """Crea los límites de partición de los próximos meses (scriptPARTICIONADO.sql)."""
+    with get_engine().begin() as conn:
+        conn.execute(text("EXEC dbo.usp_agilpagos_mantener_particiones @meses_adelante = :m"), {"m": meses_adelante})
+
+
+def archivar_en_tabla(hasta: datetime, lote: int = 50000) -> int:
+    """
+    Mueve todo lo anterior a `hasta` a transacciones_agilpagos_archivo
+    (DELETE ... OUTPUT INTO por lotes dentro del servidor, sin pasar filas por Python).
+    En AUTOCOMMIT: cada DELETE TOP(@lote) del procedimiento confirma solo, sin
+    una transacción externa que retenga locks y log hasta el final (y que ante
+    un error tardío deshaga todo lo ya movido).
+    """
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        fila = conn.execute(
+            text("EXEC dbo.usp_agilpagos_archivar @hasta = :hasta, @lote = :lote"),
+            {"hasta": hasta, "lote": lote},
+        ).first()
+    return int(fila[0]) if fila else 0
+
+
+class ArchivoInconsistente(RuntimeError):
+    """El archivo exportado no coincide con lo que se iba a borrar: se hace rollback."""
+
+
+def _contar_filas(nombre: str) -> int:
+    """Relee el .csv.gz ya cerrado (valida que esté completo y se pueda descomprimir)."""
+    with gzip.open(nombre, "rt", encoding="utf-8", newline="") as f:
+        return sum(1 for _ in csv.reader(f)) - 1
+
+
+def archivar_en_archivos(hasta: datetime, directorio: str, lote: int = 50000) -> Dict[str, int]:
+    """
+    Exporta mes a mes a CSV comprimido (transacciones_YYYY-MM.csv.gz). Por mes,
+    en una sola transacción:
+      1. fija en #archivar los ids (y el estado) de las filas a archivar
+      2. exporta exactamente esas filas y relee el archivo para verificarlo
+      3. borra por esos ids (y el mismo estado) en lotes
+    Si el archivo no verifica o se borra una cantidad distinta de la exportada
+    se hace rollback (nada se pierde) y se levanta ArchivoInconsistente.
+    Devuelve {archivo: filas}.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    engine = get_engine()
+    resultado: Dict[str, int] = {}
+
+    with engine.connect() as conn:
+        # corte: sólo se exporta/borra lo registrado antes de empezar, así una
+        # notificación tardía que entra durante el proceso no se borra sin exportar
+        primera, corte = conn.execute(
+            text("SELECT MIN(fecha_operacion), GETDATE() FROM transacciones_agilpagos WHERE fecha_operacion < :hasta"),
+            {"hasta": hasta},
+        ).one()
+    if primera is None:
+        return resultado
+
+    for inicio, fin in _meses(primera, hasta):
+        nombre = os.path.join(directorio, f"transacciones_{inicio:%Y-%m}.csv.gz")
+        if os.path.exists(nombre):
+            # Nunca se pisa un archivo ya exportado: se agrega una parte nueva
+            nombre = nombre.replace(".csv.gz", f"_{datetime.now():%Y%m%d%H%M%S}.csv.gz")
+
+        with engine.connect() as conn, conn.begin() as tx:
+            conn.execute(
+                text(
+                    "SELECT id_transaccion, estado INTO #archivar FROM transacciones_agilpagos "
+                    "WHERE fecha_operacion >= :inicio AND fecha_operacion < :fin AND fecha_registro <= :corte"
+                ),
+                {"inicio": inicio, "fin": fin, "corte": corte},
+            )
+            filas = conn.execute(text("SELECT COUNT(*) FROM #archivar")).scalar()
+            if not filas:
+                tx.rollback()
+                continue
+            conn.execute(text("CREATE UNIQUE CLUSTERED INDEX IX_archivar ON #archivar (id_transaccion)"))
+
+            exportadas = 0
+            cursor = conn.execution_options(stream_results=True, yield_per=lote).execute(
+                text(
+                    f"SELECT {', '.join('t.' + c for c in COLUMNAS)} FROM transacciones_agilpagos t "
+                    "JOIN #archivar a ON a.id_transaccion = t.id_transaccion"
+                )
+            )
+            # Se escribe a .tmp y se renombra recién con el commit hecho: un corte a
+            # mitad de camino no deja un archivo que parezca completo
+            parcial = nombre + ".tmp"
+            with gzip.open(parcial, "wt", encoding="utf-8", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(COLUMNAS)
+                for fila in cursor:
+                    w.writerow(fila)
+                    exportadas += 1
+            if exportadas != filas or _contar_filas(parcial) != filas:
+                tx.rollback()
+                os.remove(parcial)
+                raise ArchivoInconsistente(f"{nombre}: {filas} filas a archivar, {exportadas} exportadas")
+
+            # Borrado por lotes de esas mismas filas; una que cambió de estado
+            # (reversa) después de exportarse no coincide y fuerza el rollback
+            borradas = 0
+            while True:
+                n = conn.execute(
+                    text(
+                        "DELETE TOP (:lote) t FROM transacciones_agilpagos t "
+                        "JOIN #archivar a ON a.id_transaccion = t.id_transaccion AND a.estado = t.estado"
+                    ),
+                    {"lote": lote},
+                ).rowcount
+                borradas += n
+                if n < lote:
+                    break
+            if borradas != filas:
+                tx.rollback()
+                os.remove(parcial)
+                logging.error(f"Archivo {nombre}: exportadas {filas} filas pero se borrarían {borradas} (rollback)")
+                raise ArchivoInconsistente(f"{nombre}: exportadas {filas} filas pero se borrarían {borradas}")
+            conn.execute(text("DROP TABLE #archivar"))
+        os.replace(parcial, nombre)
+        resultado[nombre] = filas
+
+    return resultado
@@ -1,25 +1,14 @@
 # auth_sg.py
-import os
 import base64
 import hashlib
 import uuid
-import asyncio
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional
 
 import httpx
 
-# =========
-# Config
-# =========
-SG_BASE_URL      = os.getenv("SG_BASE_URL", "").rstrip("/")  
-SG_USER_NAME     = os.getenv("SG_USER_NAME", "") 
-SG_PASSWORD      = os.getenv("SG_PASSWORD", "") 
-SG_ID_ENTIDAD    = os.getenv("SG_ID_ENTIDAD", "") 
-SG_LOGIN_PATH    = os.getenv("SG_LOGIN_PATH", "/Account/Login")
-
-# Tiempo de seguridad para renovar el token antes de su vencimiento (en segundos)
-TOKEN_RENEW_LEEWAY = int(os.getenv("SG_TOKEN_RENEW_LEEWAY", "300"))  # 5 minutos
+# SGConfig/sg_config viven en entidades.py (defaults de cada entidad); se re-exportan acá
+from app.entidades import SGConfig, sg_config, get_registro, cerrar_registro, EstadoEntidad
 
 # =========
 # Utilidades digest 
@@ -45,64 +34,50 @@ def password_digest_b64(nonce_b64: str, created_iso_z: str, raw_password: str) -
     return base64.b64encode(sha1).decode("utf-8")
 
 # =========
-# Cache de token en memoria (por Entidad)
+# Recursos (pool, cupo y token viven por entidad en entidades.py)
 # =========
-class TokenCacheItem:
-    def __init__(self, token: str, expires_at: datetime):
-        self.token = token
-        self.expires_at = expires_at
-
-class TokenCache:
-    def __init__(self):
-        self._lock = asyncio.Lock()
-        self._items: Dict[str, TokenCacheItem] = {}  # key = id_entidad
-
-    async def get_valid(self, entidad_id: str) -> Optional[str]:
-        async with self._lock:
-            item = self._items.get(entidad_id)
-            if not item:
-                return None
-            # renovar si está por vencer
-            now = datetime.now(timezone.utc)
-            if item.expires_at <= now + timedelta(seconds=TOKEN_RENEW_LEEWAY):
-                return None
-            return item.token
-
-    async def set(self, entidad_id: str, token: str, expires_at: datetime) -> None:
-        async with self._lock:
-            self._items[entidad_id] = TokenCacheItem(token, expires_at)
-
-token_cache = TokenCache()
+async def cerrar_recursos_sg() -> None:
+    """Se llama en el shutdown del lifespan: cierra el pool de cada entidad."""
+    await cerrar_registro()
 
 # =========
 # Login a SG (Account/Login)
 # =========
-async def _login_sg(entidad_id: str) -> Dict:
+async def _login_sg(estado: EstadoEntidad) -> Dict:
     """
-    Llama a Account/Login y devuelve el json completo para que el caller lo procese.
+    Llama a Account/Login con las credenciales de la entidad y devuelve el json
+    completo para que el caller lo procese.
     """
-    if not (SG_BASE_URL and SG_USER_NAME and SG_PASSWORD and entidad_id):
-        raise RuntimeError("Faltan variables de entorno SG_BASE_URL, SG_USER_NAME, SG_PASSWORD o entidad_id")
+    cfg = estado.cfg
+    if not (cfg.base_url and cfg.user_name and cfg.password and cfg.id_entidad):
+        raise RuntimeError(f"Entidad {cfg.id_entidad}: faltan base_url, user_name o password (SG_BASE_URL, SG_USER_NAME, SG_PASSWORD)")
 
     created = ahora_utc_iso_z()
     nonce   = nonce_base64()
-    pwd_enc = password_digest_b64(nonce, created, SG_PASSWORD)
+    pwd_enc = password_digest_b64(nonce, created, cfg.password)
 
     payload = {
-        "userName":  SG_USER_NAME,
+        "userName":  cfg.user_name,
         "password":  pwd_enc,
         "nonce":     nonce,
         "created":   created,
-        "idEntidad": entidad_id,
+        "idEntidad": cfg.id_entidad,
     }
 
-    url = f"{SG_BASE_URL}{SG_LOGIN_PATH}"
     timeout = httpx.Timeout(15.0, connect=10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        resp = await client.post(url, json=payload)
-        # Si SG usa status diferentes a 200 para errores de credenciales, con esto te enterás
-        resp.raise_for_status()
-        return resp.json()
+    resp = await estado.pedir("POST", cfg.login_path, json=payload, timeout=timeout)
+    # Si SG usa status diferentes a 200 para errores de credenciales, con esto te enterás
+    resp.raise_for_status()
+    return resp.json()
+
+def _token_vigente(estado: EstadoEntidad) -> Optional[str]:
+    if not estado.token or estado.vence is None:
+        return None
+    # renovar si está por vencer
+    now = datetime.now(timezone.utc)
+    if estado.vence <= now + timedelta(seconds=sg_config().token_renew_leeway):
+        return None
+    return estado.token
 
 # =========
 # Obtener/renovar token
@@ -111,18 +86,23 @@ async def get_or_refresh_token(entidad_id: Optional[str] = None) -> str:
     if entidad_id is not None and not isinstance(entidad_id, str):
         entidad_id = None
 
-    entidad_id = entidad_id or SG_ID_ENTIDAD
-    if not entidad_id:
-        raise RuntimeError("SG_ID_ENTIDAD no definido y no se pasó entidad_id")
+    estado = get_registro().estado(entidad_id)
 
-    # 1) cache hit
-    cached = await token_cache.get_valid(entidad_id)
+    # 1) cache hit (sin lock)
+    cached = _token_vigente(estado)
     if cached:
         return cached
 
-    # 2) login
-    data = await _login_sg(entidad_id)
+    # 2) login: single-flight por entidad; el resto espera y reusa el token
+    async with estado.login_lock:
+        cached = _token_vigente(estado)
+        if cached:
+            return cached
+        data = await _login_sg(estado)
+        return _guardar_token(estado, data)
+
 
+def _guardar_token(estado: EstadoEntidad, data: Dict) -> str:
     # *** OJO ***
     # La respuesta exacta de SG puede variar. Ajustar aquí los nombres
     access_token = (
@@ -161,7 +141,7 @@ async def get_or_refresh_token(entidad_id: Optional[str] = None) -> str:
     else:
         expires_at = now + timedelta(minutes=50)
 
-    await token_cache.set(entidad_id, access_token, expires_at)
+    estado.token, estado.vence = access_token, expires_at
     return access_token
 
 
@@ -178,12 +158,8 @@ async def login_debug(entidad_id: Optional[str] = None, force_refresh: bool = Tr
     Fuerza login a SG y devuelve un resumen seguro (sin exponer el token completo).
     Útil para smoke test del Account/Login.
     """
-    ent = entidad_id or SG_ID_ENTIDAD
-    if not ent:
-        raise RuntimeError("Falta SG_ID_ENTIDAD o entidad_id")
-
     # llamamos al login "crudo" para ver la respuesta tal cual
-    data = await _login_sg(ent)
+    data = await _login_sg(get_registro().estado(entidad_id))
 
     # normalizamos campos comunes sin depender de nombres exactos
     access_token = data.get("accessToken") or data.get("token") or data.get("bearerToken")
@@ -207,25 +183,21 @@ def _iso_z(dt: datetime) -> str:
 
 # Método de introspección del cache
 async def cache_status(entidad_id: Optional[str] = None) -> dict:
-    ent = entidad_id or SG_ID_ENTIDAD
-    if not ent:
-        raise RuntimeError("Falta SG_ID_ENTIDAD o entidad_id")
-    async with token_cache._lock:  # uso interno, OK
-        item = token_cache._items.get(ent)
-        if not item:
-            return {"exists": False, "entidad_id": ent}
-        now = datetime.now(timezone.utc)
-        return {
-            "exists": True,
-            "entidad_id": ent,
-            "expires_at": _iso_z(item.expires_at),
-            "seconds_left": int((item.expires_at - now).total_seconds())
-        }
+    estado = get_registro().estado(entidad_id)
+    ent = estado.cfg.id_entidad
+    if not estado.token or estado.vence is None:
+        return {"exists": False, "entidad_id": ent}
+    now = datetime.now(timezone.utc)
+    return {
+        "exists": True,
+        "entidad_id": ent,
+        "expires_at": _iso_z(estado.vence),
+        "seconds_left": int((estado.vence - now).total_seconds())
+    }
 
 # Opcional: mejorar el /sg/auth/test para mostrar "expiration" si existe
 async def login_debug(entidad_id: Optional[str] = None, force_refresh: bool = True) -> dict:
-    ent = entidad_id or SG_ID_ENTIDAD
-    data = await _login_sg(ent)
+    data = await _login_sg(get_registro().estado(entidad_id))
     access_token = data.get("accessToken") or data.get("token") or data.get("bearerToken")
     return {
         "ok": bool(access_token),
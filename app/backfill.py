@@ -0,0 +1,334 @@
+# backfill.py
+import os
+import csv
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.config import env
+from app.ingesta import FilaInvalida, validar_columnas
+from app.schemas import TransaccionNotificada
+
+# =========
+# Config (lazy)
+# =========
+class BackfillConfig:
+    def __init__(self):
+        self.lote = int(env("BACKFILL_LOTE", "20000"))
+        self.procesos = int(env("BACKFILL_PROCESOS", str(max(1, (os.cpu_count() or 2) - 1))))
+        self.checkpoint = env("BACKFILL_CHECKPOINT", "backfill.checkpoint.json")
+
+
+# =========
+# Lectura en streaming: un "item" por notificación, sin parsear todavía
+# (el JSON se decodifica en los procesos de validación)
+# =========
+# Campos anidados de TransaccionNotificada: en CSV vienen como texto JSON
+CAMPOS_JSON_CSV = ("transaccionCuentaContraparte", "impuestos")
+
+
+def _items_json(path: str, bloque: int = 1 << 20) -> Iterator[Any]:
+    """Array JSON top-level decodificado de a un elemento (sin cargar el archivo entero)."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer, pos, inicio = "", 0, False
+        while True:
+            leido = f.read(bloque)
+            buffer = buffer[pos:] + leido
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if not inicio:
+                    if pos == len(buffer):
+                        break
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{path}: se esperaba un array JSON")
+                    inicio, pos = True, pos + 1
+                    continue
+                if pos < len(buffer) and buffer[pos] == "]":
+                    return
+                try:
+                    item, fin = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not leido:
+                        raise
+                    break  # elemento cortado: falta leer más
+                yield item
+                pos = fin
+            if not leido:
+                return
+
+
+def formato_de(path: str) -> str:
+    formato = os.path.splitext(path)[1].lower().lstrip(".")
+    if formato not in ("json", "jsonl", "csv"):
+        raise ValueError(f"{path}: formato no soportado (.json, .jsonl o .csv)")
+    return formato
+
+
+def leer_items(path: str) -> Iterator[Any]:
+    formato = formato_de(path)
+    if formato == "jsonl":
+        with open(path, "r", encoding="utf-8-sig") as f:
+            for linea in f:
+                if linea.strip():
+                    yield linea
+    elif formato == "csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        yield from _items_json(path)
+
+
+def _normalizar(item: Any, formato: str) -> Any:
+    if formato == "jsonl":
+        return json.loads(item)
+    if formato == "csv":
+        # Columnas con los nombres del JSON; vacío = null, anidados como texto JSON
+        fila = {k: (v if v != "" else None) for k, v in item.items()}
+        for campo in CAMPOS_JSON_CSV:
+            if fila.get(campo) is not None:
+                fila[campo] = json.loads(fila[campo])
+        return fila
+    return item
+
+
+# =========
+# Validación (corre en procesos aparte: Pydantic es CPU y el GIL no deja
+# escalar con hilos)
+# =========
+def validar_bloque(items: List[Any], formato: str) -> Tuple[List[tuple], List[Dict[str, Any]]]:
+    """Mismo schema y prevalidación que el webhook. Devuelve (filas, rechazos)."""
+    filas, rechazos = [], []
+    for item in items:
+        try:
+            item = _normalizar(item, formato)
+            data = TransaccionNotificada.model_validate(item)
+            fecha = validar_columnas(data)
+        except (ValidationError, FilaInvalida, ValueError, TypeError) as e:
+            rechazos.append({
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "id": item.get("idTransaccion") if isinstance(item, dict) else None,
+                "clase": type(e).__name__,
+                "error": str(e)[:500],
+                "payload": item,
+            })
+            continue
+        filas.append((
+            data.idTransaccion, data.idTipoTransaccion, data.numeroCuenta, data.importe, fecha,
+            data.cvu, data.observaciones, data.idTransaccionAnulada, data.idTransaccionOriginante,
+        ))
+    return filas, rechazos
+
+
+# =========
+# Carga en SQL Server: staging + MERGE
+# =========
+COLUMNAS_STAGING = (
+    "id_transaccion", "tipo", "numero_cuenta", "importe", "fecha_operacion",
+    "cvu", "observaciones", "id_transaccion_anulada", "id_transaccion_originante",
+)
+
+CREAR_STAGING = """
+IF OBJECT_ID('tempdb..#backfill') IS NULL
+    CREATE TABLE #backfill (
+        id_transaccion varchar(50) NOT NULL PRIMARY KEY,
+        tipo int NOT NULL,
+        numero_cuenta varchar(50) NOT NULL,
+        importe decimal(18, 2) NOT NULL,
+        fecha_operacion datetime NOT NULL,
+        cvu varchar(50) NOT NULL,
+        observaciones varchar(50) NOT NULL,
+        id_transaccion_anulada varchar(50) NULL,
+        id_transaccion_originante varchar(50) NULL
+    )
+"""
+
+# HOLDLOCK: la API puede estar insertando los mismos ids al mismo tiempo
+# Todo el lote comparte fecha_registro; las notificaciones no dependen de eso:
+# cada fila del MERGE recibe su propia rowversion (cursor de app/notificaciones.py)
+# y las colas de los workers las publican al confirmarse el commit.
+MERGE_STAGING = f"""
+MERGE transacciones_agilpagos WITH (HOLDLOCK) AS t
+USING #backfill AS s ON t.id_transaccion = s.id_transaccion
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT ({", ".join(COLUMNAS_STAGING)}, fecha_registro, estado)
+    VALUES ({", ".join("s." + c for c in COLUMNAS_STAGING)}, ?, 'registrada');
+"""
+
+# Reversas en bloque: originales anulados por una reversa del lote, y filas
+# del lote cuya reversa ya estaba en la tabla (mismo criterio que vincular_reversa)
+ANULAR_STAGING = """
+UPDATE t SET estado = 'anulada'
+FROM transacciones_agilpagos t
+WHERE t.estado <> 'anulada' AND (
+    t.id_transaccion IN (SELECT id_transaccion_anulada FROM #backfill WHERE id_transaccion_anulada IS NOT NULL)
+    OR (t.id_transaccion IN (SELECT id_transaccion FROM #backfill)
+        AND EXISTS (SELECT 1 FROM transacciones_agilpagos r WHERE r.id_transaccion_anulada = t.id_transaccion))
+);
+"""
+
+
+class CargadorSQLServer:
+    """
+    Una conexión pyodbc dedicada: INSERT a #backfill con fast_executemany
+    (un solo round trip por lote de parámetros) y MERGE set-based a la tabla.
+    Cada lote es una transacción; repetir un lote es inocuo (NOT MATCHED).
+    """
+
+    def __init__(self):
+        import pyodbc
+        from app.database import get_engine
+
+        self._pyodbc = pyodbc
+        self.conn = get_engine().raw_connection()
+        cursor = self.conn.cursor()
+        cursor.execute(CREAR_STAGING)
+        self.conn.commit()
+
+    def cargar(self, filas: List[tuple]) -> int:
+        """Devuelve cuántas filas eran nuevas."""
+        pyodbc = self._pyodbc
+        # Un id repetido dentro del lote rompería la PK de staging: queda el primero
+        unicas = list({f[0]: f for f in reversed(filas)}.values())
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("TRUNCATE TABLE #backfill")
+            cursor.fast_executemany = True
+            # Tamaños explícitos: sin esto pyodbc manda nvarchar(max) y el insert pierde el modo bulk
+            varchar = (pyodbc.SQL_VARCHAR, 50, 0)
+            cursor.setinputsizes([
+                varchar, (pyodbc.SQL_INTEGER, 0, 0), varchar, (pyodbc.SQL_DECIMAL, 18, 2),
+                (pyodbc.SQL_TYPE_TIMESTAMP, 23, 3), varchar, varchar, varchar, varchar,
+            ])
+            cursor.executemany(
+                f"INSERT INTO #backfill ({', '.join(COLUMNAS_STAGING)}) VALUES ({', '.join('?' * len(COLUMNAS_STAGING))})",
+                unicas,
+            )
+            cursor.close()
+            cursor = self.conn.cursor()
+            cursor.execute(MERGE_STAGING, datetime.now())
+            nuevas = cursor.rowcount
+            cursor.execute(ANULAR_STAGING)
+            self.conn.commit()
+            return nuevas
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def cerrar(self) -> None:
+        self.conn.close()
+
+
+# =========
+# Checkpoint: cuántos items de cada archivo ya quedaron commiteados
+# =========
+def leer_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _guardar_checkpoint(path: str, estado: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _bloques(items: Iterator[Any], tamanio: int, saltar: int) -> Iterator[List[Any]]:
+    bloque = []
+    for i, item in enumerate(items):
+        if i < saltar:
+            continue
+        bloque.append(item)
+        if len(bloque) >= tamanio:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+# =========
+# Importación
+# =========
+def importar(
+    archivos: List[str],
+    cfg: Optional[BackfillConfig] = None,
+    simular: bool = False,
+    progreso: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Lee -> valida en `procesos` procesos (hasta 2 bloques por proceso en vuelo,
+    memoria acotada) -> carga los lotes en orden en una sola conexión. La
+    validación del bloque siguiente se solapa con el MERGE del actual. El
+    checkpoint avanza recién con el commit, así que cortar y volver a correr
+    retoma desde el último lote confirmado. Los rechazos van al dead-letter
+    (reprocesables con reprocesar_deadletter una vez corregidos).
+    """
+    from app.ingesta import get_deadletter
+
+    cfg = cfg or BackfillConfig()
+    checkpoint = leer_checkpoint(cfg.checkpoint) if not simular else {}
+    cargador = None if simular else CargadorSQLServer()
+    deadletter = get_deadletter()
+    stats = {"leidas": 0, "validas": 0, "nuevas": 0, "rechazadas": 0}
+    t0 = time.perf_counter()
+
+    def procesar(clave: str, procesadas: int, resultado: Tuple[List[tuple], List[Dict[str, Any]]], n: int) -> int:
+        filas, rechazos = resultado
+        if filas and cargador is not None:
+            stats["nuevas"] += cargador.cargar(filas)
+        for rechazo in rechazos if not simular else ():
+            deadletter.escribir(rechazo)
+        stats["leidas"] += n
+        stats["validas"] += len(filas)
+        stats["rechazadas"] += len(rechazos)
+        procesadas += n
+        if not simular:
+            checkpoint[clave] = {"procesadas": procesadas, "terminado": False}
+            _guardar_checkpoint(cfg.checkpoint, checkpoint)
+        if progreso:
+            segundos = time.perf_counter() - t0
+            progreso({**stats, "archivo": clave, "segundos": round(segundos, 1),
+                      "filas_por_seg": int(stats["leidas"] / segundos) if segundos else 0})
+        return procesadas
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, cfg.procesos)) as pool:
+            for archivo in archivos:
+                clave = os.path.abspath(archivo)
+                previo = checkpoint.get(clave, {})
+                if previo.get("terminado"):
+                    continue
+                procesadas = previo.get("procesadas", 0)
+                formato = formato_de(archivo)
+                en_vuelo = deque()
+                for bloque in _bloques(leer_items(archivo), cfg.lote, procesadas):
+                    en_vuelo.append((pool.submit(validar_bloque, bloque, formato), len(bloque)))
+                    if len(en_vuelo) >= 2 * cfg.procesos:
+                        futuro, n = en_vuelo.popleft()
+                        procesadas = procesar(clave, procesadas, futuro.result(), n)
+                while en_vuelo:
+                    futuro, n = en_vuelo.popleft()
+                    procesadas = procesar(clave, procesadas, futuro.result(), n)
+                if not simular:
+                    checkpoint[clave] = {"procesadas": procesadas, "terminado": True}
+                    _guardar_checkpoint(cfg.checkpoint, checkpoint)
+    finally:
+        if cargador is not None:
+            cargador.cerrar()
+
+    segundos = time.perf_counter() - t0
+    return {**stats, "segundos": round(segundos, 2),
+            "filas_por_seg": int(stats["leidas"] / segundos) if segundos else 0}
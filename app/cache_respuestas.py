@@ -0,0 +1,128 @@
+# cache_respuestas.py
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from app.config import env
+
+
+class Entrada:
+    __slots__ = ("etag", "cuerpo", "cache_control", "vence", "cuenta", "rango", "ids")
+
+    def __init__(self, etag: str, cuerpo: bytes, cache_control: str, vence: float,
+                 cuenta: Optional[str], rango: Optional[Tuple[datetime, datetime]], ids: Set[str]):
+        self.etag = etag
+        self.cuerpo = cuerpo
+        self.cache_control = cache_control
+        self.vence = vence
+        self.cuenta = cuenta
+        self.rango = rango
+        self.ids = ids
+
+
+def calcular_etag(cuerpo: bytes) -> str:
+    # ETag fuerte: hash del JSON exacto que se devuelve
+    return '"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+
+class CacheRespuestas:
+    """
+    LRU en memoria de respuestas ya serializadas (bytes + ETag), por proceso.
+    Los endpoints de consulta son sync (threadpool) y el webhook invalida desde
+    otro hilo, por eso todo va bajo un threading.Lock.
+    Invalidación: por idTransaccion, y por cuenta/fecha_operacion para las
+    consultas por ventana. Con varios workers cada uno tiene su LRU: el alta
+    invalida enseguida en el worker que la registró y la cola de
+    notificaciones (app/notificaciones.py) invalida en los demás, y también lo
+    que commitean el reproceso o el backfill, a los NOTIF_POLL_MS (o a los
+    NOTIF_POLL_INACTIVO_MS si el worker no tiene suscriptores). El TTL
+    acota lo demás (p.ej. la BD sin la columna version).
+    """
+
+    def __init__(self, maximo: int):
+        self._lock = threading.Lock()
+        self._maximo = maximo
+        self._items: "OrderedDict[str, Entrada]" = OrderedDict()
+        self._por_id: Dict[str, Set[str]] = {}
+        self._por_cuenta: Dict[Optional[str], Set[str]] = {}  # None = ventanas sin filtro de cuenta
+
+    def get(self, clave: str) -> Optional[Entrada]:
+        with self._lock:
+            e = self._items.get(clave)
+            if e is None:
+                return None
+            if e.vence < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._items.move_to_end(clave)
+            return e
+
+    def put(self, clave: str, entrada: Entrada) -> None:
+        with self._lock:
+            if clave in self._items:
+                self._quitar(clave)
+            self._items[clave] = entrada
+            for id_tx in entrada.ids:
+                self._por_id.setdefault(id_tx, set()).add(clave)
+            if entrada.rango is not None:
+                self._por_cuenta.setdefault(entrada.cuenta, set()).add(clave)
+            while len(self._items) > self._maximo:
+                self._quitar(next(iter(self._items)))
+
+    def _quitar(self, clave: str) -> None:
+        e = self._items.pop(clave, None)
+        if e is None:
+            return
+        for id_tx in e.ids:
+            claves = self._por_id.get(id_tx)
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_id[id_tx]
+        if e.rango is not None:
+            claves = self._por_cuenta.get(e.cuenta)
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_cuenta[e.cuenta]
+
+    def invalidar(self, cuenta: Optional[str], fecha_operacion: Optional[datetime], ids: Iterable[Optional[str]]) -> None:
+        """Lo llama el webhook después de cada commit."""
+        with self._lock:
+            afectadas: Set[str] = set()
+            for id_tx in ids:
+                if id_tx:
+                    afectadas |= self._por_id.get(id_tx, set())
+            for c in (cuenta, None):
+                for clave in self._por_cuenta.get(c, ()):
+                    desde, hasta = self._items[clave].rango
+                    if fecha_operacion is None or desde <= fecha_operacion < hasta:
+                        afectadas.add(clave)
+            for clave in afectadas:
+                self._quitar(clave)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._por_id.clear()
+            self._por_cuenta.clear()
+
+
+class CacheConfig:
+    def __init__(self):
+        self.maximo     = int(env("CACHE_RESPUESTAS_MAX", "2000"))
+        self.ttl        = int(env("CACHE_TTL_SEGS", "30"))         # entradas que todavía pueden cambiar
+        self.ttl_final  = int(env("CACHE_TTL_FINAL_SEGS", "86400"))  # transacciones en estado final
+
+
+_cache: Optional[CacheRespuestas] = None
+
+
+def get_cache() -> CacheRespuestas:
+    global _cache
+    if _cache is None:
+        _cache = CacheRespuestas(CacheConfig().maximo)
+    return _cache
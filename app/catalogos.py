@@ -0,0 +1,263 @@
+# catalogos.py
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.cache_respuestas import calcular_etag
+from app.config import env
+
+# =========
+# Config (lazy)
+# =========
+class CatalogosConfig:
+    def __init__(self):
+        # Endpoints de referencia de SG (ajustar según el PDF/ambiente, como los de entidades.py)
+        self.endpoints = {
+            "tiposDocumento": env("SG_ENDPOINT_TIPOS_DOCUMENTO", "/Catalogos/TiposDocumento"),   # EJEMPLO de path
+            "tiposPersona": env("SG_ENDPOINT_TIPOS_PERSONA", "/Catalogos/TiposPersona"),         # EJEMPLO de path
+            "tiposCuenta": env("SG_ENDPOINT_TIPOS_CUENTA", "/Catalogos/TiposCuenta"),            # EJEMPLO de path
+        }
+        self.refresco_segs = float(env("SG_CATALOGOS_REFRESCO_SEGS", "3600"))
+        # Entidad sin catálogos (SG caído al arrancar): se reintenta más seguido
+        self.reintento_segs = float(env("SG_CATALOGOS_REINTENTO_SEGS", "60"))
+        self.max_age_segs = int(env("SG_CATALOGOS_MAX_AGE_SEGS", "300"))
+        # Mínimo entre refrescos pedidos en línea (valor que no está en el catálogo, carga perezosa)
+        self.refresco_min_segs = float(env("SG_CATALOGOS_REFRESCO_MIN_SEGS", "30"))
+
+
+# Campo de AltaUsuarioIn -> catálogo que lo valida y default de EntidadConfig
+CAMPOS_ALTA = {
+    "idEntidadTipoDocumento": ("tiposDocumento", "id_doc_dni"),
+    "idTipoPersona": ("tiposPersona", "id_tipo_persona"),
+    "idTipoCuenta": ("tiposCuenta", "id_tipo_cuenta"),
+}
+# Claves posibles del id y la descripción en los items de SG
+CLAVES_ID = ("id", "idEntidadTipoDocumento", "idTipoDocumento", "idTipoPersona", "idTipoCuenta")
+CLAVES_DESCRIPCION = ("descripcion", "nombre", "codigo")
+
+
+class CatalogoInvalido(ValueError):
+    """Un valor de catálogo de AltaUsuarioIn que no existe para la entidad (o falta sin default)."""
+
+
+def _normalizar(items: Any) -> List[Dict[str, Optional[str]]]:
+    if isinstance(items, dict):
+        items = items.get("items") or items.get("data") or []
+    salida = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        id_ = next((item[k] for k in CLAVES_ID if item.get(k)), None)
+        if id_ is None:
+            continue
+        descripcion = next((item[k] for k in CLAVES_DESCRIPCION if item.get(k)), None)
+        salida.append({"id": str(id_), "descripcion": str(descripcion) if descripcion is not None else None})
+    return salida
+
+
+class CatalogosEntidad:
+    """Snapshot inmutable de los catálogos de una entidad (se reemplaza entero al refrescar)."""
+
+    def __init__(self, catalogos: Dict[str, List[Dict[str, Optional[str]]]]):
+        self.catalogos = catalogos
+        self.ids = {nombre: {i["id"].lower() for i in items} for nombre, items in catalogos.items()}
+        self.cargado = datetime.now()
+        self.cargado_t = time.monotonic()
+        self.cuerpo = json.dumps(
+            {"cargado": self.cargado.isoformat(timespec="seconds"), "catalogos": catalogos},
+            ensure_ascii=False, separators=(",", ":"),
+        ).encode("utf-8")
+        self.etag = calcular_etag(json.dumps(catalogos, sort_keys=True).encode("utf-8"))
+
+    def dni(self) -> Optional[str]:
+        """Tipo de documento DNI por descripción (cuando no hay SG_ID_DOC_DNI)."""
+        for item in self.catalogos.get("tiposDocumento", []):
+            if (item["descripcion"] or "").strip().upper() == "DNI":
+                return item["id"]
+        return None
+
+
+# =========
+# Cache (sólo se usa desde el event loop: sin locks)
+# =========
+class CacheCatalogos:
+    """
+    Catálogos de referencia de SG por entidad, en memoria de cada proceso.
+    El líder (app/lider.py) los precarga y refresca cada SG_CATALOGOS_REFRESCO_SEGS;
+    los demás workers los cargan al primer uso y, si lo que tienen es más
+    viejo que eso, lo refrescan en segundo plano mientras siguen sirviéndolo.
+    Un refresco por entidad a la vez (single-flight). Si SG falla se sigue con
+    lo último cargado; sin catálogos (o con uno vacío) la validación local de
+    ese campo se saltea y decide SG.
+    """
+
+    def __init__(self, cfg: CatalogosConfig):
+        self.cfg = cfg
+        self._datos: Dict[str, CatalogosEntidad] = {}
+        self._errores: Dict[str, str] = {}
+        self._proximo: Dict[str, float] = {}
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._ultimo_pedido: Dict[str, float] = {}
+        self._tarea: Optional[asyncio.Task] = None
+
+    def get(self, entidad_id: str) -> Optional[CatalogosEntidad]:
+        return self._datos.get(entidad_id)
+
+    async def _cargar(self, entidad_id: str) -> CatalogosEntidad:
+        from app.auth_sg import get_or_refresh_token
+        from app.entidades import get_registro, json_de
+
+        estado = get_registro().estado(entidad_id)
+        headers = {"Authorization": f"Bearer {await get_or_refresh_token(estado.cfg.id_entidad)}"}
+
+        async def uno(path: str) -> List[Dict[str, Optional[str]]]:
+            r = await estado.pedir("GET", path, headers=headers, timeout=30)
+            r.raise_for_status()
+            return _normalizar(await json_de(r))
+
+        nombres = list(self.cfg.endpoints)
+        try:
+            listas = await asyncio.gather(*(uno(self.cfg.endpoints[n]) for n in nombres))
+        except Exception as e:
+            self._errores[entidad_id] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        datos = CatalogosEntidad(dict(zip(nombres, listas)))
+        self._datos[entidad_id] = datos
+        self._errores.pop(entidad_id, None)
+        return datos
+
+    def _iniciar_refresco(self, ent: str) -> asyncio.Task:
+        tarea = self._en_curso.get(ent)
+        if tarea is None:
+            tarea = self._en_curso[ent] = asyncio.create_task(self._cargar(ent))
+            self._ultimo_pedido[ent] = time.monotonic()
+
+            def fin(t: asyncio.Task) -> None:
+                if self._en_curso.get(ent) is t:
+                    del self._en_curso[ent]
+                if not t.cancelled() and t.exception() is not None:
+                    logging.error(f"No se pudieron cargar los catálogos SG de {ent}: {t.exception()}")
+
+            tarea.add_done_callback(fin)
+        return tarea
+
+    async def refrescar(self, entidad_id: str) -> CatalogosEntidad:
+        """Pide los catálogos a SG; los pedidos concurrentes de la misma entidad esperan el mismo."""
+        from app.entidades import get_registro
+
+        ent = get_registro().estado(entidad_id).cfg.id_entidad
+        return await asyncio.shield(self._iniciar_refresco(ent))
+
+    def _puede_pedir(self, entidad_id: str) -> bool:
+        return time.monotonic() - self._ultimo_pedido.get(entidad_id, float("-inf")) >= self.cfg.refresco_min_segs
+
+    async def obtener(self, entidad_id: str) -> Optional[CatalogosEntidad]:
+        """
+        Catálogos para usar en un request. Sin carga previa se pide en línea
+        (a lo sumo cada SG_CATALOGOS_REFRESCO_MIN_SEGS si SG falla); vencidos se
+        devuelven igual y se refrescan en segundo plano.
+        """
+        datos = self._datos.get(entidad_id)
+        if datos is None:
+            if entidad_id not in self._en_curso and not self._puede_pedir(entidad_id):
+                return None
+            try:
+                return await self.refrescar(entidad_id)
+            except Exception:
+                return None  # ya quedó en el log y en resumen()
+        if time.monotonic() - datos.cargado_t >= self.cfg.refresco_segs and self._puede_pedir(entidad_id):
+            self._iniciar_refresco(entidad_id)
+        return datos
+
+    async def _refrescar_vencidas(self) -> None:
+        from app.entidades import get_registro
+
+        ahora = time.monotonic()
+        for entidad_id in get_registro().configuradas():
+            if self._proximo.get(entidad_id, 0) > ahora:
+                continue
+            try:
+                await self.refrescar(entidad_id)
+                self._proximo[entidad_id] = ahora + self.cfg.refresco_segs
+            except Exception:
+                self._proximo[entidad_id] = ahora + self.cfg.reintento_segs
+
+    async def _ciclo(self) -> None:
+        while True:
+            await self._refrescar_vencidas()
+            await asyncio.sleep(min(self.cfg.reintento_segs, self.cfg.refresco_segs))
+
+    def iniciar(self) -> None:
+        """Refresco periódico: job único del proceso líder (ver app/lider.py)."""
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    @staticmethod
+    def _validar(entidad_cfg, datos: Optional[CatalogosEntidad], valores: Dict[str, Optional[str]]):
+        """(resueltos, errores, hay valores que no figuran en el catálogo)."""
+        resueltos, errores, inexistentes = {}, [], False
+        for campo, (catalogo, atributo) in CAMPOS_ALTA.items():
+            valor = valores.get(campo) or getattr(entidad_cfg, atributo)
+            if not valor and campo == "idEntidadTipoDocumento" and datos is not None:
+                valor = datos.dni()
+            if not valor:
+                errores.append(f"{campo}: falta (no vino en el body y la entidad no tiene default)")
+                continue
+            ids = datos.ids.get(catalogo) if datos is not None else None
+            # Catálogo vacío (SG devolvió [] o un formato que _normalizar no reconoce): no se valida
+            if ids and valor.lower() not in ids:
+                errores.append(f"{campo}: {valor} no existe en {catalogo} de la entidad")
+                inexistentes = True
+                continue
+            resueltos[campo] = valor
+        return resueltos, errores, inexistentes
+
+    async def resolver_alta(self, entidad_cfg, valores: Dict[str, Optional[str]]) -> Dict[str, str]:
+        """
+        Valor final de cada campo de catálogo de AltaUsuarioIn (body o default
+        de la entidad) validado contra el catálogo en memoria, sin ir a SG.
+        Si un valor no figura, el catálogo puede haber cambiado en SG: se
+        refresca una vez (respetando SG_CATALOGOS_REFRESCO_MIN_SEGS) antes de
+        rechazar. Levanta CatalogoInvalido con todos los problemas juntos.
+        """
+        ent = entidad_cfg.id_entidad
+        datos = await self.obtener(ent)
+        resueltos, errores, inexistentes = self._validar(entidad_cfg, datos, valores)
+        if inexistentes and (ent in self._en_curso or self._puede_pedir(ent)):
+            try:
+                datos = await self.refrescar(ent)
+                resueltos, errores, _ = self._validar(entidad_cfg, datos, valores)
+            except Exception:
+                pass  # se rechaza con lo que había
+        if errores:
+            raise CatalogoInvalido("; ".join(errores))
+        return resueltos
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            ent: {
+                "cargado": d.cargado.isoformat(timespec="seconds"),
+                "items": {n: len(items) for n, items in d.catalogos.items()},
+                "error": self._errores.get(ent),
+            }
+            for ent, d in self._datos.items()
+        } | {ent: {"cargado": None, "error": err} for ent, err in self._errores.items() if ent not in self._datos}
+
+
+_cache: Optional[CacheCatalogos] = None
+
+
+def get_catalogos() -> CacheCatalogos:
+    global _cache
+    if _cache is None:
+        _cache = CacheCatalogos(CatalogosConfig())
+    return _cache
@@ -0,0 +1,245 @@
+# conciliacion.py
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, insert
+
+from app.config import env
+from app.auth_sg import auth_headers, sg_config, get_registro
+from app.entidades import json_de
+from app.directorio import get_directorio
+from app.database import nueva_sesion, nueva_sesion_lectura, db_configurada
+from app.importes import a_centavos, desde_centavos, centavos_sql
+from app.models import Transaccion, DiferenciaConciliacion
+
+# =========
+# Config
+# =========
+class ConciliacionConfig:
+    def __init__(self):
+        self.tam_pagina    = int(env("CONCILIACION_TAM_PAGINA", "500"))
+        self.concurrencia  = int(env("CONCILIACION_CONCURRENCIA", "4"))     # páginas SG en paralelo
+        self.ventana_horas = int(env("CONCILIACION_VENTANA_HORAS", "24"))   # tamaño de cada chunk en memoria
+        self.lote_db       = int(env("CONCILIACION_LOTE_DB", "5000"))
+        self.intervalo_min = int(env("CONCILIACION_INTERVALO_MIN", "0"))    # 0 = worker desactivado
+        self.dias_atras    = int(env("CONCILIACION_DIAS_ATRAS", "2"))
+        self.margen_min    = int(env("CONCILIACION_MARGEN_MIN", "30"))      # no conciliar lo recién operado
+
+# (id_transaccion) -> (centavos, tipo, fecha_operacion)
+Movimiento = Tuple[int, Optional[int], Optional[datetime]]
+
+
+# =========
+# Lado SG: páginas con concurrencia acotada
+# =========
+def _items_pagina(data: Any) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Normaliza la respuesta de SG. Acepta lista plana o {items|movimientos|data: [...], totalPaginas}.
+    """
+    if isinstance(data, list):
+        return data, None
+    items = data.get("items") or data.get("movimientos") or data.get("data") or []
+    total = data.get("totalPaginas") or data.get("totalPages")
+    return items, int(total) if total else None
+
+
+async def _pagina_sg(desde: datetime, hasta: datetime, pagina: int, tam: int, entidad_id: Optional[str]) -> Tuple[List[Dict], Optional[int]]:
+    cfg = sg_config()
+    params = {
+        "fechaDesde": desde.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fechaHasta": hasta.strftime("%Y-%m-%dT%H:%M:%S"),
+        "pagina": pagina,
+        "tamanioPagina": tam,
+    }
+    headers = await auth_headers(entidad_id)
+    # Pool y cupo de la entidad: la conciliación no le quita lugar a las demás
+    r = await get_registro().estado(entidad_id).pedir(
+        "GET", cfg.endpoint_movimientos, params=params, headers=headers,
+    )
+    r.raise_for_status()
+    return _items_pagina(await json_de(r))
+
+
+async def movimientos_sg(desde: datetime, hasta: datetime, entidad_id: Optional[str] = None) -> Dict[str, Movimiento]:
+    """
+    Trae todos los movimientos SG de la ventana. La primera página dice cuántas
+    hay; el resto se pide en paralelo con un semáforo de CONCILIACION_CONCURRENCIA.
+    Si SG no informa el total, se pagina secuencialmente hasta una página corta.
+    """
+    cc = ConciliacionConfig()
+    resultado: Dict[str, Movimiento] = {}
+
+    def acumular(items: List[Dict]) -> None:
+        for m in items:
+            id_tx = m.get("idTransaccion")
+            if not id_tx:
+                continue
+            fecha = m.get("fechaOperacion")
+            resultado[str(id_tx)] = (
+                a_centavos(m.get("importe") or 0),
+                m.get("idTipoTransaccion"),
+                datetime.fromisoformat(fecha) if isinstance(fecha, str) else None,
+            )
+
+    items, total = await _pagina_sg(desde, hasta, 1, cc.tam_pagina, entidad_id)
+    acumular(items)
+
+    if total is None:
+        pagina = 1
+        while len(items) >= cc.tam_pagina:
+            pagina += 1
+            items, _ = await _pagina_sg(desde, hasta, pagina, cc.tam_pagina, entidad_id)
+            acumular(items)
+        return resultado
+
+    sem = asyncio.Semaphore(cc.concurrencia)
+
+    async def una(pagina: int) -> None:
+        async with sem:
+            items_p, _ = await _pagina_sg(desde, hasta, pagina, cc.tam_pagina, entidad_id)
+        acumular(items_p)
+
+    await asyncio.gather(*(una(p) for p in range(2, total + 1)))
+    return resultado
+
+
+# =========
+# Lado local: una consulta en streaming + diff contra el hash de SG
+# =========
+def _diff_local(
+    sg: Dict[str, Movimiento], desde: datetime, hasta: datetime, id_corrida: str, ajenas: Set[str] = frozenset(),
+) -> Dict[str, int]:
+    """
+    Recorre las filas locales de la ventana (stream, yield_per) y las cruza
+    contra el dict de SG: lo que matchea se saca del dict, así lo que queda al
+    final son los faltantes. Memoria acotada al tamaño del lado SG del chunk.
+    La tabla no guarda la entidad: las filas cuyo CVU el directorio asigna a
+    una entidad de `ajenas` (no conciliada en esta corrida) se saltean.
+    """
+    cc = ConciliacionConfig()
+    directorio = get_directorio()
+    stats = {"sg": len(sg), "local": 0, "faltante_local": 0, "sobrante_local": 0, "importe": 0, "tipo": 0,
+             "centavos_sg": sum(m[0] for m in sg.values()), "centavos_local": 0}
+    pendientes: List[Dict] = []
+
+    def diferencia(id_tx, tipo_dif, mov_sg: Optional[Movimiento], centavos_local=None, tipo_local=None, fecha=None):
+        stats[tipo_dif] += 1
+        pendientes.append({
+            "id_corrida": id_corrida,
+            "fecha_corrida": datetime.now(),
+            "id_transaccion": id_tx,
+            "tipo_diferencia": tipo_dif,
+            "importe_sg": desde_centavos(mov_sg[0]) if mov_sg else None,
+            "importe_local": desde_centavos(centavos_local) if centavos_local is not None else None,
+            "tipo_sg": mov_sg[1] if mov_sg else None,
+            "tipo_local": tipo_local,
+            "fecha_operacion": fecha or (mov_sg[2] if mov_sg else None),
+        })
+
+    # El recorrido va por el engine de lectura (sin locks sobre la tabla que
+    # recibe los webhooks); las diferencias se graban con una sesión de escritura
+    db = nueva_sesion_lectura()
+    try:
+        consulta = (
+            select(Transaccion.id_transaccion, centavos_sql(Transaccion.importe), Transaccion.tipo,
+                   Transaccion.fecha_operacion, Transaccion.cvu)
+            .where(Transaccion.fecha_operacion >= desde, Transaccion.fecha_operacion < hasta)
+            .execution_options(stream_results=True, yield_per=cc.lote_db)
+        )
+        for id_tx, centavos, tipo, fecha, cvu in db.execute(consulta):
+            mov = sg.pop(id_tx, None)
+            if mov is None and ajenas and directorio.entidad_de(cvu) in ajenas:
+                continue
+            stats["local"] += 1
+            stats["centavos_local"] += centavos or 0
+            if mov is None:
+                diferencia(id_tx, "sobrante_local", None, centavos, tipo, fecha)
+            elif mov[0] != centavos:
+                diferencia(id_tx, "importe", mov, centavos, tipo, fecha)
+            elif mov[1] is not None and mov[1] != tipo:
+                diferencia(id_tx, "tipo", mov, centavos, tipo, fecha)
+
+        for id_tx, mov in sg.items():
+            diferencia(id_tx, "faltante_local", mov)
+
+    finally:
+        db.close()
+
+    if pendientes:
+        db = nueva_sesion()
+        try:
+            # Un solo executemany por chunk
+            db.execute(insert(DiferenciaConciliacion), pendientes)
+            db.commit()
+        finally:
+            db.close()
+    return stats
+
+
+async def conciliar(desde: datetime, hasta: datetime, entidad_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Concilia [desde, hasta) en chunks de CONCILIACION_VENTANA_HORAS.
+    Sin `entidad_id` el lado SG es la unión de los movimientos de todas las
+    entidades configuradas (la tabla local tiene las de todas). Con una sola
+    entidad, las filas locales de las demás se reconocen por el directorio CVU.
+    Devuelve el resumen con totales exactos (centavos -> Decimal).
+    """
+    cc = ConciliacionConfig()
+    configuradas = get_registro().configuradas()
+    entidades = [entidad_id] if entidad_id else (configuradas or [None])
+    ajenas = set(configuradas) - set(entidades)
+    if ajenas and not get_directorio().cargado:
+        await asyncio.to_thread(get_directorio().cargar)
+    id_corrida = str(uuid.uuid4())
+    total: Dict[str, int] = {}
+    paso = timedelta(hours=cc.ventana_horas)
+    inicio = desde
+    while inicio < hasta:
+        fin = min(inicio + paso, hasta)
+        sg: Dict[str, Movimiento] = {}
+        for ent in entidades:
+            sg.update(await movimientos_sg(inicio, fin, ent))
+        stats = await asyncio.to_thread(_diff_local, sg, inicio, fin, id_corrida, ajenas)
+        for k, v in stats.items():
+            total[k] = total.get(k, 0) + v
+        inicio = fin
+
+    return {
+        "id_corrida": id_corrida,
+        "entidades": [e or get_registro().default for e in entidades],
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        **{k: v for k, v in total.items() if not k.startswith("centavos_")},
+        "total_sg": desde_centavos(total.get("centavos_sg", 0)),
+        "total_local": desde_centavos(total.get("centavos_local", 0)),
+    }
+
+
+# =========
+# Worker programado
+# =========
+async def worker_conciliacion() -> None:
+    """
+    Job único del proceso líder (app/lider.py) si CONCILIACION_INTERVALO_MIN > 0:
+    con varios workers hay un solo reporte por corrida. Cada intervalo
+    concilia los últimos CONCILIACION_DIAS_ATRAS días de todas las entidades.
+    """
+    cc = ConciliacionConfig()
+    if cc.intervalo_min <= 0 or not db_configurada():
+        return
+    while True:
+        hasta = datetime.now() - timedelta(minutes=cc.margen_min)
+        desde = hasta - timedelta(days=cc.dias_atras)
+        try:
+            resumen = await conciliar(desde, hasta)
+            difs = sum(resumen[k] for k in ("faltante_local", "sobrante_local", "importe", "tipo"))
+            if difs:
+                logging.error(f"Conciliación {resumen['id_corrida']}: {difs} diferencias ({resumen})")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error en worker de conciliación: {e}")
+        await asyncio.sleep(cc.intervalo_min * 60)
@@ -0,0 +1,42 @@
+# config.py
+import os
+import logging
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+_entorno_cargado = False
+
+
+def cargar_entorno() -> None:
+    """
+    Carga el .env una sola vez. Se llama desde el lifespan y desde los getters
+    lazy (engine, config SG), nunca al importar módulos.
+    """
+    global _entorno_cargado
+    if _entorno_cargado:
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    _entorno_cargado = True
+
+
+def env(nombre: str, default: Optional[str] = None) -> Optional[str]:
+    cargar_entorno()
+    return os.getenv(nombre, default)
+
+
+def configurar_logging() -> None:
+    # Configuración del logging para registrar errores (idempotente)
+    root = logging.getLogger()
+    if any(isinstance(h, RotatingFileHandler) for h in root.handlers):
+        return
+    handler = RotatingFileHandler(
+        env("LOG_PATH", "errores.log"),
+        maxBytes=1_000_000,  # 1 MB
+        backupCount=5        # hasta 5 archivos .log antiguos
+    )
+    logging.basicConfig(
+        handlers=[handler],
+        level=logging.ERROR,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
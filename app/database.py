@@ -1,25 +1,139 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from typing import Optional
 from sqlalchemy.orm import sessionmaker, declarative_base
+from app.config import env
 
 
-# Cargar variables del .env
-load_dotenv()
+Base = declarative_base()
 
-server = os.getenv("DB_SERVER")
-database = os.getenv("DB_NAME")
-username = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-driver = os.getenv("DB_DRIVER")
-AUTH_TOKEN = os.getenv("AUTH_TOKEN")
+# Sin bind: el engine se crea recién en el primer uso (ver get_engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+_engine = None
 
+# Lecturas (consultas del ERP, exportes, catch-up, conciliación): engine y pool
+# aparte, para que un reporte pesado no ocupe conexiones ni bloquee los INSERT
+# de recibir_transaccion
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+_read_engine = None
 
-# Formato para cadena de conexión
-connection_string = (
-    f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver={driver}"
-)
 
-engine = create_engine(connection_string)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+def connection_string() -> str:
+    server = env("DB_SERVER")
+    database = env("DB_NAME")
+    username = env("DB_USER")
+    password = env("DB_PASSWORD")
+    driver = env("DB_DRIVER")
+    # Formato para cadena de conexión
+    return f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver={driver}"
+
+
+def db_configurada() -> bool:
+    """Permite correr sin SQL Server (p.ej. sólo el proxy /sg)."""
+    return bool(env("DB_SERVER") and env("DB_NAME"))
+
+
+def get_engine():
+    """
+    Crea el engine (y carga pyodbc) en el primer uso, no al importar.
+    """
+    global _engine
+    if _engine is None:
+        if not db_configurada():
+            raise RuntimeError("Faltan variables de entorno DB_SERVER / DB_NAME")
+        from sqlalchemy import create_engine
+        # Con varios workers cada proceso tiene su pool: conexiones totales =
+        # API_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+        _engine = create_engine(
+            connection_string(),
+            pool_size=int(env("DB_POOL_SIZE", "5")),
+            max_overflow=int(env("DB_MAX_OVERFLOW", "10")),
+            pool_pre_ping=True,  # descarta conexiones cortadas (reinicio de SQL Server, failover)
+        )
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_read_engine():
+    """
+    Engine de lectura. Con DB_READ_URL apunta a una réplica (p.ej. secundaria
+    legible de un AlwaysOn); si no, a la misma base con aislamiento
+    DB_READ_ISOLATION (SNAPSHOT por defecto: lee versiones de fila, no toma
+    locks compartidos). Requiere ALLOW_SNAPSHOT_ISOLATION ON (scriptAGILPAGOS.sql);
+    con READ_COMMITTED_SNAPSHOT ON alcanza con "READ COMMITTED". Una réplica
+    puede ir unos segundos atrás del último INSERT.
+    """
+    global _read_engine
+    if _read_engine is None:
+        if not db_configurada():
+            raise RuntimeError("Faltan variables de entorno DB_SERVER / DB_NAME")
+        from sqlalchemy import create_engine
+        opciones = {}
+        isolation = env("DB_READ_ISOLATION", "SNAPSHOT")  # vacío = el default del servidor
+        if isolation:
+            opciones["isolation_level"] = isolation
+        _read_engine = create_engine(
+            env("DB_READ_URL") or connection_string(),
+            pool_size=int(env("DB_READ_POOL_SIZE", "5")),
+            max_overflow=int(env("DB_READ_MAX_OVERFLOW", "10")),
+            pool_pre_ping=True,
+            **opciones,
+        )
+        ReadSessionLocal.configure(bind=_read_engine)
+    return _read_engine
+
+
+def engine_actual():
+    """Engine ya creado o None (no fuerza la conexión)."""
+    return _engine
+
+
+def nueva_sesion():
+    get_engine()
+    return SessionLocal()
+
+
+def nueva_sesion_lectura():
+    """Sesión para consultas: nunca escribir con ella (puede ser una réplica)."""
+    get_read_engine()
+    return ReadSessionLocal()
+
+
+# Dependencia FastAPI para obtener la sesión de la base de datos
+def get_db():
+    if not db_configurada():
+        from fastapi import HTTPException
+        raise HTTPException(503, "Base de datos no configurada en este despliegue")
+    db = nueva_sesion()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependencia FastAPI para endpoints de sólo lectura
+def get_read_db():
+    if not db_configurada():
+        from fastapi import HTTPException
+        raise HTTPException(503, "Base de datos no configurada en este despliegue")
+    db = nueva_sesion_lectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def cerrar_engine() -> None:
+    global _engine, _read_engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+    if _read_engine is not None:
+        _read_engine.dispose()
+        _read_engine = None
+
+
+def get_auth_token() -> Optional[str]:
+    return env("AUTH_TOKEN")
+
+
+def get_admin_token() -> Optional[str]:
+    return env("ADMIN_TOKEN")
@@ -0,0 +1,229 @@
+# directorio.py
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.config import env
+
+# =========
+# Config (lazy)
+# =========
+class DirectorioConfig:
+    def __init__(self):
+        # Relectura incremental: cada worker ve lo que registraron los demás
+        self.refresco_segs = float(env("DIRECTORIO_REFRESCO_SEGS", "60"))
+        self.solape_segs = int(env("DIRECTORIO_SOLAPE_SEGS", "120"))
+        self.lote_db = int(env("DIRECTORIO_LOTE_DB", "50000"))
+
+
+# SQL Server admite hasta 2100 parámetros por sentencia
+MAX_PARAMETROS = 2000
+
+
+class EntradaDirectorio(NamedTuple):
+    # Tupla y no dict: con cientos de miles de CVU la diferencia de memoria se nota
+    id_usuario: Optional[str]
+    alias: Optional[str]
+    numero_cuenta_entidad: Optional[str]
+    cuit: Optional[str]
+    id_entidad: Optional[str]
+
+    def como_dict(self) -> Dict[str, Optional[str]]:
+        return {
+            "idUsuario": self.id_usuario,
+            "alias": self.alias,
+            "numeroCuentaEntidad": self.numero_cuenta_entidad,
+            "cuit": self.cuit,
+        }
+
+
+def _texto(valor: Any) -> Optional[str]:
+    return None if valor in (None, "") else str(valor)
+
+
+# =========
+# Índice en memoria + tabla directorio_cvu
+# =========
+class DirectorioCVU:
+    """
+    CVU -> (idUsuario, alias, numeroCuentaEntidad, cuit) en un dict por
+    proceso. `buscar` no toca la BD (O(1), apto para el webhook y para
+    serializar listas). Las lecturas no toman lock: sólo se reemplazan
+    entradas completas; escrituras y recargas van bajo `_lock`.
+    """
+
+    def __init__(self, cfg: DirectorioConfig):
+        self.cfg = cfg
+        self._indice: Dict[str, EntradaDirectorio] = {}
+        self._lock = threading.Lock()
+        self._marca: Optional[datetime] = None
+        self.cargado = False
+        # Sube con cada cambio real del índice: va en la clave del cache de respuestas
+        self.version = 0
+        self._tarea: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._indice)
+
+    def buscar(self, cvu: Optional[str]) -> Optional[Dict[str, Optional[str]]]:
+        entrada = self._indice.get(cvu) if cvu else None
+        return entrada.como_dict() if entrada is not None else None
+
+    def entidad_de(self, cvu: Optional[str]) -> Optional[str]:
+        entrada = self._indice.get(cvu) if cvu else None
+        return entrada.id_entidad if entrada is not None else None
+
+    def cargar(self) -> int:
+        """Lee de la BD lo actualizado desde la última carga (todo, la primera vez)."""
+        from app.database import db_configurada, nueva_sesion_lectura
+        from app.models import UsuarioCVU
+
+        if not db_configurada():
+            return 0
+        desde = self._marca - timedelta(seconds=self.cfg.solape_segs) if self._marca else None
+        q = select(
+            UsuarioCVU.cvu, UsuarioCVU.id_usuario, UsuarioCVU.alias, UsuarioCVU.numero_cuenta_entidad,
+            UsuarioCVU.cuit, UsuarioCVU.id_entidad, UsuarioCVU.fecha_actualizacion,
+        )
+        if desde is not None:
+            q = q.where(UsuarioCVU.fecha_actualizacion > desde)
+        db = nueva_sesion_lectura()
+        leidas, marca = 0, self._marca
+        try:
+            resultado = db.execute(q.execution_options(stream_results=True, yield_per=self.cfg.lote_db))
+            for filas in resultado.partitions():
+                lote = {f.cvu: EntradaDirectorio(*f[1:6]) for f in filas}
+                with self._lock:
+                    # El solape vuelve a traer filas ya cargadas: sólo cuentan las distintas
+                    cambios = {cvu: e for cvu, e in lote.items() if self._indice.get(cvu) != e}
+                    if cambios:
+                        self._indice.update(cambios)
+                        self.version += 1
+                tope = max(f.fecha_actualizacion for f in filas)
+                marca = tope if marca is None else max(marca, tope)
+                leidas += len(filas)
+        finally:
+            db.close()
+        self._marca = marca
+        self.cargado = True
+        return leidas
+
+    def guardar(self, entradas: Iterable[Dict[str, Any]]) -> int:
+        """
+        Upsert de {"cvu", "idUsuario", "alias", "numeroCuentaEntidad", "cuit",
+        "idEntidad"}. Lo que ya está igual en memoria no va a la BD. Devuelve
+        cuántas filas se escribieron.
+        """
+        from app.database import nueva_sesion
+        from app.models import UsuarioCVU
+
+        nuevas: Dict[str, EntradaDirectorio] = {}
+        for e in entradas:
+            cvu = _texto(e.get("cvu"))
+            if not cvu:
+                continue
+            previa = self._indice.get(cvu)
+            entrada = EntradaDirectorio(
+                _texto(e.get("idUsuario")) or (previa.id_usuario if previa else None),
+                _texto(e.get("alias")) or (previa.alias if previa else None),
+                _texto(e.get("numeroCuentaEntidad")) or (previa.numero_cuenta_entidad if previa else None),
+                _texto(e.get("cuit")) or (previa.cuit if previa else None),
+                _texto(e.get("idEntidad")) or (previa.id_entidad if previa else None),
+            )
+            if entrada != previa:
+                nuevas[cvu] = entrada
+        if not nuevas:
+            return 0
+
+        ahora = datetime.now()
+        for intento in (1, 2):
+            db = nueva_sesion()
+            try:
+                cvus = list(nuevas)
+                existentes = {}
+                for i in range(0, len(cvus), MAX_PARAMETROS):
+                    for fila in db.execute(select(UsuarioCVU).where(UsuarioCVU.cvu.in_(cvus[i:i + MAX_PARAMETROS]))).scalars():
+                        existentes[fila.cvu] = fila
+                for cvu, entrada in nuevas.items():
+                    fila = existentes.get(cvu)
+                    if fila is None:
+                        fila = UsuarioCVU(cvu=cvu)
+                        db.add(fila)
+                    fila.id_usuario, fila.alias, fila.numero_cuenta_entidad, fila.cuit, fila.id_entidad = entrada
+                    fila.fecha_actualizacion = ahora
+                db.commit()
+                break
+            except IntegrityError:
+                # Otro worker insertó el mismo CVU entre el SELECT y el INSERT: se reintenta como UPDATE
+                db.rollback()
+                if intento == 2:
+                    raise
+            finally:
+                db.close()
+        with self._lock:
+            self._indice.update(nuevas)
+            self.version += 1
+        return len(nuevas)
+
+    async def _ciclo(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.cargar)
+            except Exception as e:
+                logging.error(f"No se pudo leer directorio_cvu: {e}")
+            await asyncio.sleep(self.cfg.refresco_segs)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+
+_directorio: Optional[DirectorioCVU] = None
+
+
+def get_directorio() -> DirectorioCVU:
+    global _directorio
+    if _directorio is None:
+        _directorio = DirectorioCVU(DirectorioConfig())
+    return _directorio
+
+
+# =========
+# Desde respuestas de SG
+# =========
+def entradas_de_usuario(
+    id_usuario: Optional[str], cuentas: List[Dict[str, Any]], cuit: Any, id_entidad: Optional[str]
+) -> Iterator[Dict[str, Any]]:
+    """Cuentas de UsuarioByCuit (numeroCuenta = número de cuenta en la entidad)."""
+    for c in cuentas:
+        if isinstance(c, dict) and c.get("cvu"):
+            yield {
+                "cvu": c.get("cvu"), "idUsuario": id_usuario, "alias": c.get("alias"),
+                "numeroCuentaEntidad": c.get("numeroCuenta"), "cuit": cuit, "idEntidad": id_entidad,
+            }
+
+
+async def registrar_desde_sg(entradas: Iterable[Dict[str, Any]]) -> None:
+    """
+    Se consume en un hilo (UsuarioByCuit puede traer miles de cuentas). Nunca
+    hace fallar la respuesta de SG: un error del directorio sólo se loguea.
+    """
+    from app.database import db_configurada
+
+    if not db_configurada():
+        return
+    try:
+        await asyncio.to_thread(get_directorio().guardar, entradas)
+    except Exception as e:
+        logging.error(f"No se pudo actualizar directorio_cvu: {e}")
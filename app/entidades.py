@@ -0,0 +1,316 @@
+# entidades.py
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from app.config import env
+from app.perfilado import fase
+from app.sg_fake import transporte_sg
+
+# =========
+# Config global de SG (lazy: se lee del .env en el primer uso, no al importar)
+# Son los valores por defecto de cada entidad y la config en modo una-sola-entidad.
+# =========
+class SGConfig:
+    def __init__(self):
+        # Con el SG fake (SG_FAKE=1) no hace falta URL real
+        self.base_url    = env("SG_BASE_URL", "http://sg-fake" if env("SG_FAKE", "0") == "1" else "").rstrip("/")
+        self.user_name   = env("SG_USER_NAME", "")
+        self.password    = env("SG_PASSWORD", "")
+        self.id_entidad  = env("SG_ID_ENTIDAD", "")
+        self.login_path  = env("SG_LOGIN_PATH", "/Account/Login")
+        # Tiempo de seguridad para renovar el token antes de su vencimiento (en segundos)
+        self.token_renew_leeway = int(env("SG_TOKEN_RENEW_LEEWAY", "300"))  # 5 minutos
+        # Endpoints reales de SG (ajustar según tu PDF 1.8.6/ambiente)
+        self.endpoint_cvu      = env("SG_ENDPOINT_CVU", "/api/cuentas-pago/cvu")       # EJEMPLO de path
+        self.endpoint_transfer = env("SG_ENDPOINT_TRANSFER", "/api/transferencias")    # EJEMPLO de path
+        self.endpoint_movimientos = env("SG_ENDPOINT_MOVIMIENTOS", "/Movimientos")       # EJEMPLO de path
+        self.timeout_secs      = float(env("SG_HTTP_TIMEOUT", "20.0"))
+        # Catálogos para alta de usuarios
+        self.id_doc_dni        = env("SG_ID_DOC_DNI")  # <- completar en .env
+        self.id_tipo_persona   = env("SG_ID_TIPO_PERSONA", "20EB9127-7CA8-49E0-9E0B-CA8293218ACA")
+        self.id_tipo_cuenta    = env("SG_ID_TIPO_CUENTA", "D2483A34-78BE-40A2-B8CB-07AD4BCF6F61")
+        # Multi-entidad: JSON con la config de cada mutual (vacío = sólo las variables SG_*)
+        self.entidades_path    = env("SG_ENTIDADES_PATH", "")
+        self.recarga_segs      = float(env("SG_ENTIDADES_RECARGA_SEGS", "30"))  # cada cuánto se mira el mtime
+        # Presupuesto por entidad (defaults; cada entidad puede pisarlos)
+        self.max_conexiones    = int(env("SG_MAX_CONEXIONES", "20"))
+        self.concurrencia      = int(env("SG_CONCURRENCIA", "10"))
+        self.espera_cupo       = float(env("SG_ESPERA_CUPO_SEGS", "5"))
+        # Respuestas más grandes que esto se decodifican/serializan en un hilo
+        self.json_hilo_bytes   = int(env("SG_JSON_HILO_BYTES", "262144"))
+
+_config: Optional[SGConfig] = None
+
+def sg_config() -> SGConfig:
+    global _config
+    if _config is None:
+        _config = SGConfig()
+    return _config
+
+
+class EntidadDesconocida(RuntimeError):
+    pass
+
+
+class CupoAgotado(RuntimeError):
+    """La entidad tiene todos sus requests a SG en vuelo y no se liberó lugar a tiempo."""
+
+
+# =========
+# Config por entidad
+# =========
+class EntidadConfig:
+    """
+    Lo que cambia entre mutuales. Cada campo que falta en el JSON se toma de
+    SGConfig. La password conviene referenciarla con `password_env` (nombre de
+    una variable de entorno) en vez de escribirla en el archivo.
+    """
+
+    def __init__(self, id_entidad: str, datos: Dict[str, Any], base: SGConfig):
+        def valor(clave: str, default: Any) -> Any:
+            v = datos.get(clave)
+            return default if v in (None, "") else v
+
+        self.id_entidad      = id_entidad
+        self.nombre          = datos.get("nombre") or id_entidad
+        self.base_url        = str(valor("base_url", base.base_url)).rstrip("/")
+        self.user_name       = valor("user_name", base.user_name)
+        if datos.get("password_env"):
+            self.password    = env(datos["password_env"], "")
+        else:
+            self.password    = valor("password", base.password)
+        self.login_path      = valor("login_path", base.login_path)
+        self.timeout_secs    = float(valor("timeout_secs", base.timeout_secs))
+        self.id_doc_dni      = valor("id_doc_dni", base.id_doc_dni)
+        self.id_tipo_persona = valor("id_tipo_persona", base.id_tipo_persona)
+        self.id_tipo_cuenta  = valor("id_tipo_cuenta", base.id_tipo_cuenta)
+        self.max_conexiones  = int(valor("max_conexiones", base.max_conexiones))
+        self.concurrencia    = int(valor("concurrencia", base.concurrencia))
+        self.espera_cupo     = float(valor("espera_cupo", base.espera_cupo))
+
+    def huella(self) -> tuple:
+        return tuple(sorted(vars(self).items()))
+
+
+# =========
+# Recursos aislados por entidad: pool HTTP, cupo de concurrencia y slot de token
+# =========
+class EstadoEntidad:
+    def __init__(self, cfg: EntidadConfig):
+        self.cfg = cfg
+        # SG real, fake embebido (SG_FAKE=1) o cassette (SG_CASSETTE_PATH)
+        transporte, self.modo = transporte_sg()
+        self.client = httpx.AsyncClient(
+            base_url=cfg.base_url,
+            transport=transporte,
+            timeout=httpx.Timeout(cfg.timeout_secs, connect=min(10.0, cfg.timeout_secs)),
+            limits=httpx.Limits(max_connections=cfg.max_conexiones, max_keepalive_connections=cfg.max_conexiones),
+        )
+        self.semaforo = asyncio.Semaphore(cfg.concurrencia)
+        self.en_vuelo = 0
+        # Slot de token: un login a la vez por entidad (single-flight)
+        self.token: Optional[str] = None
+        self.vence: Optional[datetime] = None
+        self.login_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def cupo(self):
+        try:
+            with fase("sg_cupo"):
+                await asyncio.wait_for(self.semaforo.acquire(), self.cfg.espera_cupo)
+        except asyncio.TimeoutError:
+            raise CupoAgotado(f"Entidad {self.cfg.id_entidad}: sin cupo hacia SG ({self.cfg.concurrencia} en vuelo)")
+        self.en_vuelo += 1
+        try:
+            yield
+        finally:
+            self.en_vuelo -= 1
+            self.semaforo.release()
+
+    async def pedir(self, metodo: str, path: str, **kwargs) -> httpx.Response:
+        """Request a SG con el pool y el cupo de esta entidad. `path` es relativo a su base_url."""
+        async with self.cupo():
+            with fase("sg"):
+                return await self.client.request(metodo, path, **kwargs)
+
+
+async def json_de(resp: httpx.Response) -> Any:
+    """
+    JSON de una respuesta de SG. Por encima de SG_JSON_HILO_BYTES el parseo
+    (CPU puro) va a un hilo para no frenar los demás requests en vuelo.
+    """
+    contenido = resp.content
+    if len(contenido) >= sg_config().json_hilo_bytes:
+        return await asyncio.to_thread(json.loads, contenido)
+    return resp.json()
+
+
+# =========
+# Registro (una vez por proceso, recargable en caliente)
+# =========
+class RegistroEntidades:
+    """
+    Con SG_ENTIDADES_PATH se leen las entidades de un JSON:
+        {"default": "<guid>", "entidades": [{"id_entidad": "<guid>", "nombre": "...",
+          "user_name": "...", "password_env": "SG_PASSWORD_X", "concurrencia": 5}, ...]}
+    y una entidad que no figura se rechaza. Sin archivo la única entidad es
+    SG_ID_ENTIDAD (variables SG_*) y cualquier otro id también se rechaza.
+    Si cambia el mtime del archivo se recarga: las entidades con config distinta
+    arrancan con recursos nuevos; las demás conservan pool y token. El pool
+    reemplazado se cierra cuando terminan los requests que ya lo usaban.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configs: Dict[str, EntidadConfig] = {}
+        self._estados: Dict[str, EstadoEntidad] = {}
+        self._retirados: List[EstadoEntidad] = []
+        self._cierres: Set[asyncio.Task] = set()
+        self._desde_archivo = False
+        self._mtime: Optional[float] = None
+        self._revisado = time.monotonic()
+        self.default: Optional[str] = None
+        self.cargar()
+
+    def cargar(self) -> None:
+        base = sg_config()
+        path = base.entidades_path
+        mtime = None
+        if path:
+            mtime = os.path.getmtime(path)
+            with open(path, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            configs = {
+                str(e["id_entidad"]): EntidadConfig(str(e["id_entidad"]), e, base)
+                for e in datos.get("entidades", [])
+            }
+            default = datos.get("default") or base.id_entidad or next(iter(configs), None)
+        else:
+            configs = {base.id_entidad: EntidadConfig(base.id_entidad, {}, base)} if base.id_entidad else {}
+            default = base.id_entidad
+
+        with self._lock:
+            for ent in list(self._estados):
+                nueva = configs.get(ent)
+                if nueva is None or nueva.huella() != self._estados[ent].cfg.huella():
+                    self._retirar(self._estados.pop(ent))
+            self._configs = configs
+            self._desde_archivo = bool(path)
+            self._mtime = mtime
+            self.default = default
+
+    def _retirar(self, est: EstadoEntidad) -> None:
+        """Con el lock tomado. Puede tener requests en vuelo: se cierra cuando terminan."""
+        self._retirados.append(est)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # fuera del event loop: queda para el shutdown
+        tarea = loop.create_task(self._cerrar_retirado(est))
+        self._cierres.add(tarea)
+        tarea.add_done_callback(self._cierres.discard)
+
+    async def _cerrar_retirado(self, est: EstadoEntidad) -> None:
+        # Un request que tomó el estado justo antes de la recarga todavía puede
+        # no haber entrado al cupo: se espera al menos su timeout
+        await asyncio.sleep(est.cfg.timeout_secs)
+        while est.en_vuelo:
+            await asyncio.sleep(1)
+        with self._lock:
+            if est not in self._retirados:
+                return  # ya lo cerró el shutdown
+            self._retirados.remove(est)
+        await est.client.aclose()
+
+    def _revisar(self) -> None:
+        if not self._desde_archivo:
+            return
+        ahora = time.monotonic()
+        if ahora - self._revisado < sg_config().recarga_segs:
+            return
+        self._revisado = ahora
+        try:
+            if os.path.getmtime(sg_config().entidades_path) != self._mtime:
+                self.cargar()
+        except (OSError, ValueError, KeyError) as e:
+            # Archivo a medio escribir o inválido: se sigue con la config anterior
+            logging.error(f"No se pudo recargar SG_ENTIDADES_PATH: {e}")
+
+    def estado(self, entidad_id: Optional[str] = None) -> EstadoEntidad:
+        self._revisar()
+        ent = entidad_id or self.default
+        if not ent:
+            raise EntidadDesconocida("SG_ID_ENTIDAD no definido y no se pasó entidad_id")
+        with self._lock:
+            est = self._estados.get(ent)
+            if est is None:
+                cfg = self._configs.get(ent)
+                if cfg is None:
+                    # Sin archivo sólo existe SG_ID_ENTIDAD: un id cualquiera no crea pool ni token
+                    origen = "SG_ENTIDADES_PATH" if self._desde_archivo else "SG_ID_ENTIDAD"
+                    raise EntidadDesconocida(f"Entidad {ent} no configurada en {origen}")
+                est = self._estados[ent] = EstadoEntidad(cfg)
+            return est
+
+    def configuradas(self) -> List[str]:
+        """Ids de entidad del archivo (o la única de SG_ID_ENTIDAD)."""
+        self._revisar()
+        with self._lock:
+            return list(self._configs)
+
+    def activos(self) -> List[EstadoEntidad]:
+        """Entidades con recursos ya creados (sin instanciar las que nadie usó)."""
+        with self._lock:
+            return list(self._estados.values())
+
+    def listar(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "idEntidad": ent,
+                    "nombre": cfg.nombre,
+                    "default": ent == self.default,
+                    "concurrencia": cfg.concurrencia,
+                    "maxConexiones": cfg.max_conexiones,
+                    "enVuelo": self._estados[ent].en_vuelo if ent in self._estados else 0,
+                    "token": ent in self._estados and self._estados[ent].token is not None,
+                    "modo": self._estados[ent].modo if ent in self._estados else None,
+                }
+                for ent, cfg in self._configs.items()
+            ]
+
+    async def cerrar(self) -> None:
+        tareas = list(self._cierres)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        with self._lock:
+            estados = list(self._estados.values()) + self._retirados
+            self._estados.clear()
+            self._retirados = []
+        for est in estados:
+            await est.client.aclose()
+
+
+_registro: Optional[RegistroEntidades] = None
+
+def get_registro() -> RegistroEntidades:
+    global _registro
+    if _registro is None:
+        _registro = RegistroEntidades()
+    return _registro
+
+async def cerrar_registro() -> None:
+    global _registro
+    if _registro is not None:
+        await _registro.cerrar()
+    _registro = None
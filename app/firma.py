@@ -0,0 +1,199 @@
+# firma.py
+import os
+import hmac
+import base64
+import binascii
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Dict, Optional, Set
+
+from starlette.responses import JSONResponse
+
+from app.config import env
+
+HEADER_FIRMA = b"x-signature"
+HEADER_USUARIO_FINAL = b"idwebusuariofinal"
+
+
+# =========
+# Config (lazy: se lee en el primer request, no al importar)
+# =========
+class FirmaConfig:
+    def __init__(self):
+        # Rutas (POST) cuyo body debe venir firmado por Agilpagos en X-Signature.
+        self.rutas = tuple(
+            r.strip() for r in env("AGIL_FIRMA_RUTAS", "/transacciones").split(",") if r.strip()
+        )
+        self.algoritmo = env("AGIL_FIRMA_ALGORITMO", "sha256")
+        self.max_bytes = int(env("AGIL_FIRMA_MAX_BYTES", str(1_000_000)))  # 1 MB
+        # Header de donde se toma la entidad para elegir la clave (si no viene, SG_ID_ENTIDAD)
+        self.header_entidad = env("AGIL_FIRMA_HEADER_ENTIDAD", "IDENTIDAD").lower().encode("latin-1")
+        # Si no hay claves configuradas y no es obligatoria, la validación se omite (modo UAT)
+        self.obligatoria = env("AGIL_FIRMA_OBLIGATORIA", "0").lower() in {"1", "true", "si", "sí"}
+        # Claves por entidad (AGIL_FIRMA_CLAVE_<ENTIDAD>) y general (AGIL_FIRMA_CLAVE).
+        # Se leen una vez: el header de entidad nunca agranda ningún cache.
+        prefijo = "AGIL_FIRMA_CLAVE_"
+        self.claves = {
+            nombre[len(prefijo):]: valor
+            for nombre, valor in os.environ.items()
+            if nombre.startswith(prefijo) and valor
+        }
+        self.clave_general = env("AGIL_FIRMA_CLAVE") or None
+        self.entidad_default = env("SG_ID_ENTIDAD", "")
+
+    def activa(self) -> bool:
+        """Con cualquier clave configurada la firma es obligatoria para todas las entidades."""
+        return bool(self.claves or self.clave_general) or self.obligatoria
+
+
+@lru_cache(maxsize=1)
+def firma_config() -> FirmaConfig:
+    return FirmaConfig()
+
+
+# =========
+# Claves por Entidad
+# =========
+def _sufijo(entidad_id: str) -> str:
+    return entidad_id.upper().replace("-", "_")
+
+
+def _entidades_conocidas(cfg: FirmaConfig) -> Set[str]:
+    """Entidades con clave propia, SG_ID_ENTIDAD y las de SG_ENTIDADES_PATH."""
+    conocidas = set(cfg.claves)
+    if cfg.entidad_default:
+        conocidas.add(_sufijo(cfg.entidad_default))
+    if env("SG_ENTIDADES_PATH"):
+        from app.entidades import get_registro
+        conocidas.update(_sufijo(e) for e in get_registro().configuradas())
+    return conocidas
+
+
+@lru_cache(maxsize=64)
+def _mac_base(sufijo: str) -> Optional["hmac.HMAC"]:
+    """
+    Devuelve un HMAC ya inicializado con la clave de la entidad.
+    Por request se hace .copy() y se evita recalcular los pads de la clave.
+    Clave: AGIL_FIRMA_CLAVE_<ENTIDAD> o, si no existe, AGIL_FIRMA_CLAVE.
+    """
+    cfg = firma_config()
+    clave = cfg.claves.get(sufijo) or cfg.clave_general
+    if not clave:
+        return None
+    return hmac.new(clave.encode("utf-8"), digestmod=getattr(hashlib, cfg.algoritmo))
+
+
+def mac_entidad(entidad_id: str) -> Optional["hmac.HMAC"]:
+    """None si la entidad no es una de las configuradas o no tiene clave (el cache sólo ve conocidas)."""
+    sufijo = _sufijo(entidad_id)
+    if not sufijo or sufijo not in _entidades_conocidas(firma_config()):
+        return None
+    return _mac_base(sufijo)
+
+
+def limpiar_cache_claves() -> None:
+    """Para rotación de claves sin reiniciar el proceso."""
+    _mac_base.cache_clear()
+    firma_config.cache_clear()
+
+
+def _decodificar_firma(valor: str) -> Optional[bytes]:
+    """
+    Acepta la firma en hex o en base64, con o sin prefijo "sha256=".
+    """
+    valor = valor.strip()
+    prefijo = f"{firma_config().algoritmo}="
+    if valor.lower().startswith(prefijo):
+        valor = valor[len(prefijo):]
+    try:
+        return bytes.fromhex(valor)
+    except ValueError:
+        pass
+    try:
+        return base64.b64decode(valor, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _rechazar(status_code: int, mensaje: str) -> JSONResponse:
+    return JSONResponse({"status": "error", "mensaje": mensaje}, status_code=status_code)
+
+
+# =========
+# Middleware ASGI
+# =========
+class FirmaMiddleware:
+    """
+    Valida X-Signature = HMAC(clave_entidad, body crudo) e IDWEBUSUARIOFINAL.
+    El hash se calcula a medida que llegan los chunks del body, sin parsear ni
+    re-serializar el JSON, y se rechaza ANTES de Pydantic y de abrir sesión de BD.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        cfg = firma_config()
+        if not scope["path"].startswith(cfg.rutas):
+            await self.app(scope, receive, send)
+            return
+
+        if not cfg.activa():
+            # Sin ninguna clave y sin AGIL_FIRMA_OBLIGATORIA (modo UAT)
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        entidad_id = headers.get(cfg.header_entidad, b"").decode("latin-1") or cfg.entidad_default
+        # Falla cerrado: una entidad desconocida o sin clave no saltea la firma
+        mac_base = mac_entidad(entidad_id)
+        if mac_base is None:
+            logging.error(f"Firma: entidad {entidad_id[:60]!r} desconocida o sin clave en {scope['path']}")
+            await _rechazar(401, "Firma no configurada para la entidad")(scope, receive, send)
+            return
+
+        firma = headers.get(HEADER_FIRMA)
+        esperado = _decodificar_firma(firma.decode("latin-1")) if firma else None
+        if not esperado or not headers.get(HEADER_USUARIO_FINAL):
+            await _rechazar(401, "Faltan headers X-Signature / IDWEBUSUARIOFINAL")(scope, receive, send)
+            return
+
+        # Hash incremental del body crudo (se guarda para re-entregarlo a la app)
+        mac = mac_base.copy()
+        chunks = []
+        recibidos = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            if chunk:
+                recibidos += len(chunk)
+                if recibidos > cfg.max_bytes:
+                    await _rechazar(413, "Body demasiado grande")(scope, receive, send)
+                    return
+                mac.update(chunk)
+                chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+
+        if not hmac.compare_digest(mac.digest(), esperado):
+            logging.error(f"Firma inválida en {scope['path']} (entidad {entidad_id})")
+            await _rechazar(401, "Firma inválida")(scope, receive, send)
+            return
+
+        body = b"".join(chunks)
+        entregado = False
+
+        async def receive_body():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, receive_body, send)
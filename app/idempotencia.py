@@ -0,0 +1,419 @@
+# idempotencia.py
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.config import env
+from app.database import db_configurada
+
+# Errores que no se guardan: el cliente tiene que poder reintentar con la misma clave
+NO_CACHEABLES = {409, 429}
+MAX_LARGO_CLAVE = 255
+
+# Estados de una clave
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+DESCONOCIDO = "desconocido"  # 5xx / timeout / cancelación: SG pudo haberlo procesado
+
+
+class IdempotenciaConfig:
+    def __init__(self):
+        self.ttl       = int(env("IDEMPOTENCIA_TTL_SEGS", "86400"))
+        self.maximo    = int(env("IDEMPOTENCIA_MAX", "10000"))
+        # Una clave "en curso" más vieja que esto es de un proceso que murió a mitad de la llamada
+        self.en_curso  = int(env("IDEMPOTENCIA_EN_CURSO_SEGS", "300"))
+        self.purga     = int(env("IDEMPOTENCIA_PURGA_SEGS", "300"))
+        # Cuánto espera un request a que otro worker/nodo resuelva la misma clave antes del 409
+        self.espera    = float(env("IDEMPOTENCIA_ESPERA_SEGS", "30"))
+        self.sondeo    = int(env("IDEMPOTENCIA_SONDEO_MS", "250")) / 1000
+
+
+def huella_de(payload: Any) -> str:
+    """Hash del payload canónico (claves ordenadas) para detectar una clave reusada con otro body."""
+    crudo = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(crudo.encode("utf-8")).hexdigest()
+
+
+def _en_curso() -> HTTPException:
+    return HTTPException(409, detail="Hay un request con esta Idempotency-Key en curso, reintentar más tarde")
+
+
+def _desconocido() -> HTTPException:
+    return HTTPException(
+        502,
+        detail="El request original con esta Idempotency-Key terminó sin respuesta de SG: "
+               "el resultado es desconocido, conciliar con SG antes de reintentar",
+    )
+
+
+# =========
+# Store en memoria (sin BD: un solo proceso)
+# =========
+class _Entrada:
+    __slots__ = ("huella", "futuro", "vence")
+
+    def __init__(self, huella: str, futuro: asyncio.Future, vence: float):
+        self.huella = huella
+        self.futuro = futuro
+        self.vence = vence
+
+
+def _marcar_leida(futuro: asyncio.Future) -> None:
+    # Evita el warning "exception was never retrieved" si nadie más esperaba
+    if not futuro.cancelled():
+        futuro.exception()
+
+
+class StoreIdempotencia:
+    """
+    Resultados de los POST a SG por Idempotency-Key, en memoria del proceso.
+    Se usa sólo sin BD configurada (proxy /sg suelto, un worker). Sólo lo
+    usan endpoints async (un único event loop), así que no hace falta lock.
+    - Clave nueva: se llama a SG y el resultado (o el 4xx) queda guardado TTL segundos.
+    - Clave en vuelo: se espera el mismo futuro, sin segundo request a SG.
+    - Clave completada: se repite la respuesta guardada.
+    - 5xx, cancelación o error: la clave queda como resultado desconocido y
+      los reintentos reciben 502 hasta que venza (no se vuelve a llamar a SG).
+    Los 409/429 no se guardan.
+    """
+
+    def __init__(self, ttl: int, maximo: int):
+        self._ttl = ttl
+        self._maximo = maximo
+        self._items: "OrderedDict[str, _Entrada]" = OrderedDict()
+
+    def _purgar(self) -> None:
+        ahora = time.monotonic()
+        while self._items:
+            clave, e = next(iter(self._items.items()))
+            vencida = e.vence < ahora and e.futuro.done()
+            if not (vencida or (len(self._items) > self._maximo and e.futuro.done())):
+                break
+            del self._items[clave]
+
+    async def ejecutar(
+        self, alcance: str, entidad: str, clave: str, huella: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Devuelve (resultado, repetido)."""
+        self._purgar()
+        clave = f"{alcance}|{entidad}|{clave}"
+        e = self._items.get(clave)
+        if e is not None:
+            if e.huella != huella:
+                raise HTTPException(422, detail="Idempotency-Key ya usada con otro payload")
+            return await asyncio.shield(e.futuro), True
+
+        futuro = asyncio.get_running_loop().create_future()
+        futuro.add_done_callback(_marcar_leida)
+        self._items[clave] = _Entrada(huella, futuro, time.monotonic() + self._ttl)
+        try:
+            resultado = await fn()
+        except HTTPException as exc:
+            if exc.status_code in NO_CACHEABLES:
+                self._items.pop(clave, None)
+                futuro.set_exception(exc)
+            else:
+                futuro.set_exception(exc if exc.status_code < 500 else _desconocido())
+            raise
+        except BaseException:
+            # CancelledError incluido: SG pudo haber recibido el request
+            futuro.set_exception(_desconocido())
+            raise
+        futuro.set_result(resultado)
+        return resultado, False
+
+
+# =========
+# Store en BD (tabla idempotencia_sg, scriptIDEMPOTENCIA.sql)
+# =========
+def _reclamar(alcance: str, entidad: str, clave: str, huella: str, cfg: IdempotenciaConfig) -> Optional[Dict[str, Any]]:
+    """
+    INSERT de la clave en estado en_curso. Devuelve None si este request la
+    tomó, o la fila existente (compartida por todos los workers y nodos).
+    """
+    from sqlalchemy.exc import IntegrityError
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    ahora = datetime.now()
+    db = nueva_sesion()
+    try:
+        for _ in range(2):
+            db.add(IdempotenciaSG(
+                alcance=alcance, id_entidad=entidad, clave=clave, huella=huella, estado=EN_CURSO,
+                fecha_creacion=ahora, vence=ahora + timedelta(seconds=cfg.ttl),
+            ))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                db.rollback()
+            fila = db.get(IdempotenciaSG, (alcance, entidad, clave), with_for_update=True)
+            if fila is None:
+                continue  # se purgó entre el INSERT y el SELECT
+            if fila.estado == COMPLETADA and fila.vence < ahora:
+                # Vencida: la clave se puede volver a usar
+                db.delete(fila)
+                db.commit()
+                continue
+            if fila.estado == EN_CURSO and fila.fecha_creacion < ahora - timedelta(seconds=cfg.en_curso):
+                fila.estado = DESCONOCIDO
+                db.commit()
+            existente = {"huella": fila.huella, "estado": fila.estado,
+                         "status_code": fila.status_code, "respuesta": fila.respuesta}
+            db.rollback()
+            return existente
+        raise HTTPException(409, detail="Idempotency-Key en conflicto, reintentar")
+    finally:
+        db.close()
+
+
+def _leer(alcance: str, entidad: str, clave: str) -> Optional[Dict[str, Any]]:
+    """Estado actual de la clave (sin lock), o None si ya no existe."""
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    db = nueva_sesion()
+    try:
+        fila = db.get(IdempotenciaSG, (alcance, entidad, clave))
+        if fila is None:
+            return None
+        return {"huella": fila.huella, "estado": fila.estado,
+                "status_code": fila.status_code, "respuesta": fila.respuesta}
+    finally:
+        db.close()
+
+
+def _cerrar(alcance: str, entidad: str, clave: str, estado: Optional[str],
+            status_code: Optional[int] = None, respuesta: Optional[str] = None) -> None:
+    """Guarda el desenlace; estado None libera la clave (409/429: se puede reintentar)."""
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    db = nueva_sesion()
+    try:
+        fila = db.get(IdempotenciaSG, (alcance, entidad, clave))
+        if fila is not None:
+            if estado is None:
+                db.delete(fila)
+            else:
+                fila.estado, fila.status_code, fila.respuesta = estado, status_code, respuesta
+                fila.fecha_fin = datetime.now()
+            db.commit()
+    finally:
+        db.close()
+
+
+def purgar_vencidas() -> int:
+    """Borra claves completadas y vencidas. Las desconocidas quedan hasta conciliarlas."""
+    from sqlalchemy import delete
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    db = nueva_sesion()
+    try:
+        r = db.execute(delete(IdempotenciaSG).where(
+            IdempotenciaSG.estado == COMPLETADA, IdempotenciaSG.vence < datetime.now(),
+        ))
+        db.commit()
+        return r.rowcount
+    finally:
+        db.close()
+
+
+def _replay(existente: Dict[str, Any], huella: str) -> Any:
+    if existente["huella"] != huella:
+        raise HTTPException(422, detail="Idempotency-Key ya usada con otro payload")
+    if existente["estado"] == EN_CURSO:
+        raise _en_curso()
+    if existente["estado"] == DESCONOCIDO:
+        raise _desconocido()
+    respuesta = json.loads(existente["respuesta"]) if existente["respuesta"] else None
+    if existente["status_code"] and existente["status_code"] >= 400:
+        raise HTTPException(existente["status_code"], detail=respuesta)
+    return respuesta
+
+
+class StoreIdempotenciaDB:
+    """
+    Mismas reglas que StoreIdempotencia pero compartido entre workers y nodos:
+    la clave se reserva con un INSERT (PK) antes de llamar a SG.
+    - Clave en vuelo en este proceso: se espera el mismo futuro (ni INSERT ni
+      segundo request a SG).
+    - Clave en curso en otro worker/nodo: se relee la fila cada
+      IDEMPOTENCIA_SONDEO_MS hasta que se resuelva; si sigue en curso pasados
+      IDEMPOTENCIA_ESPERA_SEGS, 409 (reintentar más tarde).
+    - Clave completada: se repite la respuesta (o el 4xx) guardada.
+    - Resultado desconocido (5xx, timeout, cancelación, error, proceso caído
+      con la clave en curso más de IDEMPOTENCIA_EN_CURSO_SEGS): 502 hasta que
+      se concilie con SG y se libere (app/utilidades/idempotencia.py).
+    """
+
+    def __init__(self, cfg: IdempotenciaConfig):
+        self._cfg = cfg
+        self._ultima_purga = 0.0
+        # alcance|entidad|clave -> (huella, futuro) de los requests en vuelo de este proceso
+        self._en_vuelo: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def _purgar(self) -> None:
+        if time.monotonic() - self._ultima_purga < self._cfg.purga:
+            return
+        self._ultima_purga = time.monotonic()
+        await asyncio.to_thread(purgar_vencidas)
+
+    async def ejecutar(
+        self, alcance: str, entidad: str, clave: str, huella: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Devuelve (resultado, repetido)."""
+        k = f"{alcance}|{entidad}|{clave}"
+        local = self._en_vuelo.get(k)
+        if local is not None:
+            if local[0] != huella:
+                raise HTTPException(422, detail="Idempotency-Key ya usada con otro payload")
+            return await asyncio.shield(local[1]), True
+
+        futuro = asyncio.get_running_loop().create_future()
+        futuro.add_done_callback(_marcar_leida)
+        self._en_vuelo[k] = (huella, futuro)
+        llamada = False
+
+        async def llamar() -> Any:
+            nonlocal llamada
+            llamada = True
+            return await fn()
+
+        try:
+            resultado, repetido = await self._resolver(alcance, entidad, clave, huella, llamar)
+        except BaseException as exc:
+            # Los que esperaban reciben lo mismo que recibiría un reintento:
+            # 5xx/cancelación con SG ya llamado -> desconocido; sin llamarlo -> 409
+            if isinstance(exc, HTTPException) and not (llamada and exc.status_code >= 500):
+                futuro.set_exception(exc)
+            else:
+                futuro.set_exception(_desconocido() if llamada else _en_curso())
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado, repetido
+        finally:
+            self._en_vuelo.pop(k, None)
+
+    async def _resolver(
+        self, alcance: str, entidad: str, clave: str, huella: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        await self._purgar()
+        existente = await asyncio.to_thread(_reclamar, alcance, entidad, clave, huella, self._cfg)
+        limite = time.monotonic() + self._cfg.espera
+        while (existente is not None and existente["estado"] == EN_CURSO
+               and existente["huella"] == huella and time.monotonic() < limite):
+            # En curso en otro worker/nodo: se espera su desenlace
+            await asyncio.sleep(self._cfg.sondeo)
+            existente = await asyncio.to_thread(_leer, alcance, entidad, clave)
+            if existente is None:
+                # La liberó (409/429) o se purgó: se vuelve a reclamar
+                existente = await asyncio.to_thread(_reclamar, alcance, entidad, clave, huella, self._cfg)
+        if existente is not None:
+            return _replay(existente, huella), True
+
+        async def cerrar(*args) -> None:
+            # shield: el desenlace se guarda aunque el request se cancele
+            await asyncio.shield(asyncio.to_thread(_cerrar, alcance, entidad, clave, *args))
+
+        try:
+            resultado = await fn()
+        except HTTPException as exc:
+            if exc.status_code in NO_CACHEABLES:
+                await cerrar(None)
+            elif exc.status_code >= 500:
+                await cerrar(DESCONOCIDO, exc.status_code)
+            else:
+                await cerrar(COMPLETADA, exc.status_code, json.dumps(jsonable_encoder(exc.detail), ensure_ascii=False))
+            raise
+        except BaseException:
+            await cerrar(DESCONOCIDO)
+            raise
+        await cerrar(COMPLETADA, 200, json.dumps(jsonable_encoder(resultado), ensure_ascii=False))
+        return resultado, False
+
+
+def pendientes(limite: int = 100) -> List[Dict[str, Any]]:
+    """Claves en curso o con resultado desconocido (para conciliar a mano)."""
+    from sqlalchemy import select
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    db = nueva_sesion()
+    try:
+        t = IdempotenciaSG
+        filas = db.execute(
+            select(t).where(t.estado != COMPLETADA).order_by(t.fecha_creacion).limit(limite)
+        ).scalars()
+        return [{"alcance": f.alcance, "entidad": f.id_entidad, "clave": f.clave, "estado": f.estado,
+                 "status_code": f.status_code, "fecha_creacion": f.fecha_creacion.isoformat()} for f in filas]
+    finally:
+        db.close()
+
+
+def resolver(alcance: str, entidad: str, clave: str, respuesta: Optional[Any] = None) -> bool:
+    """
+    Cierra una clave conciliada con SG: con `respuesta` queda completada (los
+    reintentos la repiten); sin ella se libera y el próximo reintento llama a SG.
+    """
+    from app.database import nueva_sesion
+    from app.models import IdempotenciaSG
+
+    db = nueva_sesion()
+    try:
+        fila = db.get(IdempotenciaSG, (alcance, entidad, clave))
+        if fila is None:
+            return False
+        if respuesta is None:
+            db.delete(fila)
+        else:
+            fila.estado, fila.status_code = COMPLETADA, 200
+            fila.respuesta = json.dumps(respuesta, ensure_ascii=False)
+            fila.fecha_fin = datetime.now()
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        cfg = IdempotenciaConfig()
+        _store = StoreIdempotenciaDB(cfg) if db_configurada() else StoreIdempotencia(cfg.ttl, cfg.maximo)
+    return _store
+
+
+async def idempotente(
+    clave: Optional[str],
+    alcance: str,
+    entidad_id: Optional[str],
+    payload: Any,
+    response: Response,
+    fn: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    Envuelve un POST a SG. Sin header Idempotency-Key se comporta como antes.
+    La clave se aísla por endpoint (`alcance`) y entidad.
+    """
+    if not clave:
+        return await fn()
+    if len(clave) > MAX_LARGO_CLAVE:
+        raise HTTPException(400, detail=f"Idempotency-Key supera {MAX_LARGO_CLAVE} caracteres")
+    resultado, repetido = await get_store().ejecutar(alcance, entidad_id or "", clave, huella_de(payload), fn)
+    if repetido:
+        response.headers["Idempotent-Replayed"] = "true"
+    return resultado
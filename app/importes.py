@@ -0,0 +1,58 @@
+# importes.py
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Annotated, Any, Iterable
+
+from pydantic import BeforeValidator
+from sqlalchemy import BigInteger, cast
+
+# La columna importe es decimal(18,2): todo el dinero se maneja como Decimal
+# con 2 decimales, y los totales se acumulan en centavos (int) para no
+# pasar nunca por float.
+CENTAVO = Decimal("0.01")
+
+
+def redondear(valor: Any) -> Decimal:
+    """
+    Normaliza a Decimal con 2 decimales (mismo redondeo que SQL Server al
+    convertir a decimal(18,2)). Los float se convierten vía str para no
+    arrastrar el error binario (1500.1 -> "1500.1").
+    """
+    if isinstance(valor, float):
+        valor = repr(valor)
+    try:
+        importe = Decimal(valor)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"importe inválido: {valor!r}")
+    if not importe.is_finite():
+        raise ValueError(f"importe inválido: {valor!r}")
+    try:
+        return importe.quantize(CENTAVO, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        # Más dígitos que la precisión del contexto (1e30): ValueError para que
+        # Pydantic responda 422 y no se escape un ArithmeticError como 500
+        raise ValueError(f"importe fuera de rango: {valor!r}")
+
+
+# Tipo para schemas Pydantic. En JSON de respuesta se serializa como string
+# ("1500.50") para que el ERP lo reciba exacto.
+Importe = Annotated[Decimal, BeforeValidator(redondear)]
+
+
+def a_centavos(importe: Any) -> int:
+    return int(redondear(importe).scaleb(2))
+
+
+def desde_centavos(centavos: int) -> Decimal:
+    return Decimal(centavos).scaleb(-2).quantize(CENTAVO)
+
+
+def sumar_centavos(importes: Iterable[Any]) -> int:
+    return sum(a_centavos(i) for i in importes)
+
+
+def centavos_sql(columna):
+    """
+    Expresión SQL: importe * 100 como bigint. SUM() sobre esto es aritmética
+    entera exacta en el servidor, sin re-redondear el total.
+    """
+    return cast(columna * 100, BigInteger)
@@ -0,0 +1,394 @@
+# ingesta.py
+import os
+import json
+import glob
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.config import env
+from app.models import Transaccion, ESTADO_ANULADA, ESTADO_REGISTRADA
+from app.reversas import vincular_reversa
+from app.schemas import TransaccionNotificada
+
+# =========
+# Prevalidación local contra las restricciones de transacciones_agilpagos
+# (scriptAGILPAGOS.sql / scriptREVERSAS.sql): una fila que el servidor va a
+# rechazar no llega a abrir conexión
+# =========
+VARCHAR_50 = ("idTransaccion", "numeroCuenta", "cvu", "observaciones", "idTransaccionAnulada", "idTransaccionOriginante")
+NOT_NULL = ("idTransaccion", "numeroCuenta", "cvu", "observaciones")
+MAX_IMPORTE = Decimal(10) ** 16        # decimal(18,2)
+RANGO_INT = (-2**31, 2**31 - 1)
+MIN_DATETIME = datetime(1753, 1, 1)    # datetime de SQL Server
+
+
+class FilaInvalida(ValueError):
+    def __init__(self, errores: List[str]):
+        super().__init__("; ".join(errores))
+        self.errores = errores
+
+
+def validar_columnas(data: TransaccionNotificada) -> datetime:
+    """Devuelve fecha_operacion ya parseada o levanta FilaInvalida con todos los errores."""
+    errores = []
+    for campo in NOT_NULL:
+        if getattr(data, campo) is None:
+            errores.append(f"{campo}: no puede ser nulo")
+    for campo in VARCHAR_50:
+        valor = getattr(data, campo)
+        if valor is not None and len(valor) > 50:
+            errores.append(f"{campo}: {len(valor)} caracteres (máx. 50)")
+    if abs(data.importe) >= MAX_IMPORTE:
+        errores.append("importe: excede decimal(18,2)")
+    if not RANGO_INT[0] <= data.idTipoTransaccion <= RANGO_INT[1]:
+        errores.append("idTipoTransaccion: fuera de rango int")
+    fecha = None
+    try:
+        fecha = datetime.fromisoformat(data.fechaOperacion)
+        if fecha.tzinfo is not None:
+            errores.append("fechaOperacion: con zona horaria (la columna es datetime local)")
+        elif fecha < MIN_DATETIME:
+            errores.append("fechaOperacion: anterior a 1753-01-01")
+    except ValueError:
+        errores.append(f"fechaOperacion: formato inválido ({data.fechaOperacion!r})")
+    if errores:
+        raise FilaInvalida(errores)
+    return fecha
+
+
+def construir(data: TransaccionNotificada, fecha_operacion: datetime, registro: datetime) -> Transaccion:
+    return Transaccion(
+        id_transaccion=data.idTransaccion,
+        tipo=data.idTipoTransaccion,
+        numero_cuenta=data.numeroCuenta,
+        importe=data.importe,
+        fecha_operacion=fecha_operacion,
+        cvu=data.cvu,
+        observaciones=data.observaciones,
+        fecha_registro=registro,
+        id_transaccion_anulada=data.idTransaccionAnulada,
+        id_transaccion_originante=data.idTransaccionOriginante,
+        estado=ESTADO_REGISTRADA,
+    )
+
+
+def _preparar(nuevas: List[Transaccion]) -> List[tuple]:
+    # Antes del commit: después los atributos expiran y leerlos sería otro SELECT por fila
+    return [(t.numero_cuenta, t.fecha_operacion, [t.id_transaccion, t.id_transaccion_anulada]) for t in nuevas]
+
+
+def _publicar(preparados: List[tuple]) -> None:
+    # Con el commit hecho: se invalidan las respuestas cacheadas y se despierta
+    # la cola de notificaciones de este proceso (los demás la leen por polling)
+    from app.cache_respuestas import get_cache
+    from app.notificaciones import broker
+
+    cache = get_cache()
+    for cuenta, fecha, ids in preparados:
+        cache.invalidar(cuenta, fecha, ids)
+    broker.avisar()
+
+
+# =========
+# Alta
+# =========
+OK = {"status": "ok", "mensaje": "Transacción registrada correctamente"}
+DUPLICADO = {"status": "duplicado", "mensaje": "La transacción ya existe"}
+ERROR_INTERNO = {"status": "error_interno", "mensaje": "Error inesperado al procesar la transacción"}
+
+# SQL Server admite hasta 2100 parámetros por sentencia
+MAX_PARAMETROS = 2000
+
+
+def registrar(db: Session, data: TransaccionNotificada) -> Dict[str, str]:
+    """Alta de una notificación (webhook). Levanta FilaInvalida o el error de BD."""
+    fecha = validar_columnas(data)
+
+    # Validar duplicado
+    if db.query(Transaccion.id_transaccion).filter_by(id_transaccion=data.idTransaccion).first():
+        return DUPLICADO
+
+    nueva = construir(data, fecha, datetime.now())
+    db.add(nueva)
+    # Reversa -> original en la misma transacción que el alta
+    vincular_reversa(db, nueva)
+    preparados = _preparar([nueva])
+    db.commit()
+    _publicar(preparados)
+    return OK
+
+
+def _en_tramos(ids: List[str]) -> Iterator[List[str]]:
+    for i in range(0, len(ids), MAX_PARAMETROS):
+        yield ids[i:i + MAX_PARAMETROS]
+
+
+def registrar_lote(
+    db: Session,
+    datos: List[TransaccionNotificada],
+    al_fallar: Optional[Callable[[TransaccionNotificada, BaseException], None]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Alta de varias notificaciones en una transacción: un SELECT de existentes,
+    un SELECT de reversas previas, un UPDATE de originales y un INSERT por lote
+    (en vez de 3-4 round trips por fila). Devuelve un {"status", "mensaje"} por
+    item, en el orden de `datos`, con la misma semántica que `registrar`.
+    Si el commit falla se reintenta fila por fila para aislar la mala.
+    `al_fallar(data, error)` se llama por cada item inválido o con error.
+    """
+    def fallo(i: int, d: TransaccionNotificada, e: BaseException, respuesta: Dict[str, str]) -> None:
+        resultado[i] = respuesta
+        if al_fallar:
+            al_fallar(d, e)
+
+    resultado: List[Optional[Dict[str, str]]] = [None] * len(datos)
+    validas: Dict[str, Tuple[int, TransaccionNotificada, datetime]] = {}
+    vistos = set()
+    for i, d in enumerate(datos):
+        # La collation de SQL Server no distingue mayúsculas: "ABC" y "abc" son el mismo id
+        if d.idTransaccion.lower() in vistos:
+            resultado[i] = {"status": "duplicado", "mensaje": "Repetida dentro del lote"}
+            continue
+        vistos.add(d.idTransaccion.lower())
+        try:
+            validas[d.idTransaccion] = (i, d, validar_columnas(d))
+        except FilaInvalida as e:
+            fallo(i, d, e, {"status": "error_validacion", "mensaje": str(e)})
+
+    if validas:
+        existentes = set()
+        for tramo in _en_tramos(list(validas)):
+            existentes.update(db.execute(
+                select(Transaccion.id_transaccion).where(Transaccion.id_transaccion.in_(tramo))
+            ).scalars())
+        # La BD devuelve el id como está guardado, que puede diferir en mayúsculas del recibido
+        por_minuscula = {id_tx.lower(): id_tx for id_tx in validas}
+        for id_tx in existentes:
+            resultado[validas.pop(por_minuscula[id_tx.lower()])[0]] = DUPLICADO
+
+    if validas:
+        # Originales ya anulados por una reversa (en la BD o en el mismo lote)
+        anuladas = {d.idTransaccionAnulada.lower() for _, d, _ in validas.values() if d.idTransaccionAnulada}
+        for tramo in _en_tramos(list(validas)):
+            anuladas.update(a.lower() for a in db.execute(
+                select(Transaccion.id_transaccion_anulada).where(Transaccion.id_transaccion_anulada.in_(tramo))
+            ).scalars())
+
+        registro = datetime.now()
+        nuevas = []
+        for id_tx, (_, d, fecha) in validas.items():
+            t = construir(d, fecha, registro)
+            if id_tx.lower() in anuladas:
+                t.estado = ESTADO_ANULADA
+            nuevas.append(t)
+        originales = [t.id_transaccion_anulada for t in nuevas if t.id_transaccion_anulada]
+        try:
+            for tramo in _en_tramos(originales):
+                db.execute(
+                    update(Transaccion).where(Transaccion.id_transaccion.in_(tramo)).values(estado=ESTADO_ANULADA),
+                    execution_options={"synchronize_session": False},
+                )
+            db.add_all(nuevas)
+            preparados = _preparar(nuevas)
+            db.commit()
+        except Exception:
+            db.rollback()
+            for i, d, _ in validas.values():
+                try:
+                    resultado[i] = registrar(db, d)
+                except Exception as e:
+                    db.rollback()
+                    fallo(i, d, e, ERROR_INTERNO)
+        else:
+            _publicar(preparados)
+            for i, _, _ in validas.values():
+                resultado[i] = OK
+    return resultado
+
+
+# =========
+# Dead-letter: notificaciones que no se pudieron registrar, tal cual llegaron
+# =========
+class ValidacionSchema(ValueError):
+    """El body no pasó TransaccionNotificada (lo que FastAPI contesta con 422)."""
+
+
+class DeadLetterConfig:
+    def __init__(self):
+        self.directorio = env("DEADLETTER_DIR", "deadletter")
+
+
+class DeadLetter:
+    """
+    Un JSON por línea: {"fecha", "id", "clase", "error", "payload"}. Un archivo
+    por día y por proceso (deadletter-YYYYMMDD-<pid>.jsonl), así varios workers
+    nunca escriben el mismo archivo.
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def guardar(self, payload: Any, error: BaseException, id_transaccion: Optional[str] = None) -> None:
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", errors="replace")
+        if id_transaccion is None and isinstance(payload, dict):
+            id_transaccion = payload.get("idTransaccion")
+        self.escribir({
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "id": id_transaccion,
+            "clase": type(error).__name__,
+            "error": str(error)[:500],
+            "payload": payload,
+        })
+
+    def escribir(self, registro: Dict[str, Any]) -> None:
+        linea = json.dumps(registro, ensure_ascii=False, separators=(",", ":"), default=str)
+        path = os.path.join(self.directorio, f"deadletter-{datetime.now():%Y%m%d}-{os.getpid()}.jsonl")
+        try:
+            with self._lock:
+                os.makedirs(self.directorio, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+        except OSError as e:
+            # Último recurso: que el payload quede al menos en el log
+            logging.error(f"No se pudo escribir dead-letter ({e}): {linea}")
+
+
+_deadletter: Optional[DeadLetter] = None
+
+
+def get_deadletter() -> DeadLetter:
+    global _deadletter
+    if _deadletter is None:
+        _deadletter = DeadLetter(DeadLetterConfig().directorio)
+    return _deadletter
+
+
+def payload_de(data: TransaccionNotificada) -> Dict[str, Any]:
+    """Payload con los nombres de Agilpagos (CVU, importes como string exacto)."""
+    return data.model_dump(mode="json", by_alias=True)
+
+
+def archivos_deadletter(directorio: str) -> List[str]:
+    # .reproceso: tomados por un reproceso que no terminó (se vuelven a leer)
+    return sorted(glob.glob(os.path.join(directorio, "deadletter-*.jsonl"))
+                  + glob.glob(os.path.join(directorio, "deadletter-*.jsonl.reproceso")))
+
+
+def leer_deadletter(archivos: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for path in archivos:
+        with open(path, "r", encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip():
+                    yield path, json.loads(linea)
+
+
+# =========
+# Reproceso masivo (ver app/utilidades/reprocesar_deadletter.py)
+# =========
+def reprocesar(
+    directorio: str,
+    lote: int = 500,
+    hilos: int = 4,
+    clase: Optional[str] = None,
+    simular: bool = False,
+    progreso: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Re-ingesta el dead-letter: deduplica por idTransaccion (queda el último),
+    revalida schema y columnas localmente y registra por lotes en `hilos`
+    sesiones en paralelo. Primero los originales y después las reversas, para
+    que una reversa nunca se procese antes que su original en otro hilo.
+    Lo que vuelve a fallar queda en un dead-letter nuevo; los archivos leídos
+    terminan renombrados a .procesado. Corre fuera de la API: los workers ven
+    las filas nuevas con su cola de notificaciones (publican e invalidan su
+    cache de respuestas a los NOTIF_POLL_MS).
+    """
+    from app.database import nueva_sesion
+
+    archivos = archivos_deadletter(directorio)
+    if not simular:
+        # Se apartan antes de leer: lo que la API agregue mientras tanto va a
+        # un archivo nuevo. En Windows un archivo abierto no se puede renombrar:
+        # queda para la próxima corrida.
+        tomados = []
+        for path in archivos:
+            destino = path if path.endswith(".reproceso") else path + ".reproceso"
+            try:
+                os.replace(path, destino)
+                tomados.append(destino)
+            except OSError:
+                pass
+        archivos = tomados
+
+    por_id, ajenos = {}, []
+    for _, reg in leer_deadletter(archivos):
+        if clase is not None and reg.get("clase") != clase:
+            ajenos.append(reg)  # otra clase: se conserva tal cual
+            continue
+        por_id[reg.get("id") or f"sin-id-{len(por_id)}"] = reg
+    stats = {"leidas": len(por_id), "ok": 0, "duplicado": 0, "invalidas": 0, "error": 0}
+    fallidas: List[Tuple[Dict[str, Any], BaseException]] = []
+
+    datos: List[TransaccionNotificada] = []
+    origen: Dict[str, Dict[str, Any]] = {}
+    for reg in por_id.values():
+        try:
+            d = TransaccionNotificada.model_validate(reg["payload"])
+            validar_columnas(d)
+            if d.idTransaccion in origen:
+                continue
+            origen[d.idTransaccion] = reg
+            datos.append(d)
+        except (ValidationError, FilaInvalida, TypeError) as e:
+            stats["invalidas"] += 1
+            fallidas.append((reg, e))
+    if simular:
+        return {**stats, "a_registrar": len(datos)}
+
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+
+    def un_lote(chunk: List[TransaccionNotificada]) -> None:
+        errores: List[Tuple[Dict[str, Any], BaseException]] = []
+        db = nueva_sesion()
+        try:
+            res = registrar_lote(db, chunk, lambda d, e: errores.append((origen[d.idTransaccion], e)))
+        except Exception as e:
+            # BD caída u otro error global: todo el lote vuelve al dead-letter
+            res = [ERROR_INTERNO] * len(chunk)
+            errores = [(origen[d.idTransaccion], e) for d in chunk]
+        finally:
+            db.close()
+        with lock:
+            for r in res:
+                clave = {"error_validacion": "invalidas", "error_interno": "error"}.get(r["status"], r["status"])
+                stats[clave] += 1
+            fallidas.extend(errores)
+            if progreso:
+                progreso({**stats, "segundos": int(time.perf_counter() - t0)})
+
+    originales = [d for d in datos if not d.idTransaccionAnulada]
+    reversas = [d for d in datos if d.idTransaccionAnulada]
+    with ThreadPoolExecutor(max_workers=max(1, hilos)) as pool:
+        for fase in (originales, reversas):
+            list(pool.map(un_lote, [fase[i:i + lote] for i in range(0, len(fase), lote)]))
+
+    dl = DeadLetter(directorio)
+    for reg in ajenos:
+        dl.escribir(reg)
+    for reg, e in fallidas:
+        dl.guardar(reg["payload"], e, reg.get("id"))
+    for path in archivos:
+        os.replace(path, path[:-len(".reproceso")] + ".procesado")
+    return {**stats, "segundos": round(time.perf_counter() - t0, 2)}
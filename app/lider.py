@@ -0,0 +1,212 @@
+# lider.py
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+from app.config import env
+from app.database import db_configurada
+
+# =========
+# Config (lazy)
+# =========
+class LiderConfig:
+    def __init__(self):
+        # auto: applock de SQL Server si la BD es mssql; si no, lock de archivo (un solo host)
+        self.modo = env("LIDER_MODO", "auto")                        # auto | db | archivo
+        self.recurso = env("LIDER_RECURSO", "agilpagos_jobs")
+        self.lock_path = env("LIDER_LOCK_PATH", "agilpagos_lider.lock")
+        self.reintento_segs = float(env("LIDER_REINTENTO_SEGS", "15"))
+
+
+# =========
+# Locks (se toman sin esperar; los libera el servidor / el SO si el proceso muere)
+# =========
+class _LockDB:
+    """
+    sp_getapplock con owner Session en una conexión dedicada que queda tomada
+    mientras el proceso sea líder. Vale entre nodos detrás del balanceador.
+    """
+
+    def __init__(self, recurso: str):
+        self.recurso = recurso
+        self.conn = None
+
+    def tomar(self) -> bool:
+        from sqlalchemy import text
+        from app.database import get_engine
+
+        conn = get_engine().connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            r = conn.execute(
+                text(
+                    "SET NOCOUNT ON; DECLARE @r int; "
+                    "EXEC @r = sp_getapplock @Resource = :recurso, @LockMode = 'Exclusive', "
+                    "@LockOwner = 'Session', @LockTimeout = 0; SELECT @r"
+                ),
+                {"recurso": self.recurso},
+            ).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if r is None or r < 0:
+            conn.close()
+            return False
+        self.conn = conn
+        return True
+
+    def vigente(self) -> bool:
+        from sqlalchemy import text
+
+        try:
+            modo = self.conn.execute(
+                text("SELECT APPLOCK_MODE('public', :recurso, 'Session')"), {"recurso": self.recurso}
+            ).scalar()
+        except Exception:
+            return False
+        return modo == "Exclusive"
+
+    def soltar(self) -> None:
+        if self.conn is None:
+            return
+        # invalidate: la conexión no vuelve al pool con el applock tomado
+        try:
+            self.conn.invalidate()
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+
+class _LockArchivo:
+    """Lock exclusivo del SO sobre un archivo (workers de uvicorn del mismo host)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = None
+
+    def tomar(self) -> bool:
+        f = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.f = f
+        return True
+
+    def vigente(self) -> bool:
+        return self.f is not None
+
+    def soltar(self) -> None:
+        if self.f is not None:
+            self.f.close()  # cerrar el descriptor libera el lock
+            self.f = None
+
+
+# =========
+# Jobs únicos
+# =========
+class TareaUnica:
+    """Envuelve un worker `async def` (loop infinito) para que lo arranque y cancele el líder."""
+
+    def __init__(self, nombre: str, worker: Callable[[], Awaitable[Any]]):
+        self.nombre = nombre
+        self._worker = worker
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._worker())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+
+class Liderazgo:
+    """
+    Con varios workers (app/utilidades/servidor.py) los jobs que no deben
+    multiplicarse (conciliación, webhooks salientes, refresco de catálogos,
+    export de reportes) corren sólo en el proceso que tiene el lock. Los demás
+    reintentan cada LIDER_REINTENTO_SEGS: si el líder cae (o pierde la conexión
+    del applock) otro toma el lugar. Cada job implementa iniciar()/detener().
+    """
+
+    def __init__(self, cfg: LiderConfig):
+        self.cfg = cfg
+        self.es_lider = False
+        self._jobs: List[Any] = []
+        self._lock = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def agregar(self, job: Any) -> None:
+        self._jobs.append(job)
+
+    def _nuevo_lock(self):
+        modo = self.cfg.modo
+        if modo == "auto":
+            from app.database import get_engine
+            modo = "db" if db_configurada() and get_engine().dialect.name == "mssql" else "archivo"
+        return _LockDB(self.cfg.recurso) if modo == "db" else _LockArchivo(self.cfg.lock_path)
+
+    async def _asumir(self) -> None:
+        self.es_lider = True
+        logging.error(f"Proceso {os.getpid()} es líder: arranca los jobs únicos")
+        for job in self._jobs:
+            job.iniciar()
+
+    async def _ceder(self) -> None:
+        self.es_lider = False
+        for job in reversed(self._jobs):
+            try:
+                await job.detener()
+            except Exception as e:
+                logging.error(f"Error al detener job único: {e}")
+        await asyncio.to_thread(self._lock.soltar)
+
+    async def _ciclo(self) -> None:
+        while True:
+            try:
+                if self._lock is None:
+                    self._lock = self._nuevo_lock()
+                if not self.es_lider:
+                    if await asyncio.to_thread(self._lock.tomar):
+                        await self._asumir()
+                elif not await asyncio.to_thread(self._lock.vigente):
+                    logging.error(f"Proceso {os.getpid()} perdió el lock de líder: se detienen los jobs únicos")
+                    await self._ceder()
+            except Exception as e:
+                logging.error(f"Elección de líder: {e}")
+            await asyncio.sleep(self.cfg.reintento_segs)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        if self.es_lider:
+            await self._ceder()
+        self._jobs = []
+
+
+_lider: Optional[Liderazgo] = None
+
+
+def get_lider() -> Liderazgo:
+    global _lider
+    if _lider is None:
+        _lider = Liderazgo(LiderConfig())
+    return _lider
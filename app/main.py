@@ -1,39 +1,94 @@
-from fastapi import FastAPI, Depends, Security
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Security, Request, Body, HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
+from pydantic import ValidationError
 from app.schemas import TransaccionNotificada
-from app.database import SessionLocal, AUTH_TOKEN
-from app.models import Transaccion
+from app.config import cargar_entorno, configurar_logging, env
+from app.database import get_db, cerrar_engine, get_auth_token
+from app.seguridad import security
+from app.ingesta import (
+    registrar, registrar_lote, FilaInvalida, ValidacionSchema, ERROR_INTERNO, get_deadletter, payload_de,
+)
+from app.auth_sg import cerrar_recursos_sg
 from app.sg import router as sg_router
-from datetime import datetime
+from app.firma import FirmaMiddleware
+from app.conciliacion import worker_conciliacion
+from app.notificaciones import router as notif_router, Despachador, ColaTransacciones
+from app.transacciones import router as transacciones_router
+from app.reportes import router as reportes_router, worker_reportes
+from app.monitor_loop import get_monitor
+from app.salud import router as salud_router, proceso, get_sondas, instalar_prestop
+from app.lider import get_lider, TareaUnica
+from app.catalogos import get_catalogos
+from app.directorio import get_directorio
+from app.perfilado import router as perfil_router, PerfilMiddleware
+from app.admision import AdmisionMiddleware
 import logging
-from logging.handlers import RotatingFileHandler
+import anyio.to_thread
+from typing import Any, Dict, List, Optional
 
-app = FastAPI()
-security = HTTPBearer()
-app.include_router(sg_router, prefix="/sg", tags=["SG"])
 
-# Configuración del logging para registrar errores 
-handler = RotatingFileHandler(
-    "errores.log",
-    maxBytes=1_000_000,  # 1 MB
-    backupCount=5        # hasta 5 archivos .log antiguos
-)
-logging.basicConfig(
-    handlers=[handler],
-    level=logging.ERROR,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+# Inicialización diferida: nada se conecta al importar el módulo.
+# El engine de BD y el cliente HTTP de SG se crean en el primer uso.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cargar_entorno()
+    configurar_logging()
+    # recibir_transaccion es sync: cada proceso atiende a lo sumo API_HILOS a la vez
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(env("API_HILOS", "40"))
+    monitor = get_monitor()
+    monitor.iniciar()
+    # Cada proceso lee de la BD las transacciones nuevas para sus SSE/WebSocket
+    cola = ColaTransacciones()
+    cola.iniciar()
+    # Jobs que no se multiplican por worker: los corre sólo el proceso líder
+    lider = get_lider()
+    lider.agregar(Despachador())
+    lider.agregar(TareaUnica("conciliacion", worker_conciliacion))
+    lider.agregar(TareaUnica("reportes", worker_reportes))
+    # Catálogos: el líder los refresca; los demás workers los cargan al primer uso
+    lider.agregar(get_catalogos())
+    lider.iniciar()
+    directorio = get_directorio()
+    directorio.iniciar()
+    sondas = get_sondas()
+    sondas.iniciar()
+    proceso.marcar_listo()
+    # SIGTERM: /ready pasa a 503 API_PRESTOP_SEGS antes de que uvicorn deje de aceptar
+    instalar_prestop(float(env("API_PRESTOP_SEGS", "10")))
+    yield
+    # Drenado: uvicorn ya dejó de aceptar y terminó los requests en vuelo; acá
+    # el líder vacía los webhooks pendientes y recién después se cierra todo
+    proceso.marcar_drenando()
+    await lider.detener()
+    await cola.detener()
+    await sondas.detener()
+    await directorio.detener()
+    await cerrar_recursos_sg()
+    cerrar_engine()
+    await monitor.detener()
+    for handler in logging.getLogger().handlers:
+        handler.flush()
 
 
-# Dependencia para obtener la sesión de la base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+app = FastAPI(lifespan=lifespan)
+app.include_router(sg_router, prefix="/sg", tags=["SG"])
+app.include_router(notif_router, prefix="/notificaciones", tags=["Notificaciones"])
+app.include_router(transacciones_router, prefix="/transacciones", tags=["Transacciones"])
+app.include_router(reportes_router, prefix="/reportes", tags=["Reportes"])
+app.include_router(salud_router, tags=["Salud"])
+app.include_router(perfil_router, prefix="/admin", tags=["Admin"])
+# Validación de X-Signature sobre el body crudo (antes de Pydantic y get_db)
+app.add_middleware(FirmaMiddleware)
+# Presupuestos por clase (webhook / sg / lectura): corta con 503 antes de la firma y de la BD
+app.add_middleware(AdmisionMiddleware)
+# Fases BD/SG por request, captura de lentos y X-Perfil (el más externo: mide también la firma)
+app.add_middleware(PerfilMiddleware)
+
 
 # Endpoint para recibir transacciones notificadas
 @app.post("/transacciones")
@@ -43,43 +98,94 @@ def recibir_transaccion(
     db: Session = Depends(get_db)
 ):
     token = credentials.credentials
-    if token != AUTH_TOKEN:
+    if token != get_auth_token():
         return {"status": "error", "mensaje": "Token inválido"}
 
     try:
-        # Validar duplicado
-        transaccion_existente = db.query(Transaccion).filter_by(id_transaccion=data.idTransaccion).first()
-        if transaccion_existente:
-            return {"status": "duplicado", "mensaje": "La transacción ya existe"}
-
-        # Registrar nueva transacción
-        nueva = Transaccion(
-            id_transaccion=data.idTransaccion,
-            tipo=data.idTipoTransaccion,
-            numero_cuenta=data.numeroCuenta,
-            importe=data.importe,
-            fecha_operacion=datetime.fromisoformat(data.fechaOperacion),
-            cvu=data.cvu,
-            observaciones=data.observaciones
-        )
-
-        db.add(nueva)
-        db.commit()
-
-        return {"status": "ok", "mensaje": "Transacción registrada correctamente"}
+        respuesta = registrar(db, data)
+        # Titular del CVU desde el directorio en memoria (O(1), sin ir a SG ni a la BD)
+        return {**respuesta, "usuario": get_directorio().buscar(data.cvu)}
+
+    except FilaInvalida as e:
+        # Rechazada localmente (varchar(50), NOT NULL, rangos): sin round trip a la BD
+        logging.error(f"Transacción {data.idTransaccion} inválida: {e}")
+        get_deadletter().guardar(payload_de(data), e, data.idTransaccion)
+        return {"status": "error_validacion", "mensaje": str(e)}
 
     except Exception as e:
         logging.error(f"Error al procesar transacción {data.idTransaccion}: {str(e)}")
-        return {"status": "error_interno", "mensaje": "Error inesperado al procesar la transacción"}
+        get_deadletter().guardar(payload_de(data), e, data.idTransaccion)
+        return ERROR_INTERNO
+
+
+# Lote de notificaciones (reprocesos de Agilpagos, replays propios): una
+# validación por item, un SELECT de duplicados y un commit para todo el lote
+@app.post("/transacciones/batch")
+def recibir_lote(
+    datos: List[Dict[str, Any]] = Body(...),
+    credentials: HTTPAuthorizationCredentials = Security(security),
+    db: Session = Depends(get_db)
+):
+    token = credentials.credentials
+    if token != get_auth_token():
+        return {"status": "error", "mensaje": "Token inválido"}
+    maximo = int(env("TRANSACCIONES_LOTE_MAX", "500"))
+    if len(datos) > maximo:
+        raise HTTPException(status_code=413, detail=f"Máximo {maximo} notificaciones por lote")
+
+    deadletter = get_deadletter()
+
+    def al_fallar(data: TransaccionNotificada, error: BaseException) -> None:
+        logging.error(f"Error al procesar transacción {data.idTransaccion}: {str(error)}")
+        deadletter.guardar(payload_de(data), error, data.idTransaccion)
+
+    resultados: List[Optional[Dict[str, Any]]] = [None] * len(datos)
+    validas, posiciones = [], []
+    for i, item in enumerate(datos):
+        try:
+            validas.append(TransaccionNotificada.model_validate(item))
+            posiciones.append(i)
+        except ValidationError as e:
+            errores = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            deadletter.guardar(item, ValidacionSchema(errores))
+            resultados[i] = {"idTransaccion": item.get("idTransaccion"), "status": "error_validacion", "mensaje": errores}
 
+    if validas:
+        try:
+            estados = registrar_lote(db, validas, al_fallar)
+        except Exception as e:
+            db.rollback()
+            for data in validas:
+                al_fallar(data, e)
+            estados = [ERROR_INTERNO] * len(validas)
+        for i, data, estado in zip(posiciones, validas, estados):
+            resultados[i] = {"idTransaccion": data.idTransaccion, **estado}
 
+    return {"status": "ok", "total": len(datos), "resultados": resultados}
 
-# Endpoint para verificar el estado del servicio
+
+# Body que ni siquiera pasa el schema: se guarda crudo antes del 422 habitual
+@app.exception_handler(RequestValidationError)
+async def validacion_schema(request: Request, exc: RequestValidationError):
+    if request.method == "POST" and request.url.path == "/transacciones":
+        get_deadletter().guardar(exc.body, ValidacionSchema(str(exc.errors())[:500]))
+    return await request_validation_exception_handler(request, exc)
+
+
+
+# Endpoint para verificar el estado del servicio (sólo que el proceso responde;
+# el estado de BD/SG está en /health)
 @app.get("/status")
 def status():
     return {"status": "ok"}
 
 
+# Lag del event loop (p50/p99/máx de las últimas muestras)
+@app.get("/status/loop")
+async def status_loop():
+    return get_monitor().resumen()
+
+
 @app.get('/', response_class=HTMLResponse, tags=['Inicio'])
 async def mensage():
     return '''
@@ -1,15 +1,79 @@
-from sqlalchemy import Column, String, Float, Integer, DateTime
+from sqlalchemy import Column, String, Numeric, Integer, BigInteger, DateTime, FetchedValue, UnicodeText
+from sqlalchemy.dialects.mssql import ROWVERSION
 from app.database import Base
 from datetime import datetime
 
+ESTADO_REGISTRADA = "registrada"
+ESTADO_ANULADA = "anulada"
+
 class Transaccion(Base):
     __tablename__ = "transacciones_agilpagos"
 
     id_transaccion = Column(String, primary_key=True, index=True)
     tipo = Column(Integer)  # 1=Débito, 2=Crédito, etc.
     numero_cuenta = Column(String)
-    importe = Column(Float)
+    importe = Column(Numeric(18, 2))  # decimal(18,2) -> Decimal, nunca float
     fecha_operacion = Column(DateTime)
     cvu = Column(String)
     observaciones = Column(String)
     fecha_registro = Column(DateTime, default=datetime.now)
+    # Reversas: se vinculan al ingresar (ver scriptREVERSAS.sql)
+    id_transaccion_anulada = Column(String(50), index=True)
+    id_transaccion_originante = Column(String(50), index=True)
+    estado = Column(String(20), default=ESTADO_REGISTRADA)  # registrada | anulada
+    # rowversion: cursor de notificaciones (ver scriptNOTIFICACIONES.sql); lo asigna el servidor
+    version = Column(ROWVERSION(convert_int=True), server_default=FetchedValue(), server_onupdate=FetchedValue())
+
+
+class DiferenciaConciliacion(Base):
+    """Reporte del worker de conciliación (ver app/conciliacion.py)."""
+    __tablename__ = "conciliacion_agilpagos"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_corrida = Column(String(36), index=True)
+    fecha_corrida = Column(DateTime, default=datetime.now)
+    id_transaccion = Column(String(50))
+    tipo_diferencia = Column(String(20))  # faltante_local | sobrante_local | importe | tipo
+    importe_sg = Column(Numeric(18, 2))
+    importe_local = Column(Numeric(18, 2))
+    tipo_sg = Column(Integer)
+    tipo_local = Column(Integer)
+    fecha_operacion = Column(DateTime)
+
+
+class UsuarioCVU(Base):
+    """Directorio CVU -> usuario SG (ver app/directorio.py y scriptDIRECTORIO.sql)."""
+    __tablename__ = "directorio_cvu"
+
+    cvu = Column(String(50), primary_key=True)
+    id_usuario = Column(String(50))
+    alias = Column(String(50))
+    numero_cuenta_entidad = Column(String(50))
+    cuit = Column(String(20), index=True)
+    id_entidad = Column(String(50))
+    fecha_actualizacion = Column(DateTime, default=datetime.now, index=True)
+
+
+class CursorWebhook(Base):
+    """Último cursor entregado a cada webhook saliente (ver app/notificaciones.py)."""
+    __tablename__ = "notif_cursores"
+
+    url = Column(String(400), primary_key=True)
+    cursor = Column(BigInteger, nullable=False)
+    fecha_actualizacion = Column(DateTime, default=datetime.now)
+
+
+class IdempotenciaSG(Base):
+    """Idempotency-Key de los POST a SG, compartida entre workers (ver app/idempotencia.py)."""
+    __tablename__ = "idempotencia_sg"
+
+    alcance = Column(String(30), primary_key=True)      # cvu | transferencias | usuarios
+    id_entidad = Column(String(50), primary_key=True)   # '' = entidad por defecto
+    clave = Column(String(255), primary_key=True)
+    huella = Column(String(64), nullable=False)
+    estado = Column(String(20), nullable=False)         # en_curso | completada | desconocido
+    status_code = Column(Integer)
+    respuesta = Column(UnicodeText)
+    fecha_creacion = Column(DateTime, default=datetime.now)
+    fecha_fin = Column(DateTime)
+    vence = Column(DateTime, index=True)
@@ -0,0 +1,107 @@
+# monitor_loop.py
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.config import env
+
+
+class MonitorConfig:
+    def __init__(self):
+        self.intervalo_ms = float(env("LOOP_MONITOR_INTERVALO_MS", "100"))  # 0 = desactivado
+        self.umbral_ms    = float(env("LOOP_LAG_UMBRAL_MS", "250"))         # loguear stack a partir de acá
+        self.muestras     = int(env("LOOP_MONITOR_MUESTRAS", "600"))
+
+
+class MonitorLoop:
+    """
+    Mide el lag del event loop: una tarea duerme `intervalo` y registra cuánto
+    tarde se despertó. Un hilo aparte vigila el último latido; si el loop queda
+    trabado más de `umbral` loguea el stack del hilo del loop (quién lo frena)
+    una vez por trabada.
+    """
+
+    def __init__(self, cfg: MonitorConfig):
+        self._cfg = cfg
+        self._lags: Deque[float] = deque(maxlen=cfg.muestras)
+        self._latido = time.monotonic()
+        self._max_ms = 0.0
+        self._trabadas = 0
+        self._tarea: Optional[asyncio.Task] = None
+        self._hilo: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+        self._id_hilo_loop: Optional[int] = None
+
+    def iniciar(self) -> None:
+        if self._cfg.intervalo_ms <= 0:
+            return
+        self._id_hilo_loop = threading.get_ident()
+        self._parar = threading.Event()
+        self._latido = time.monotonic()
+        self._tarea = asyncio.create_task(self._medir())
+        self._hilo = threading.Thread(target=self._vigilar, args=(self._parar,), name="monitor-loop", daemon=True)
+        self._hilo.start()
+
+    async def detener(self) -> None:
+        self._parar.set()
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    async def _medir(self) -> None:
+        intervalo = self._cfg.intervalo_ms / 1000
+        while True:
+            antes = time.monotonic()
+            await asyncio.sleep(intervalo)
+            ahora = time.monotonic()
+            lag_ms = max(0.0, (ahora - antes - intervalo) * 1000)
+            self._lags.append(lag_ms)
+            self._max_ms = max(self._max_ms, lag_ms)
+            self._latido = ahora
+
+    def _vigilar(self, parar: threading.Event) -> None:
+        umbral = self._cfg.umbral_ms / 1000
+        avisado = False
+        while not parar.wait(self._cfg.intervalo_ms / 1000):
+            trabado = time.monotonic() - self._latido
+            if trabado < umbral:
+                avisado = False
+                continue
+            if avisado:
+                continue
+            avisado = True
+            self._trabadas += 1
+            frame = sys._current_frames().get(self._id_hilo_loop)
+            pila = "".join(traceback.format_stack(frame)) if frame is not None else "(sin stack)"
+            logging.error(f"Event loop trabado {trabado * 1000:.0f} ms. Stack del loop:\n{pila}")
+
+    def resumen(self) -> Dict[str, Any]:
+        lags = sorted(self._lags)
+
+        def pct(p: float) -> Optional[float]:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))], 2) if lags else None
+
+        return {
+            "activo": self._tarea is not None and not self._tarea.done(),
+            "intervalo_ms": self._cfg.intervalo_ms,
+            "muestras": len(lags),
+            "lag_p50_ms": pct(0.50),
+            "lag_p99_ms": pct(0.99),
+            "lag_max_ms": round(self._max_ms, 2),
+            "trabadas": self._trabadas,
+        }
+
+
+_monitor: Optional[MonitorLoop] = None
+
+
+def get_monitor() -> MonitorLoop:
+    global _monitor
+    if _monitor is None:
+        _monitor = MonitorLoop(MonitorConfig())
+    return _monitor
@@ -0,0 +1,501 @@
+# notificaciones.py
+import json
+import asyncio
+import bisect
+import itertools
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+from fastapi import APIRouter, Depends, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import BigInteger, and_, cast, func, literal, select
+from sqlalchemy.dialects.mssql import BINARY
+
+from app.config import env
+from app.database import nueva_sesion, nueva_sesion_lectura, db_configurada
+from app.directorio import get_directorio
+from app.models import Transaccion, CursorWebhook
+from app.seguridad import requiere_admin, admin_valido
+
+router = APIRouter()
+
+# =========
+# Config
+# =========
+class NotifConfig:
+    def __init__(self):
+        self.buffer        = int(env("NOTIF_BUFFER", "10000"))         # eventos en memoria para catch-up
+        self.lote_db       = int(env("NOTIF_LOTE_DB", "500"))          # filas por lectura de la BD
+        self.poll_ms       = int(env("NOTIF_POLL_MS", "500"))          # cada cuánto lee lo nuevo un proceso con suscriptores
+        self.poll_inactivo_ms = int(env("NOTIF_POLL_INACTIVO_MS", "5000"))  # sin suscriptores ni webhooks
+        self.heartbeat     = float(env("NOTIF_HEARTBEAT_SEGS", "15"))
+        # Webhooks salientes: URLs separadas por coma
+        self.webhooks      = [u.strip() for u in env("NOTIF_WEBHOOKS", "").split(",") if u.strip()]
+        self.webhook_token = env("NOTIF_WEBHOOK_TOKEN", "")
+        self.lote          = int(env("NOTIF_LOTE", "100"))
+        self.espera_ms     = int(env("NOTIF_ESPERA_MS", "500"))        # espera máxima para juntar un lote
+        self.reintentos    = int(env("NOTIF_REINTENTOS", "5"))
+
+
+def serializar(t: Transaccion) -> Dict[str, Any]:
+    return {
+        "idTransaccion": t.id_transaccion,
+        "tipo": t.tipo,
+        "numeroCuenta": t.numero_cuenta,
+        "importe": str(t.importe) if t.importe is not None else None,
+        "fechaOperacion": t.fecha_operacion.isoformat() if t.fecha_operacion else None,
+        "cvu": t.cvu,
+        "observaciones": t.observaciones,
+        "fechaRegistro": t.fecha_registro.isoformat() if t.fecha_registro else None,
+        "estado": t.estado,
+        "idTransaccionAnulada": t.id_transaccion_anulada,
+        "idTransaccionOriginante": t.id_transaccion_originante,
+        # Titular del CVU desde el directorio en memoria (None si todavía no se conoce)
+        "usuario": get_directorio().buscar(t.cvu),
+    }
+
+
+# =========
+# Lectura por cursor = rowversion (columna version, scriptNOTIFICACIONES.sql)
+# =========
+def _tope_confirmado(db) -> int:
+    """MIN_ACTIVE_ROWVERSION(): toda versión menor ya pertenece a una transacción confirmada."""
+    return db.execute(select(cast(func.min_active_rowversion(), BigInteger))).scalar()
+
+
+def _rango_version(desde: int, tope: int):
+    # Se compara como binary(8) contra la columna (range seek sobre el índice de version)
+    return and_(
+        Transaccion.version > cast(literal(desde, BigInteger), BINARY(8)),
+        Transaccion.version < cast(literal(tope, BigInteger), BINARY(8)),
+    )
+
+
+def _sesion_cola():
+    # Una réplica (DB_READ_URL) puede ir atrás y su MIN_ACTIVE_ROWVERSION no
+    # refleja las transacciones en vuelo del primario: la cola lee del primario
+    return nueva_sesion() if env("DB_READ_URL") else nueva_sesion_lectura()
+
+
+def ultimo_confirmado() -> int:
+    db = _sesion_cola()
+    try:
+        return _tope_confirmado(db) - 1
+    finally:
+        db.close()
+
+
+def _leer_desde(cursor: int, limite: int) -> List[Dict[str, Any]]:
+    """
+    Filas con version > cursor ya confirmadas, en orden de versión. Primero se
+    lee el tope (en SNAPSHOT esa sentencia fija la foto, así todo lo que está
+    debajo del tope entra en ella) y después el rango. Una fila que commitea
+    tarde tiene versión >= tope: ningún cursor la saltea, aunque todo un lote
+    comparta fecha_registro. Un UPDATE (reversa que anula el original) cambia
+    la versión y la fila se vuelve a emitir con el estado nuevo.
+    """
+    if not db_configurada():
+        return []
+    db = _sesion_cola()
+    try:
+        tope = _tope_confirmado(db)
+        filas = (
+            db.query(Transaccion)
+            .filter(_rango_version(cursor, tope))
+            .order_by(Transaccion.version)
+            .limit(limite)
+            .all()
+        )
+        return [{"cursor": t.version, "transaccion": serializar(t)} for t in filas]
+    finally:
+        db.close()
+
+
+# =========
+# Broker en memoria (por proceso)
+# =========
+class Broker:
+    """
+    Ring buffer de los eventos que la cola (`ColaTransacciones`) lee de la BD,
+    ordenados por cursor. Cada proceso tiene el suyo, pero todos leen la misma
+    tabla: un suscriptor ve lo que registró cualquier worker (o el backfill, o
+    un reproceso). La ingesta sólo avisa (`avisar`, desde el threadpool) para
+    que la cola lea enseguida en vez de esperar NOTIF_POLL_MS.
+    Lleva la cuenta de suscriptores SSE/WS y de si el proceso despacha
+    webhooks (líder): sin ninguno la cola lee cada NOTIF_POLL_INACTIVO_MS.
+    Entrega al-menos-una-vez: los consumidores deduplican por idTransaccion.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursores: Deque[int] = deque()
+        self._eventos: Deque[Dict[str, Any]] = deque()
+        self._maximo = 10000
+        self._ultimo = 0
+        self._piso = 0  # todo evento con cursor > piso está en el buffer
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._nuevo: Optional[asyncio.Event] = None
+        self._aviso: Optional[asyncio.Event] = None
+        self._listo: Optional[asyncio.Event] = None
+        self._suscriptores = 0
+        self._despachando = False
+
+    def iniciar(self, maximo: int) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._nuevo = asyncio.Event()
+        self._aviso = asyncio.Event()
+        self._listo = asyncio.Event()
+        self._maximo = maximo
+
+    def arrancar_en(self, cursor: int) -> None:
+        """Cursor inicial (lo último confirmado al arrancar): lo anterior se pide a la BD."""
+        with self._lock:
+            self._cursores.clear()
+            self._eventos.clear()
+            self._ultimo = self._piso = cursor
+        self._listo.set()
+
+    def publicar(self, eventos: List[Dict[str, Any]]) -> None:
+        """Desde el event loop (la cola), con eventos en orden de cursor."""
+        with self._lock:
+            for e in eventos:
+                self._cursores.append(e["cursor"])
+                self._eventos.append(e)
+            self._ultimo = max(self._ultimo, eventos[-1]["cursor"])
+            while len(self._eventos) > self._maximo:
+                self._piso = self._cursores.popleft()
+                self._eventos.popleft()
+        self._despertar()
+
+    def avisar(self) -> None:
+        """Hay filas nuevas confirmadas (thread-safe)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._aviso.set)
+
+    async def esperar_aviso(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._aviso.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._aviso.clear()
+
+    def suscribir(self) -> None:
+        """Desde el event loop. Despierta la cola por si estaba en la espera larga."""
+        self._suscriptores += 1
+        self._aviso.set()
+
+    def desuscribir(self) -> None:
+        self._suscriptores -= 1
+
+    def despachando(self, activo: bool) -> None:
+        self._despachando = activo
+        if activo:
+            self._aviso.set()
+
+    def activo(self) -> bool:
+        """Alguien consume los eventos de este proceso (SSE/WS o webhooks)."""
+        return self._suscriptores > 0 or self._despachando
+
+    async def esperar_listo(self) -> None:
+        await self._listo.wait()
+
+    def _despertar(self) -> None:
+        nuevo, self._nuevo = self._nuevo, asyncio.Event()
+        nuevo.set()
+
+    def ultimo(self) -> int:
+        return self._ultimo
+
+    def pendientes(self, cursor: int) -> Optional[int]:
+        """Eventos del buffer posteriores a `cursor`; None si el atraso ya excede el buffer."""
+        with self._lock:
+            if cursor < self._piso:
+                return None
+            return len(self._cursores) - bisect.bisect_right(self._cursores, cursor)
+
+    def en_buffer(self) -> int:
+        return len(self._eventos)
+
+    def desde_buffer(self, cursor: int, limite: int) -> Optional[List[Dict[str, Any]]]:
+        """Eventos con cursor > `cursor`, o None si ya no están en memoria."""
+        with self._lock:
+            if cursor < self._piso:
+                return None
+            i = bisect.bisect_right(self._cursores, cursor)
+            return list(itertools.islice(self._eventos, i, i + limite))
+
+    async def esperar(self, timeout: float) -> bool:
+        """True si llegó un evento nuevo, False si venció el timeout."""
+        evento = self._nuevo
+        try:
+            await asyncio.wait_for(evento.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+broker = Broker()
+
+
+def _invalidar_cache(eventos: List[Dict[str, Any]]) -> None:
+    """
+    Filas confirmadas por otro worker o por un proceso fuera de la API
+    (reprocesar_deadletter, importar_historico): se invalidan las respuestas
+    cacheadas de este proceso igual que tras un alta local.
+    """
+    from app.cache_respuestas import get_cache
+
+    cache = get_cache()
+    for e in eventos:
+        t = e["transaccion"]
+        fecha = datetime.fromisoformat(t["fechaOperacion"]) if t["fechaOperacion"] else None
+        cache.invalidar(t["numeroCuenta"], fecha, [t["idTransaccion"], t["idTransaccionAnulada"]])
+
+
+class ColaTransacciones:
+    """
+    Una tarea por proceso (lifespan): lee de la BD lo confirmado después del
+    último cursor, lo publica en el broker e invalida el cache de respuestas.
+    Corre apenas la ingesta de este proceso avisa y, además, cada NOTIF_POLL_MS
+    mientras haya suscriptores SSE/WS o el proceso despache webhooks. Si no,
+    sólo cada NOTIF_POLL_INACTIVO_MS: eso acota cuánto tarda en invalidarse
+    el cache por altas de otros workers o del reproceso/backfill.
+    """
+
+    def __init__(self):
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self) -> None:
+        cfg = NotifConfig()
+        broker.iniciar(cfg.buffer)
+        if not db_configurada():
+            broker.arrancar_en(0)
+            return
+        self._tarea = asyncio.create_task(self._ciclo(cfg))
+
+    async def _ciclo(self, cfg: NotifConfig) -> None:
+        while True:
+            try:
+                broker.arrancar_en(await asyncio.to_thread(ultimo_confirmado))
+                break
+            except Exception as e:
+                logging.error(f"Notificaciones: no se pudo leer el cursor inicial: {e}")
+                await asyncio.sleep(cfg.heartbeat)
+        while True:
+            try:
+                eventos = await asyncio.to_thread(_leer_desde, broker.ultimo(), cfg.lote_db)
+                if eventos:
+                    broker.publicar(eventos)
+                    _invalidar_cache(eventos)
+                    if len(eventos) >= cfg.lote_db:
+                        continue
+            except Exception as e:
+                logging.error(f"Notificaciones: error leyendo transacciones nuevas: {e}")
+            await broker.esperar_aviso((cfg.poll_ms if broker.activo() else cfg.poll_inactivo_ms) / 1000)
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+
+async def siguientes(cursor: int, limite: int) -> List[Dict[str, Any]]:
+    eventos = broker.desde_buffer(cursor, limite)
+    if eventos is not None:
+        return eventos
+    # Catch-up de un cursor que ya salió del buffer (range seek sobre version)
+    return await asyncio.to_thread(_leer_desde, cursor, limite)
+
+
+async def stream_eventos(cursor: Optional[int], heartbeat: float):
+    """
+    Generador común a SSE y WebSocket. Sin cursor se arranca desde lo último
+    que leyó la cola; un cursor posterior (p.ej. uno de antes de pasar a
+    rowversion) también. Emite None como heartbeat cuando no hay novedades.
+    Mientras está abierto cuenta como suscriptor del broker.
+    """
+    cfg = NotifConfig()
+    await broker.esperar_listo()
+    if cursor is None or cursor > broker.ultimo():
+        cursor = broker.ultimo()
+    broker.suscribir()
+    try:
+        while True:
+            eventos = await siguientes(cursor, cfg.lote_db)
+            if eventos:
+                for e in eventos:
+                    cursor = max(cursor, e["cursor"])
+                    yield e
+                continue
+            if not await broker.esperar(heartbeat):
+                yield None
+    finally:
+        broker.desuscribir()
+
+
+# =========
+# SSE / WebSocket
+# =========
+@router.get("/sse", dependencies=[Depends(requiere_admin)])
+async def notificaciones_sse(
+    cursor: Optional[int] = Query(None, description="Último cursor recibido (reanuda desde ahí)"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events con las transacciones nuevas. El `id` de cada evento es
+    el cursor; al reconectar el navegador manda Last-Event-ID y se retoma.
+    """
+    if cursor is None and last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+    heartbeat = NotifConfig().heartbeat
+
+    async def generar():
+        async for e in stream_eventos(cursor, heartbeat):
+            if e is None:
+                yield ": ping\n\n"
+                continue
+            yield f"id: {e['cursor']}\nevent: transaccion\ndata: {json.dumps(e['transaccion'], ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(generar(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.websocket("/ws")
+async def notificaciones_ws(websocket: WebSocket, cursor: Optional[int] = None):
+    """
+    WebSocket: autentica con `Authorization: Bearer <token>` o, desde un
+    navegador (que no puede mandar headers), con el subprotocolo
+    `Sec-WebSocket-Protocol: bearer, <token>`. Nunca por query string: la URL
+    queda en logs de proxies. Cada mensaje es {"cursor": ..., "transaccion": {...}}.
+    """
+    auth = websocket.headers.get("authorization", "")
+    token = auth[7:].strip() if auth[:7].lower() == "bearer " else None
+    protocolos = websocket.scope.get("subprotocols") or []
+    subprotocolo = None
+    if token is None and len(protocolos) == 2 and protocolos[0].lower() == "bearer":
+        token, subprotocolo = protocolos[1], protocolos[0]
+    if not admin_valido(token):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept(subprotocol=subprotocolo)
+    eventos = stream_eventos(cursor, NotifConfig().heartbeat)
+    try:
+        async for e in eventos:
+            await websocket.send_json(e if e is not None else {"ping": True})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await eventos.aclose()  # deja de contar como suscriptor
+
+
+# =========
+# Webhooks salientes (lotes + reintentos + cursor persistido en notif_cursores)
+# =========
+def _leer_cursor(url: str) -> Optional[int]:
+    db = nueva_sesion()
+    try:
+        fila = db.get(CursorWebhook, url)
+        return fila.cursor if fila is not None else None
+    finally:
+        db.close()
+
+
+def _guardar_cursor(url: str, cursor: int) -> None:
+    """
+    Upsert con la fila bloqueada (UPDLOCK) y sin retroceder nunca: si en un
+    cambio de líder dos despachadores llegan a solaparse, gana el más avanzado.
+    """
+    db = nueva_sesion()
+    try:
+        fila = db.execute(select(CursorWebhook).where(CursorWebhook.url == url).with_for_update()).scalar_one_or_none()
+        if fila is None:
+            db.add(CursorWebhook(url=url, cursor=cursor, fecha_actualizacion=datetime.now()))
+        elif cursor > fila.cursor:
+            fila.cursor, fila.fecha_actualizacion = cursor, datetime.now()
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _enviar_lote(cli: httpx.AsyncClient, cfg: NotifConfig, url: str, eventos: List[Dict[str, Any]]) -> bool:
+    headers = {"Authorization": f"Bearer {cfg.webhook_token}"} if cfg.webhook_token else {}
+    espera = 1.0
+    for intento in range(cfg.reintentos):
+        try:
+            r = await cli.post(url, json={"eventos": eventos}, headers=headers)
+            if r.status_code < 400:
+                return True
+            if r.status_code < 500 and r.status_code not in (408, 429):
+                logging.error(f"Webhook {url} rechazó el lote ({r.status_code}): {r.text[:200]}")
+                return False
+        except httpx.HTTPError as e:
+            logging.error(f"Webhook {url} intento {intento + 1}: {e}")
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, 30)
+    return False
+
+
+# Último cursor confirmado por cada webhook (para medir el atraso en /health)
+cursores_webhook: Dict[str, int] = {}
+
+
+async def despachar_webhook(url: str, drenar: asyncio.Event) -> None:
+    """
+    Un despachador por suscriptor: junta hasta NOTIF_LOTE eventos (o lo que haya
+    en NOTIF_ESPERA_MS), los manda en un POST y recién con 2xx avanza y
+    persiste su cursor. Si el destino está caído se reintenta el mismo lote.
+    """
+    cfg = NotifConfig()
+    await broker.esperar_listo()
+    cursor = await asyncio.to_thread(_leer_cursor, url)
+    if cursor is None:
+        cursor = broker.ultimo()
+    cursores_webhook[url] = cursor
+    async with httpx.AsyncClient(timeout=10) as cli:
+        while True:
+            eventos = await siguientes(cursor, cfg.lote)
+            if len(eventos) < cfg.lote and not drenar.is_set():
+                await broker.esperar(cfg.espera_ms / 1000)
+                eventos = await siguientes(cursor, cfg.lote)
+            if not eventos:
+                if drenar.is_set():
+                    return
+                await broker.esperar(cfg.heartbeat)
+                continue
+            if await _enviar_lote(cli, cfg, url, eventos):
+                cursor = cursores_webhook[url] = eventos[-1]["cursor"]
+                await asyncio.to_thread(_guardar_cursor, url, cursor)
+            elif drenar.is_set():
+                return
+            else:
+                await asyncio.sleep(cfg.heartbeat)
+
+
+class Despachador:
+    """Arranca/drena los despachadores de webhooks (job único del proceso líder, ver app/lider.py)."""
+
+    def __init__(self):
+        self._tareas: List[asyncio.Task] = []
+        self._drenar = asyncio.Event()
+
+    def iniciar(self) -> None:
+        # Puede volver a arrancar si el proceso recupera el liderazgo
+        self._drenar = asyncio.Event()
+        self._tareas = [asyncio.create_task(despachar_webhook(url, self._drenar)) for url in NotifConfig().webhooks]
+        broker.despachando(bool(self._tareas))
+
+    async def detener(self, timeout: float = 10.0) -> None:
+        # Primero se intenta vaciar lo pendiente, después se cancela
+        self._drenar.set()
+        broker._despertar()
+        if self._tareas:
+            _, pendientes = await asyncio.wait(self._tareas, timeout=timeout)
+            for t in pendientes:
+                t.cancel()
+            await asyncio.gather(*pendientes, return_exceptions=True)
+        broker.despachando(False)
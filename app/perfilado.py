@@ -0,0 +1,346 @@
+# perfilado.py
+import os
+import sys
+import time
+import asyncio
+import itertools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import env
+from app.seguridad import requiere_admin, admin_valido
+
+router = APIRouter(dependencies=[Depends(requiere_admin)])
+
+# =========
+# Config
+# =========
+class PerfilConfig:
+    def __init__(self):
+        self.lento_ms     = float(env("PERFIL_LENTO_MS", "1000"))      # 0 = sin captura de requests lentos
+        self.intervalo_ms = float(env("PERFIL_INTERVALO_MS", "5"))     # período de muestreo de stacks
+        self.max_segs     = int(env("PERFIL_MAX_SEGS", "60"))
+        self.buffer       = int(env("PERFIL_BUFFER", "100"))           # capturas guardadas (ring buffer)
+        self.max_pilas    = int(env("PERFIL_MAX_PILAS", "2000"))       # stacks distintos por perfil
+
+
+# =========
+# Fases por request (BD / SG): contextvar con un dict mutable, así lo que se
+# suma desde el threadpool (los endpoints sync corren en una copia del
+# contexto) se ve en el middleware
+# =========
+_medicion: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("perfil_medicion", default=None)
+
+
+def _sumar(nombre: str, ms: float) -> None:
+    m = _medicion.get()
+    if m is not None:
+        acum = m.setdefault(nombre, [0.0, 0])
+        acum[0] += ms
+        acum[1] += 1
+
+
+@contextmanager
+def fase(nombre: str):
+    """Suma la duración del bloque a la fase `nombre` del request en curso (si hay)."""
+    if _medicion.get() is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _sumar(nombre, (time.perf_counter() - t0) * 1000)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    if _medicion.get() is not None:
+        conn.info.setdefault("perfil_t0", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_sql(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("perfil_t0")
+    if pila:
+        _sumar("db", (time.perf_counter() - pila.pop()) * 1000)
+
+
+def _fases_json(m: Dict[str, List[float]]) -> Dict[str, Any]:
+    return {k: {"ms": round(v[0], 1), "n": v[1]} for k, v in sorted(m.items())}
+
+
+def _server_timing(m: Dict[str, List[float]], total_ms: float) -> str:
+    partes = [f"{k};dur={v[0]:.1f};desc=\"{v[1]}x\"" for k, v in sorted(m.items())]
+    return ", ".join(partes + [f"total;dur={total_ms:.1f}"])
+
+
+# =========
+# Muestreo de stacks (formato "folded": flamegraph.pl, speedscope, inferno)
+# =========
+# Hojas de hilos esperando (pool ocioso, selector del loop): no aportan al perfil
+HOJAS_OCIOSAS = {"wait", "select", "poll", "_poll", "_wait_for_tstate_lock", "accept", "_worker"}
+
+
+def _plegar(frame, nombre_hilo: str) -> Optional[str]:
+    if frame.f_code.co_name in HOJAS_OCIOSAS:
+        return None
+    partes = []
+    while frame is not None:
+        co = frame.f_code
+        partes.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})")
+        frame = frame.f_back
+    partes.append(nombre_hilo)
+    return ";".join(reversed(partes))
+
+
+class Muestreador:
+    """
+    Hilo que cada `intervalo` toma los stacks de todos los hilos del proceso
+    (sys._current_frames) y cuenta los stacks plegados. Muestrea el proceso
+    entero: con requests concurrentes aparecen todos, separados por hilo.
+    """
+
+    def __init__(self, intervalo_ms: float, max_pilas: int):
+        self._intervalo = max(intervalo_ms, 1) / 1000
+        self._max_pilas = max_pilas
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self.conteo: Counter = Counter()
+        self.muestras = 0
+        self.descartadas = 0
+
+    def iniciar(self) -> None:
+        self._hilo = threading.Thread(target=self._correr, args=(self._parar,), name="perfil", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _correr(self, parar: threading.Event) -> None:
+        propio = threading.get_ident()
+        while not parar.wait(self._intervalo):
+            nombres = {h.ident: h.name for h in threading.enumerate()}
+            self.muestras += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = _plegar(frame, nombres.get(ident, str(ident)))
+                if pila is None:
+                    continue
+                if pila in self.conteo or len(self.conteo) < self._max_pilas:
+                    self.conteo[pila] += 1
+                else:
+                    self.descartadas += 1
+
+    def plegado(self) -> str:
+        return "".join(f"{pila} {n}\n" for pila, n in self.conteo.most_common())
+
+
+# Un muestreo por vez por proceso (el costo es sobre todos los hilos)
+_muestreo_lock = threading.Lock()
+
+
+# =========
+# Ring buffer de capturas
+# =========
+class RegistroPerfiles:
+    def __init__(self, maximo: int):
+        self._lock = threading.Lock()
+        self._items: Deque[Dict[str, Any]] = deque(maxlen=maximo)
+        self._ids = itertools.count(1)
+
+    def nuevo_id(self) -> str:
+        return f"{os.getpid()}-{next(self._ids)}"
+
+    def agregar(self, captura: Dict[str, Any]) -> None:
+        with self._lock:
+            self._items.append(captura)
+
+    def listar(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{k: v for k, v in c.items() if k != "plegado"} for c in reversed(self._items)]
+
+    def obtener(self, id_captura: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return next((c for c in self._items if c["id"] == id_captura), None)
+
+
+_registro: Optional[RegistroPerfiles] = None
+_config: Optional[PerfilConfig] = None
+
+
+def perfil_config() -> PerfilConfig:
+    global _config
+    if _config is None:
+        _config = PerfilConfig()
+    return _config
+
+
+def get_registro_perfiles() -> RegistroPerfiles:
+    global _registro
+    if _registro is None:
+        _registro = RegistroPerfiles(perfil_config().buffer)
+    return _registro
+
+
+def _captura_perfil(id_captura: str, muestreador: Muestreador, segundos: float, origen: str) -> Dict[str, Any]:
+    return {
+        "id": id_captura,
+        "tipo": "perfil",
+        "origen": origen,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "segundos": round(segundos, 3),
+        "muestras": muestreador.muestras,
+        "pilas": len(muestreador.conteo),
+        "descartadas": muestreador.descartadas,
+        "plegado": muestreador.plegado(),
+    }
+
+
+# =========
+# Middleware ASGI: fases por request, captura de lentos y X-Perfil
+# =========
+HEADER_PERFIL = b"x-perfil"
+
+
+class PerfilMiddleware:
+    """
+    Mide cada request HTTP con sus fases de BD y SG. Si supera PERFIL_LENTO_MS
+    se guarda el desglose en el ring buffer. Con `X-Perfil: 1` y token de
+    admin (Bearer ADMIN_TOKEN) además se muestrea el proceso mientras dura el
+    request: la respuesta trae `X-Perfil-Id` y `Server-Timing`. Los streams
+    (SSE) no se cuentan como lentos.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cfg = perfil_config()
+        headers = dict(scope["headers"])
+        muestreador = None
+        id_perfil = None
+        if headers.get(HEADER_PERFIL) and _admin(headers) and _muestreo_lock.acquire(blocking=False):
+            muestreador = Muestreador(cfg.intervalo_ms, cfg.max_pilas)
+            muestreador.iniciar()
+            id_perfil = get_registro_perfiles().nuevo_id()
+
+        medicion: Dict[str, List[float]] = {}
+        token = _medicion.set(medicion)
+        t0 = time.perf_counter()
+        estado = {"status": 500, "stream": False}
+
+        async def enviar(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+                extra = []
+                for k, v in message.get("headers", []):
+                    if k.lower() == b"content-type" and v.startswith(b"text/event-stream"):
+                        estado["stream"] = True
+                if id_perfil is not None:
+                    total = (time.perf_counter() - t0) * 1000
+                    extra = [(b"x-perfil-id", id_perfil.encode()),
+                             (b"server-timing", _server_timing(medicion, total).encode("latin-1"))]
+                if extra:
+                    message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _medicion.reset(token)
+            total_ms = (time.perf_counter() - t0) * 1000
+            if muestreador is not None:
+                await asyncio.to_thread(muestreador.detener)
+                _muestreo_lock.release()
+                captura = _captura_perfil(id_perfil, muestreador, total_ms / 1000, f"{scope['method']} {scope['path']}")
+                get_registro_perfiles().agregar(captura)
+            if cfg.lento_ms > 0 and total_ms >= cfg.lento_ms and not estado["stream"]:
+                get_registro_perfiles().agregar({
+                    "id": get_registro_perfiles().nuevo_id(),
+                    "tipo": "lento",
+                    "origen": f"{scope['method']} {scope['path']}",
+                    "fecha": datetime.now().isoformat(timespec="seconds"),
+                    "status": estado["status"],
+                    "total_ms": round(total_ms, 1),
+                    "fases": _fases_json(medicion),
+                    # lo que no es BD ni SG: CPU propia, espera de hilo/event loop, cliente lento
+                    "otros_ms": round(total_ms - sum(v[0] for k, v in medicion.items() if k in ("db", "sg")), 1),
+                    "perfil": id_perfil,
+                })
+
+
+def _admin(headers: Dict[bytes, bytes]) -> bool:
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    return auth[:7].lower() == "bearer " and admin_valido(auth[7:].strip())
+
+
+# =========
+# Endpoints de admin
+# =========
+@router.post("/perfil", response_class=PlainTextResponse)
+async def perfilar_proceso(
+    segundos: float = Query(10, gt=0),
+    intervalo_ms: Optional[float] = Query(None, ge=1, le=1000),
+):
+    """
+    Muestrea el proceso vivo durante `segundos` y devuelve los stacks plegados
+    (`flamegraph.pl perfil.folded > perfil.svg`, o abrir en speedscope).
+    Queda también en el ring buffer. Con varios workers perfila sólo al que atendió.
+    """
+    cfg = perfil_config()
+    if segundos > cfg.max_segs:
+        raise HTTPException(422, detail=f"segundos supera PERFIL_MAX_SEGS ({cfg.max_segs})")
+    if not _muestreo_lock.acquire(blocking=False):
+        raise HTTPException(409, detail="Ya hay un perfil en curso en este proceso")
+    try:
+        muestreador = Muestreador(intervalo_ms or cfg.intervalo_ms, cfg.max_pilas)
+        muestreador.iniciar()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            await asyncio.to_thread(muestreador.detener)
+    finally:
+        _muestreo_lock.release()
+    registro = get_registro_perfiles()
+    captura = _captura_perfil(registro.nuevo_id(), muestreador, segundos, "manual")
+    registro.agregar(captura)
+    return PlainTextResponse(
+        captura["plegado"],
+        headers={"X-Perfil-Id": captura["id"],
+                 "Content-Disposition": f'attachment; filename="perfil-{captura["id"]}.folded"'},
+    )
+
+
+@router.get("/perfiles")
+async def listar_perfiles():
+    """Capturas del ring buffer (más nuevas primero), sin los stacks."""
+    return get_registro_perfiles().listar()
+
+
+@router.get("/perfiles/{id_captura}")
+async def obtener_perfil(id_captura: str):
+    captura = get_registro_perfiles().obtener(id_captura)
+    if captura is None:
+        raise HTTPException(404, detail="Captura inexistente o ya rotada del buffer")
+    if captura["tipo"] == "perfil":
+        return PlainTextResponse(
+            captura["plegado"],
+            headers={"Content-Disposition": f'attachment; filename="perfil-{id_captura}.folded"'},
+        )
+    return JSONResponse(captura)
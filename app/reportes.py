@@ -0,0 +1,390 @@
+# reportes.py
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import or_, select
+
+from app.config import env
+from app.database import db_configurada, nueva_sesion_lectura
+from app.importes import centavos_sql, desde_centavos
+from app.models import Transaccion
+from app.seguridad import requiere_admin
+
+# Reportes (totales por tipo / cuenta / día / mes) fuera de SQL Server:
+# export incremental a Parquet particionado por mes y agregaciones con DuckDB.
+router = APIRouter(dependencies=[Depends(requiere_admin)])
+
+# =========
+# Config
+# =========
+class ReportesConfig:
+    def __init__(self):
+        self.directorio    = env("REPORTES_DIR", "reportes")
+        self.intervalo_min = int(env("REPORTES_INTERVALO_MIN", "0"))   # 0 = sólo manual / CLI
+        self.solape_segs   = int(env("REPORTES_SOLAPE_SEGS", "300"))   # re-lee commits tardíos
+        self.lote_db       = int(env("REPORTES_LOTE_DB", "50000"))
+
+
+class ReportesNoDisponibles(RuntimeError):
+    pass
+
+
+class SincronizacionEnCurso(RuntimeError):
+    pass
+
+
+def _duckdb():
+    # Dependencia opcional: sin duckdb la API funciona igual, sin /reportes
+    try:
+        import duckdb
+    except ImportError:
+        raise ReportesNoDisponibles("duckdb no está instalado (pip install -r requirements.txt)")
+    return duckdb
+
+
+# Columnas del store (importe en centavos: SUM entero exacto, sin float)
+COLUMNAS = {
+    "id_transaccion": "VARCHAR",
+    "tipo": "INTEGER",
+    "numero_cuenta": "VARCHAR",
+    "centavos": "BIGINT",
+    "fecha_operacion": "TIMESTAMP",
+    "fecha_registro": "TIMESTAMP",
+    "estado": "VARCHAR",
+    "id_transaccion_anulada": "VARCHAR",
+}
+ARCHIVO_ESTADO = "_estado.json"
+ARCHIVO_LOCK = "_sync.lock"
+LOCK_VENCIDO_SEGS = 3600
+
+
+def _archivo_mes(directorio: str, mes: str) -> str:
+    return os.path.join(directorio, f"mes={mes}", "transacciones.parquet")
+
+
+def _literal(path: str) -> str:
+    # COPY ... TO no acepta parámetros: el path va como literal SQL
+    return "'" + path.replace("'", "''") + "'"
+
+
+def leer_estado(directorio: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directorio, ARCHIVO_ESTADO), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_estado(directorio: str, estado: Dict[str, Any]) -> None:
+    path = os.path.join(directorio, ARCHIVO_ESTADO)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(tmp, path)
+
+
+class _LockSync:
+    """
+    Un solo sincronizador a la vez entre procesos (workers, CLI programada):
+    archivo creado con O_EXCL. Un lock de más de una hora se considera
+    abandonado (proceso muerto) y se pisa.
+    """
+
+    def __init__(self, directorio: str):
+        self._path = os.path.join(directorio, ARCHIVO_LOCK)
+
+    def __enter__(self):
+        try:
+            fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(self._path) < LOCK_VENCIDO_SEGS:
+                raise SincronizacionEnCurso("Ya hay una sincronización de reportes en curso")
+            os.remove(self._path)
+            fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+# =========
+# Export incremental
+# =========
+def _exportar_csv(marca: Optional[datetime], solape: int, lote: int, path: str) -> Tuple[Optional[datetime], int]:
+    """
+    Vuelca a CSV las filas con fecha_registro posterior a la marca (menos el
+    solape) y los originales de las reversas nuevas, que cambiaron de estado
+    sin cambiar su fecha_registro. Devuelve (nueva marca = máx. fecha_registro, filas).
+    """
+    consulta = select(
+        Transaccion.id_transaccion, Transaccion.tipo, Transaccion.numero_cuenta,
+        centavos_sql(Transaccion.importe), Transaccion.fecha_operacion, Transaccion.fecha_registro,
+        Transaccion.estado, Transaccion.id_transaccion_anulada,
+    )
+    if marca is not None:
+        desde = marca - timedelta(seconds=solape)
+        anuladas = select(Transaccion.id_transaccion_anulada).where(
+            Transaccion.fecha_registro > desde, Transaccion.id_transaccion_anulada.is_not(None)
+        )
+        consulta = consulta.where(or_(Transaccion.fecha_registro > desde, Transaccion.id_transaccion.in_(anuladas)))
+
+    nueva, filas = marca, 0
+    db = nueva_sesion_lectura()
+    try:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            for fila in db.execute(consulta.execution_options(stream_results=True, yield_per=lote)):
+                w.writerow(fila)
+                filas += 1
+                if nueva is None or fila[5] > nueva:
+                    nueva = fila[5]
+    finally:
+        db.close()
+    return nueva, filas
+
+
+def _reescribir_meses(duckdb, directorio: str, csv_path: str) -> List[str]:
+    """Carga el CSV de staging y reescribe cada mes que toca. Devuelve los meses."""
+    con = duckdb.connect()
+    try:
+        # executemany fila a fila es ~1000x más lento que leer el CSV de staging
+        con.execute(
+            "CREATE TEMP TABLE nuevos AS SELECT *, strftime(fecha_operacion, '%Y-%m') AS mes "
+            "FROM read_csv(?, header = false, columns = ?, quote = '\"')",
+            [csv_path, COLUMNAS],
+        )
+        meses = [m for (m,) in con.execute("SELECT DISTINCT mes FROM nuevos ORDER BY mes").fetchall()]
+        columnas = ", ".join(COLUMNAS)
+        for mes in meses:
+            destino = _archivo_mes(directorio, mes)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            tmp = destino + ".tmp"
+            nuevas = f"SELECT {columnas} FROM nuevos WHERE mes = '{mes}'"
+            if os.path.exists(destino):
+                fuente = (
+                    f"SELECT {columnas} FROM read_parquet({_literal(destino)}) "
+                    f"WHERE id_transaccion NOT IN (SELECT id_transaccion FROM ({nuevas})) "
+                    f"UNION ALL {nuevas}"
+                )
+            else:
+                fuente = nuevas
+            con.execute(f"COPY ({fuente} ORDER BY fecha_operacion) TO {_literal(tmp)} (FORMAT parquet)")
+            os.replace(tmp, destino)
+        return meses
+    finally:
+        con.close()
+
+
+def sincronizar(cfg: Optional[ReportesConfig] = None) -> Dict[str, Any]:
+    """
+    Trae de SQL Server (engine de lectura) lo nuevo desde la última corrida y
+    reescribe sólo los meses tocados: cada partición mes=YYYY-MM se arma con
+    lo que ya tenía menos las filas actualizadas, más las nuevas, y se
+    reemplaza con os.replace (los lectores nunca ven un archivo a medias).
+    Partición mensual y no diaria: abrir cientos de archivos chicos domina el
+    tiempo de una consulta de varios meses; dentro del archivo las filas van
+    ordenadas por fecha_operacion y los row groups se podan por sus min/max.
+    Lo archivado/borrado de la tabla OLTP sigue en el store.
+    """
+    cfg = cfg or ReportesConfig()
+    duckdb = _duckdb()
+    if not db_configurada():
+        raise ReportesNoDisponibles("Base de datos no configurada en este despliegue")
+    os.makedirs(cfg.directorio, exist_ok=True)
+
+    with _LockSync(cfg.directorio):
+        t0 = time.perf_counter()
+        estado = leer_estado(cfg.directorio)
+        marca = datetime.fromisoformat(estado["marca"]) if estado.get("marca") else None
+        fd, csv_path = tempfile.mkstemp(suffix=".csv", dir=cfg.directorio)
+        os.close(fd)
+        try:
+            nueva_marca, filas = _exportar_csv(marca, cfg.solape_segs, cfg.lote_db, csv_path)
+            # Sin novedades (período tranquilo, tabla vacía): read_csv no puede
+            # inferir un CSV vacío y tampoco hay meses que reescribir
+            meses = _reescribir_meses(duckdb, cfg.directorio, csv_path) if filas else []
+        finally:
+            os.remove(csv_path)
+
+        estado = {
+            "marca": nueva_marca.isoformat() if nueva_marca else None,
+            "ultima_sync": datetime.now().isoformat(),
+            "filas_ultima_sync": filas,
+            "meses_ultima_sync": len(meses),
+        }
+        _guardar_estado(cfg.directorio, estado)
+    return {**estado, "segundos": round(time.perf_counter() - t0, 2)}
+
+
+# =========
+# Consultas (DuckDB en memoria sobre los Parquet; sin locks entre procesos)
+# =========
+AGRUPACIONES = {
+    "tipo": "tipo",
+    "numeroCuenta": "numero_cuenta",
+    "estado": "estado",
+    "dia": "CAST(fecha_operacion AS DATE)",
+    "mes": "year(fecha_operacion) * 100 + month(fecha_operacion)",  # entero (más barato que date_trunc); sale YYYY-MM
+}
+
+_con = None
+_con_lock = threading.Lock()
+
+
+def _cursor():
+    # Una conexión por proceso; cursor() da una conexión hija por consulta (thread-safe)
+    global _con
+    with _con_lock:
+        if _con is None:
+            _con = _duckdb().connect()
+        return _con.cursor()
+
+
+def _archivos(directorio: str, desde: date, hasta: date) -> List[str]:
+    """Particiones que cubren [desde, hasta): la poda por mes se hace acá, sin abrir archivos."""
+    try:
+        nombres = os.listdir(directorio)
+    except OSError:
+        return []
+    d, h = f"mes={desde:%Y-%m}", f"mes={hasta - timedelta(days=1):%Y-%m}"
+    return [
+        _archivo_mes(directorio, n[4:])
+        for n in sorted(nombres)
+        if n.startswith("mes=") and d <= n <= h and os.path.exists(_archivo_mes(directorio, n[4:]))
+    ]
+
+
+def totales(
+    desde: date,
+    hasta: date,
+    agrupar: List[str],
+    numero_cuenta: Optional[str] = None,
+    tipo: Optional[int] = None,
+    estado: Optional[str] = None,
+    limite: int = 1000,
+) -> List[Dict[str, Any]]:
+    archivos = _archivos(ReportesConfig().directorio, desde, hasta)
+    if not archivos:
+        return []
+    grupos = [f"{AGRUPACIONES[g]} AS {g}" for g in agrupar]
+    filtros = ["fecha_operacion >= ?", "fecha_operacion < ?"]
+    params = [archivos, desde, hasta]
+    for columna, valor in (("numero_cuenta", numero_cuenta), ("tipo", tipo), ("estado", estado)):
+        if valor is not None:
+            filtros.append(f"{columna} = ?")
+            params.append(valor)
+    sql = (
+        f"SELECT {', '.join(grupos + ['COUNT(*) AS cantidad', 'SUM(centavos) AS centavos'])} "
+        f"FROM read_parquet(?) WHERE {' AND '.join(filtros)}"
+        + (f" GROUP BY ALL ORDER BY {', '.join(agrupar)}" if agrupar else "")
+        + f" LIMIT {int(limite)}"
+    )
+    cur = _cursor()
+    try:
+        res = cur.execute(sql, params)
+        nombres = [c[0] for c in res.description]
+        filas = res.fetchall()
+    finally:
+        cur.close()
+    salida = []
+    for fila in filas:
+        item = dict(zip(nombres, fila))
+        item["total"] = str(desde_centavos(item.pop("centavos") or 0))
+        if "dia" in item:
+            item["dia"] = item["dia"].isoformat()
+        if "mes" in item:
+            item["mes"] = f"{item['mes'] // 100:04d}-{item['mes'] % 100:02d}"
+        salida.append(item)
+    return salida
+
+
+# =========
+# Worker programado
+# =========
+async def worker_reportes() -> None:
+    """
+    Se lanza desde el lifespan si REPORTES_INTERVALO_MIN > 0. Con varios
+    workers el lock de archivo deja correr a uno solo por vez.
+    """
+    cfg = ReportesConfig()
+    if cfg.intervalo_min <= 0 or not db_configurada():
+        return
+    while True:
+        try:
+            await asyncio.to_thread(sincronizar, cfg)
+        except asyncio.CancelledError:
+            raise
+        except SincronizacionEnCurso:
+            pass
+        except Exception as e:
+            logging.error(f"Error sincronizando reportes: {e}")
+        await asyncio.sleep(cfg.intervalo_min * 60)
+
+
+# =========
+# Endpoints
+# =========
+@router.get("/totales")
+def reporte_totales(
+    desde: date = Query(..., description="fecha_operacion desde (inclusive)"),
+    hasta: date = Query(..., description="fecha_operacion hasta (exclusive)"),
+    agrupar: List[str] = Query([], description="tipo, numeroCuenta, estado, dia, mes (repetible)"),
+    numeroCuenta: Optional[str] = Query(None),
+    tipo: Optional[int] = Query(None),
+    estado: Optional[str] = Query(None),
+    limite: int = Query(1000, ge=1, le=100000),
+):
+    """
+    Cantidad y total (importe exacto, string) por los grupos pedidos, sobre el
+    store de reportes. Los datos llegan hasta `actualizado` (última sincronización).
+    """
+    invalidos = [g for g in agrupar if g not in AGRUPACIONES]
+    if invalidos:
+        raise HTTPException(422, detail=f"agrupar inválido: {', '.join(invalidos)}")
+    if hasta <= desde:
+        raise HTTPException(422, detail="hasta debe ser posterior a desde")
+    try:
+        filas = totales(desde, hasta, agrupar, numeroCuenta, tipo, estado, limite)
+    except ReportesNoDisponibles as e:
+        raise HTTPException(503, detail=str(e))
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "actualizado": leer_estado(ReportesConfig().directorio).get("marca"),
+        "filas": filas,
+    }
+
+
+@router.get("/estado")
+def reporte_estado():
+    cfg = ReportesConfig()
+    return {
+        "directorio": cfg.directorio,
+        "particiones": len(_archivos(cfg.directorio, date.min, date.max)),
+        **leer_estado(cfg.directorio),
+    }
+
+
+@router.post("/sincronizar")
+def reporte_sincronizar():
+    """Sincroniza ahora (también: python -m app.utilidades.sincronizar_reportes)."""
+    try:
+        return sincronizar()
+    except SincronizacionEnCurso as e:
+        raise HTTPException(409, detail=str(e))
+    except ReportesNoDisponibles as e:
+        raise HTTPException(503, detail=str(e))
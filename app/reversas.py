@@ -0,0 +1,76 @@
+# reversas.py
+from typing import List, Dict, Any
+
+from sqlalchemy import select, func, literal_column
+from sqlalchemy.orm import Session, aliased
+
+from app.models import Transaccion, ESTADO_ANULADA
+
+# Tope de profundidad de la cadena (protege contra ciclos en datos corruptos)
+MAX_NIVELES = 50
+
+
+def vincular_reversa(db: Session, nueva: Transaccion) -> None:
+    """
+    Se llama antes del commit que inserta `nueva`, así el alta y el cambio de
+    estado del original quedan en la misma transacción (atómico).
+    - Si `nueva` anula a otra: UPDATE del original por PK (un index seek).
+    - Si la reversa de `nueva` llegó antes que ella: seek por el índice de
+      id_transaccion_anulada y `nueva` ya nace anulada.
+    """
+    if nueva.id_transaccion_anulada:
+        db.query(Transaccion).filter(
+            Transaccion.id_transaccion == nueva.id_transaccion_anulada
+        ).update({Transaccion.estado: ESTADO_ANULADA}, synchronize_session=False)
+
+    reversa_previa = db.execute(
+        select(Transaccion.id_transaccion)
+        .where(Transaccion.id_transaccion_anulada == nueva.id_transaccion)
+        .limit(1)
+    ).first()
+    if reversa_previa:
+        nueva.estado = ESTADO_ANULADA
+
+
+def cadena_reversas(db: Session, id_transaccion: str) -> List[Dict[str, Any]]:
+    """
+    Devuelve la cadena completa (original -> reversa -> reversa de la reversa...)
+    de cualquier eslabón, en UNA consulta con dos CTE recursivas:
+    `arriba` sube por id_transaccion_anulada hasta el original y `abajo` baja
+    desde ahí por el índice de id_transaccion_anulada.
+    """
+    t = Transaccion.__table__
+    # version es el cursor interno de notificaciones: no forma parte de la respuesta
+    columnas = [c.name for c in t.c if c.name != "version"]
+
+    arriba = (
+        select(t.c.id_transaccion, t.c.id_transaccion_anulada, literal_column("0").label("nivel"))
+        .where(t.c.id_transaccion == id_transaccion)
+        .cte("arriba", recursive=True)
+    )
+    padre = aliased(t)
+    arriba = arriba.union_all(
+        select(padre.c.id_transaccion, padre.c.id_transaccion_anulada, (arriba.c.nivel - 1).label("nivel"))
+        .join(arriba, padre.c.id_transaccion == arriba.c.id_transaccion_anulada)
+        .where(arriba.c.nivel > -MAX_NIVELES)
+    )
+    raiz = (
+        select(arriba.c.id_transaccion)
+        .where(arriba.c.nivel == select(func.min(arriba.c.nivel)).scalar_subquery())
+        .scalar_subquery()
+    )
+
+    abajo = (
+        select(*(t.c[c] for c in columnas), literal_column("0").label("nivel"))
+        .where(t.c.id_transaccion == raiz)
+        .cte("abajo", recursive=True)
+    )
+    hijo = aliased(t)
+    abajo = abajo.union_all(
+        select(*(hijo.c[c] for c in columnas), (abajo.c.nivel + 1).label("nivel"))
+        .join(abajo, hijo.c.id_transaccion_anulada == abajo.c.id_transaccion)
+        .where(abajo.c.nivel < MAX_NIVELES)
+    )
+
+    filas = db.execute(select(abajo).order_by(abajo.c.nivel, abajo.c.fecha_registro)).mappings().all()
+    return [dict(f) for f in filas]
@@ -0,0 +1,315 @@
+# salud.py
+import os
+import time
+import signal
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import anyio.to_thread
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.config import env
+from app.database import db_configurada, get_engine
+
+router = APIRouter()
+
+# =========
+# Estado del proceso (lo marca el lifespan)
+# =========
+class EstadoProceso:
+    def __init__(self):
+        self.listo = False
+        self.drenando = False
+        self.inicio = time.monotonic()
+
+    def marcar_listo(self) -> None:
+        self.listo, self.drenando = True, False
+
+    def marcar_drenando(self) -> None:
+        self.drenando = True
+
+
+proceso = EstadoProceso()
+
+
+def instalar_prestop(retardo_segs: float) -> None:
+    """
+    SIGTERM (en Windows uvicorn convierte Ctrl+Break en SIGTERM): /ready pasa
+    a 503 enseguida y recién después de `retardo_segs` la señal le llega a
+    uvicorn, que deja de aceptar conexiones y drena. Mientras tanto el proceso
+    sigue atendiendo y el balanceador alcanza a ver el 503 y sacarlo. Se llama
+    desde el lifespan, con los handlers de uvicorn ya instalados (se encadenan).
+    Una segunda señal no espera.
+    """
+    if retardo_segs <= 0:
+        return
+    previo = signal.getsignal(signal.SIGTERM)
+    if not callable(previo):
+        return
+    loop = asyncio.get_running_loop()
+
+    def al_recibir(sig, frame):
+        if proceso.drenando:
+            previo(sig, frame)
+            return
+        proceso.marcar_drenando()
+        loop.call_soon_threadsafe(loop.call_later, retardo_segs, previo, sig, None)
+
+    try:
+        signal.signal(signal.SIGTERM, al_recibir)
+    except ValueError:
+        # Fuera del hilo principal (p.ej. TestClient): sin pre-stop
+        pass
+
+
+class SaludConfig:
+    def __init__(self):
+        self.timeout_segs    = float(env("SALUD_TIMEOUT_SEGS", "2"))
+        self.intervalo_segs  = float(env("SALUD_INTERVALO_SEGS", "5"))   # cada cuánto corren las sondas
+        self.requiere_sg     = env("READY_REQUIERE_SG", "0") == "1"      # SG caído no impide recibir webhooks
+        self.umbral_pool     = float(env("SALUD_UMBRAL_POOL", "0.9"))    # ocupación del pool que se avisa
+        self.umbral_cola     = int(env("SALUD_UMBRAL_COLA", "1000"))     # eventos sin entregar a un webhook
+
+
+# =========
+# Sondas (corren en segundo plano, nunca en el request del probe)
+# =========
+def _ping_db() -> Dict[str, Any]:
+    from sqlalchemy import text
+    engine = get_engine()
+    t0 = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {"ok": True, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+def _pool_db() -> Dict[str, Any]:
+    pool = get_engine().pool
+    if not hasattr(pool, "checkedout"):
+        return {"tipo": type(pool).__name__}
+    # La conexión del SELECT 1 ya volvió al pool: esto es lo que usan los requests
+    capacidad = pool.size() + max(0, getattr(pool, "_max_overflow", 0))
+    en_uso = pool.checkedout()
+    return {
+        "tipo": type(pool).__name__,
+        "en_uso": en_uso,
+        "capacidad": capacidad,
+        "ocupacion": round(en_uso / capacidad, 2) if capacidad else None,
+    }
+
+
+async def sondear_db(timeout: float) -> Dict[str, Any]:
+    if not db_configurada():
+        return {"ok": True, "omitido": "BD no configurada"}
+    try:
+        res = await asyncio.wait_for(asyncio.to_thread(_ping_db), timeout)
+    except asyncio.TimeoutError:
+        res = {"ok": False, "error": f"SELECT 1 sin respuesta en {timeout}s"}
+    except Exception as e:
+        res = {"ok": False, "error": str(e)[:200]}
+    try:
+        res["pool"] = _pool_db()
+    except Exception:
+        pass
+    return res
+
+
+def _tokens() -> List[Dict[str, Any]]:
+    """Frescura del token de cada entidad en uso. No hace login: sólo mira el slot."""
+    from app.entidades import get_registro, sg_config
+
+    ahora = datetime.now(timezone.utc)
+    margen = sg_config().token_renew_leeway
+    salida = []
+    for est in get_registro().activos():
+        if not est.token or est.vence is None:
+            estado, segundos = "sin_token", None
+        else:
+            segundos = int((est.vence - ahora).total_seconds())
+            estado = "vencido" if segundos <= 0 else "por_renovar" if segundos <= margen else "vigente"
+        salida.append({"entidad": est.cfg.id_entidad, "estado": estado, "segundos": segundos})
+    return salida
+
+
+async def sondear_sg(timeout: float) -> Dict[str, Any]:
+    """
+    Alcance de SG: un HEAD a la base_url de cada entidad en uso (una vez por
+    host). Cualquier respuesta HTTP cuenta como alcanzable; no consume cupo ni
+    token, así el probe no compite con los requests reales.
+    """
+    from app.catalogos import get_catalogos
+    from app.entidades import get_registro, sg_config
+
+    if not sg_config().base_url and not sg_config().entidades_path:
+        return {"ok": True, "omitido": "SG_BASE_URL no configurado"}
+    try:
+        registro = get_registro()
+        estados = registro.activos() or ([registro.estado()] if registro.default else [])
+    except Exception as e:
+        return {"ok": False, "error": str(e)[:200]}
+
+    async def uno(est) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            r = await est.client.request("HEAD", "/", timeout=timeout)
+            return {"host": est.cfg.base_url, "ok": True, "http": r.status_code,
+                    "ms": round((time.perf_counter() - t0) * 1000, 1)}
+        except Exception as e:
+            return {"host": est.cfg.base_url, "ok": False, "error": f"{type(e).__name__}: {e}"[:200]}
+
+    hosts = {}
+    for est in estados:
+        hosts.setdefault(est.cfg.base_url, est)
+    resultados = await asyncio.gather(*(uno(est) for est in hosts.values()))
+    return {"ok": all(r["ok"] for r in resultados), "hosts": list(resultados), "tokens": _tokens(),
+            "catalogos": get_catalogos().resumen()}
+
+
+def sondear_ingesta() -> Dict[str, Any]:
+    """Cola de ingesta: hilos ocupados con POST /transacciones y atraso de cada webhook."""
+    from app.admision import get_admision
+    from app.notificaciones import broker, cursores_webhook
+
+    limitador = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "hilos_en_uso": limitador.borrowed_tokens,
+        "hilos_max": int(limitador.total_tokens),
+        "eventos_en_buffer": broker.en_buffer(),
+        # None = el atraso ya es mayor que el buffer (se recupera desde la BD)
+        "webhooks_pendientes": {url: broker.pendientes(c) for url, c in cursores_webhook.items()},
+        "admision": get_admision().resumen(),
+    }
+
+
+class SondasSalud:
+    """
+    Corre las sondas cada SALUD_INTERVALO_SEGS en una tarea del lifespan y deja
+    el último resultado en memoria: /health y /ready sólo leen ese dict, así el
+    balanceador puede consultar seguido sin pegarle a la BD ni a SG. Si el
+    resultado envejece (la tarea se trabó) se informa como no saludable.
+    """
+
+    def __init__(self, cfg: SaludConfig):
+        self._cfg = cfg
+        self._tarea: Optional[asyncio.Task] = None
+        self.ultimo: Optional[Dict[str, Any]] = None
+        self._ultimo_t = 0.0
+
+    def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    async def sondear(self) -> Dict[str, Any]:
+        timeout = self._cfg.timeout_segs
+        db, sg = await asyncio.gather(sondear_db(timeout), sondear_sg(timeout))
+        self.ultimo = {"db": db, "sg": sg, "ingesta": sondear_ingesta(),
+                       "generado": datetime.now(timezone.utc).isoformat()}
+        self._ultimo_t = time.monotonic()
+        if not db["ok"] or not sg["ok"]:
+            logging.error(f"Salud degradada: db={db} sg={sg}")
+        return self.ultimo
+
+    async def _ciclo(self) -> None:
+        while True:
+            try:
+                await self.sondear()
+            except Exception as e:
+                logging.error(f"Error en sondas de salud: {e}")
+            await asyncio.sleep(self._cfg.intervalo_segs)
+
+    def edad(self) -> Optional[float]:
+        return round(time.monotonic() - self._ultimo_t, 1) if self.ultimo is not None else None
+
+    def vigente(self) -> bool:
+        edad = self.edad()
+        return edad is not None and edad <= 3 * self._cfg.intervalo_segs + self._cfg.timeout_segs
+
+    def avisos(self) -> List[str]:
+        """Saturación: se informa pero no saca al nodo (bajo carga pareja sacaría a todos)."""
+        if self.ultimo is None:
+            return []
+        avisos = []
+        ocupacion = self.ultimo["db"].get("pool", {}).get("ocupacion")
+        if ocupacion is not None and ocupacion >= self._cfg.umbral_pool:
+            avisos.append(f"pool de BD al {ocupacion:.0%}")
+        ingesta = self.ultimo["ingesta"]
+        if ingesta["hilos_en_uso"] >= ingesta["hilos_max"]:
+            avisos.append("threadpool sin hilos libres")
+        for url, n in ingesta["webhooks_pendientes"].items():
+            if n is None or n >= self._cfg.umbral_cola:
+                avisos.append(f"webhook {url} atrasado ({'más que el buffer' if n is None else n} eventos)")
+        for t in self.ultimo["sg"].get("tokens", []):
+            if t["estado"] == "vencido":
+                avisos.append(f"token SG vencido para {t['entidad']}")
+        return avisos
+
+
+_sondas: Optional[SondasSalud] = None
+
+
+def get_sondas() -> SondasSalud:
+    global _sondas
+    if _sondas is None:
+        _sondas = SondasSalud(SaludConfig())
+    return _sondas
+
+
+def _sano(sondas: SondasSalud) -> bool:
+    u = sondas.ultimo
+    return sondas.vigente() and u["db"]["ok"] and (u["sg"]["ok"] or not SaludConfig().requiere_sg)
+
+
+# =========
+# Endpoints (separados de /status)
+# =========
+@router.get("/live")
+async def live():
+    """Liveness: el proceso y su event loop responden. No toca BD ni SG."""
+    return {"status": "ok", "uptime_segs": int(time.monotonic() - proceso.inicio)}
+
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness: arrancó, no está drenando y la última sonda de BD dio bien (sin
+    BD no se pueden registrar notificaciones). SG sólo bloquea con READY_REQUIERE_SG=1.
+    """
+    if not proceso.listo or proceso.drenando:
+        estado = "drenando" if proceso.drenando else "iniciando"
+        return JSONResponse({"status": estado}, status_code=503)
+    sondas = get_sondas()
+    if sondas.ultimo is None:
+        return JSONResponse({"status": "iniciando"}, status_code=503)
+    ok = _sano(sondas)
+    return JSONResponse({"status": "ok" if ok else "degradado"}, status_code=200 if ok else 503)
+
+
+@router.get("/health")
+async def health():
+    """
+    Detalle de dependencias desde la última sonda en segundo plano: BD (latencia
+    y ocupación del pool), SG (alcance por host y frescura del token por
+    entidad) e ingesta (hilos ocupados y atraso de webhooks). 503 con las
+    mismas reglas que /ready; las saturaciones van en `avisos`.
+    """
+    sondas = get_sondas()
+    if proceso.drenando:
+        status = "drenando"
+    elif sondas.ultimo is None:
+        status = "iniciando"
+    elif not sondas.vigente():
+        status = "sondas_atrasadas"
+    else:
+        status = "ok" if _sano(sondas) else "degradado"
+    from app.lider import get_lider
+
+    cuerpo = {"status": status, "edad_segs": sondas.edad(), "avisos": sondas.avisos(),
+              "proceso": {"pid": os.getpid(), "lider": get_lider().es_lider}, **(sondas.ultimo or {})}
+    return JSONResponse(cuerpo, status_code=200 if status == "ok" else 503)
@@ -1,9 +1,11 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List
+from datetime import datetime
+from app.importes import Importe
 
 class Impuesto(BaseModel):
     idTransaccion: str
-    importe: float
+    importe: Importe
     idTipoTransaccion: int
     tipoImporte: str
     idTipoImporte: str
@@ -18,7 +20,7 @@ class TransaccionNotificada(BaseModel):
     idTransaccionAnulada: Optional[str]
     idTipoTransaccion: int
     numeroCuenta: str
-    importe: float
+    importe: Importe
     idMoneda: int
     fechaOperacion: str
     fechaContable: str
@@ -29,7 +31,7 @@ class TransaccionNotificada(BaseModel):
     idEntidad: str
     idWebOperacion: str
     cuentaBloqueada: Optional[bool]
-    total: float
+    total: Importe
     idCoelsa: Optional[str]
     transaccionCuentaContraparte: Contraparte
     impuestos: List[Impuesto]
@@ -37,3 +39,35 @@ class TransaccionNotificada(BaseModel):
     class Config:
         validate_by_name = True  # <- Pydantic v2 usa este nombre
         extra = "forbid"         # (opcional) rechaza campos inesperados
+
+
+# Titular del CVU según el directorio local (app/directorio.py)
+class UsuarioCVUOut(BaseModel):
+    idUsuario: Optional[str] = None
+    alias: Optional[str] = None
+    numeroCuentaEntidad: Optional[str] = None
+    cuit: Optional[str] = None
+
+# Respuestas de consulta (ERP / Home Mutual). importe se serializa como string exacto.
+class TransaccionOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    idTransaccion: str = Field(validation_alias="id_transaccion")
+    tipo: int
+    numeroCuenta: str = Field(validation_alias="numero_cuenta")
+    importe: Importe
+    fechaOperacion: datetime = Field(validation_alias="fecha_operacion")
+    cvu: str
+    observaciones: Optional[str] = None
+    fechaRegistro: Optional[datetime] = Field(None, validation_alias="fecha_registro")
+    estado: Optional[str] = None
+    idTransaccionAnulada: Optional[str] = Field(None, validation_alias="id_transaccion_anulada")
+    idTransaccionOriginante: Optional[str] = Field(None, validation_alias="id_transaccion_originante")
+    usuario: Optional[UsuarioCVUOut] = None
+
+class EslabonReversa(TransaccionOut):
+    nivel: int  # 0 = original; 1 = su reversa; 2 = reversa de la reversa...
+
+class CadenaReversasOut(BaseModel):
+    idTransaccion: str
+    cadena: List[EslabonReversa]
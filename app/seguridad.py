@@ -0,0 +1,26 @@
+# seguridad.py
+import hmac
+from typing import Optional
+
+from fastapi import HTTPException, Security
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+
+from app.database import get_admin_token
+
+security = HTTPBearer()
+
+
+def admin_valido(token: Optional[str]) -> bool:
+    esperado = get_admin_token()
+    return bool(token and esperado) and hmac.compare_digest(token, esperado)
+
+
+def requiere_admin(credentials: HTTPAuthorizationCredentials = Security(security)) -> None:
+    """
+    Dependencia para endpoints internos y de admin (ERP / Home Mutual):
+    lecturas de /transacciones, /reportes, notificaciones, catálogos y
+    entidades de /sg, /admin. Usa ADMIN_TOKEN, no el AUTH_TOKEN con el que
+    Agilpagos llama al webhook: esa credencial no da acceso a nada más.
+    """
+    if not admin_valido(credentials.credentials):
+        raise HTTPException(401, "Token inválido")
@@ -1,59 +1,83 @@
 # sg.py
-import os
-from typing import Optional, Dict, Any
-from fastapi import APIRouter, HTTPException, Body, Query
-from app.auth_sg import auth_headers, SG_BASE_URL, login_debug, cache_status, get_or_refresh_token
-from pydantic import BaseModel, EmailStr, constr
-import os, httpx
+import json
+import asyncio
+from functools import lru_cache
+from typing import Optional, Dict, Any, FrozenSet, List, Set, Tuple, Union
+from typing_extensions import TypedDict
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Header, Response
+from app.auth_sg import sg_config, login_debug, cache_status, get_or_refresh_token
+from app.entidades import get_registro, EstadoEntidad, EntidadDesconocida, CupoAgotado, json_de
+from app.seguridad import requiere_admin
+from app.idempotencia import idempotente
+from app.catalogos import get_catalogos, CatalogoInvalido, CAMPOS_ALTA
+from app.directorio import registrar_desde_sg, entradas_de_usuario
+from pydantic import BaseModel, ConfigDict, EmailStr, TypeAdapter, ValidationError, constr
+import httpx
 
 
 router = APIRouter()
 
-# Endpoints reales de SG (ajustar según tu PDF 1.8.6/ambiente)
-SG_ENDPOINT_CVU         = os.getenv("SG_ENDPOINT_CVU", "/api/cuentas-pago/cvu")           # EJEMPLO de path
-SG_ENDPOINT_TRANSFER    = os.getenv("SG_ENDPOINT_TRANSFER", "/api/transferencias")        # EJEMPLO de path
-SG_TIMEOUT_SECS         = float(os.getenv("SG_HTTP_TIMEOUT", "20.0"))
+# Listas de cuentas a partir de este tamaño se serializan fuera del event loop
+ITEMS_HILO = 1000
 
-SG_BASE_URL = os.getenv("SG_BASE_URL", "").rstrip("/")
+def _entidad(entidad_id: Optional[str]) -> EstadoEntidad:
+    try:
+        estado = get_registro().estado(entidad_id)
+    except EntidadDesconocida as e:
+        raise HTTPException(404, detail=str(e))
+    if not estado.cfg.base_url:
+        raise HTTPException(500, detail="Falta SG_BASE_URL en .env")
+    return estado
+
+async def _llamar_sg(estado: EstadoEntidad, metodo: str, path: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+    """
+    Request a SG con el pool y el cupo de la entidad. Si la entidad ya tiene
+    todo su cupo en vuelo se corta con 503: no hace esperar a las demás.
+    """
+    try:
+        return await estado.pedir(metodo, path, headers=headers, **kwargs)
+    except CupoAgotado as e:
+        raise HTTPException(503, detail=str(e), headers={"Retry-After": "1"})
 
-def _full_url(path: str) -> str:
-    base = SG_BASE_URL.rstrip("/")
-    return f"{base}{path}"
+async def _token(estado: EstadoEntidad) -> str:
+    try:
+        return await get_or_refresh_token(estado.cfg.id_entidad)
+    except CupoAgotado as e:
+        raise HTTPException(503, detail=str(e), headers={"Retry-After": "1"})
+
+async def _respuesta_json(datos: Any, grande: bool) -> Any:
+    """
+    Las respuestas grandes se serializan en un hilo y salen como bytes; si no,
+    FastAPI las pasa por jsonable_encoder + json.dumps dentro del event loop.
+    """
+    if not grande:
+        return datos
+    cuerpo = await asyncio.to_thread(lambda: json.dumps(datos, ensure_ascii=False).encode("utf-8"))
+    return Response(content=cuerpo, media_type="application/json")
 
 async def _post_to_sg(path: str, payload: Dict[str, Any], entidad_id: Optional[str] = None) -> Dict:
     """
     Plantilla genérica para POST → SG con token automático.
     """
-    if not SG_BASE_URL:
-        raise HTTPException(500, detail="Falta SG_BASE_URL en .env")
-
-    headers = await auth_headers(entidad_id)
-    url     = _full_url(path)
-    timeout = httpx.Timeout(SG_TIMEOUT_SECS, connect=min(10.0, SG_TIMEOUT_SECS))
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        # Dejar pasar 4xx/5xx a un mensaje claro para el front
-        if resp.status_code >= 400:
-            # Propaga texto/JSON de SG para diagnosticar
-            try:
-                raise HTTPException(resp.status_code, detail=resp.json())
-            except Exception:
-                raise HTTPException(resp.status_code, detail=resp.text)
+    estado  = _entidad(entidad_id)
+    headers = {"Authorization": f"bearer {await _token(estado)}"}
+    resp = await _llamar_sg(estado, "POST", path, headers, json=payload)
+    # Dejar pasar 4xx/5xx a un mensaje claro para el front
+    if resp.status_code >= 400:
+        # Propaga texto/JSON de SG para diagnosticar
         try:
-            return resp.json()
+            raise HTTPException(resp.status_code, detail=resp.json())
         except Exception:
-            return {"ok": True, "raw": resp.text}
+            raise HTTPException(resp.status_code, detail=resp.text)
+    try:
+        return await json_de(resp)
+    except Exception:
+        return {"ok": True, "raw": resp.text}
 
 async def _usuario_by_cuit_core(cuit: str, entidad_id: Optional[str] = None) -> Dict[str, Any]:
-    SG_BASE_URL = os.getenv("SG_BASE_URL", "").rstrip("/")
-    if not SG_BASE_URL:
-        raise HTTPException(500, "Falta SG_BASE_URL")
-
-    token = await get_or_refresh_token(entidad_id)
-    url = f"{SG_BASE_URL}/Usuarios/{cuit}/UsuarioByCuit"
-    headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=30) as cli:
-        r = await cli.get(url, headers=headers)
+    estado = _entidad(entidad_id)
+    headers = {"Authorization": f"Bearer {await _token(estado)}"}
+    r = await _llamar_sg(estado, "GET", f"/Usuarios/{cuit}/UsuarioByCuit", headers, timeout=30)
 
     if r.status_code == 404:
         return {"existe": False, "idUsuario": None, "cuentas": [], "rawCount": 0}
@@ -65,7 +89,7 @@ async def _usuario_by_cuit_core(cuit: str, entidad_id: Optional[str] = None) ->
         raise HTTPException(status_code=r.status_code, detail=detail)
 
     try:
-        data = r.json()
+        data = await json_de(r)
     except Exception:
         raise HTTPException(status_code=502, detail="Respuesta no JSON desde SG")
 
@@ -79,6 +103,8 @@ async def _usuario_by_cuit_core(cuit: str, entidad_id: Optional[str] = None) ->
             id_usuario = usuario_list[0]
         cuentas = first.get("cuentas") or []
 
+    if cuentas:
+        await registrar_desde_sg(entradas_de_usuario(id_usuario, cuentas, cuit, estado.cfg.id_entidad))
     return {"existe": bool(id_usuario or cuentas), "idUsuario": id_usuario, "cuentas": cuentas, "rawCount": len(items)}
 
 
@@ -87,8 +113,10 @@ async def _usuario_by_cuit_core(cuit: str, entidad_id: Optional[str] = None) ->
 # =========================================================
 @router.post("/cvu")
 async def crear_o_obtener_cvu(
+    response: Response,
     payload: Dict[str, Any] = Body(..., description="Datos requeridos por SG para CVU (cuit/cuil, titular, etc.)"),
     entidad_id: Optional[str] = Query(None, description="GUID entidad si difiere del por defecto"),
+    idempotency_key: Optional[str] = Header(None, description="Reintentos con la misma clave no vuelven a llamar a SG"),
 ):
     """
     Proxy seguro hacia SG para crear/obtener CVU.
@@ -96,7 +124,10 @@ async def crear_o_obtener_cvu(
     - Este servicio adjunta el Bearer válido y reenvía a SG.
     """
     # TODO: si necesitás validar negocio local (existencia de socio, etc.), hazlo aquí
-    data = await _post_to_sg(SG_ENDPOINT_CVU, payload, entidad_id=entidad_id)
+    data = await idempotente(
+        idempotency_key, "cvu", entidad_id, payload, response,
+        lambda: _post_to_sg(sg_config().endpoint_cvu, payload, entidad_id=entidad_id),
+    )
     return data
 
 # =========================================================
@@ -104,14 +135,20 @@ async def crear_o_obtener_cvu(
 # =========================================================
 @router.post("/transferencias")
 async def iniciar_transferencia(
+    response: Response,
     payload: Dict[str, Any] = Body(..., description="Datos de transferencia: origen, destino (CVU/Alias), importe, concepto"),
     entidad_id: Optional[str] = Query(None, description="GUID entidad si difiere del por defecto"),
+    idempotency_key: Optional[str] = Header(None, description="Reintentos con la misma clave no vuelven a llamar a SG"),
 ):
     """
-    Proxy seguro para crear una transferencia en SG.
+    Proxy seguro para crear una transferencia en SG. Con Idempotency-Key un
+    reintento del ERP (timeout) no genera una segunda transferencia.
     """
     # TODO: validaciones locales (límites, KYC, fraude, etc.) antes de enviar a SG
-    data = await _post_to_sg(SG_ENDPOINT_TRANSFER, payload, entidad_id=entidad_id)
+    data = await idempotente(
+        idempotency_key, "transferencias", entidad_id, payload, response,
+        lambda: _post_to_sg(sg_config().endpoint_transfer, payload, entidad_id=entidad_id),
+    )
     return data
 
 # ===================================================
@@ -145,12 +182,6 @@ async def auth_cache(entidad_id: Optional[str] = Query(None, description="GUID e
     return await cache_status(entidad_id)
 
 
-SG_BASE_URL = os.getenv("SG_BASE_URL", "").rstrip("/")
-SG_ID_DOC_DNI = os.getenv("SG_ID_DOC_DNI")  # <- completar en .env
-SG_ID_TIPO_PERSONA = os.getenv("SG_ID_TIPO_PERSONA", "20EB9127-7CA8-49E0-9E0B-CA8293218ACA")
-SG_ID_TIPO_CUENTA = os.getenv("SG_ID_TIPO_CUENTA", "D2483A34-78BE-40A2-B8CB-07AD4BCF6F61")
-
-
 class AltaUsuarioIn(BaseModel):
     nombre: constr(min_length=1, max_length=40)
     apellido: constr(min_length=1, max_length=40)
@@ -175,44 +206,183 @@ class AltaUsuarioOut(BaseModel):
     yaExistia: bool = False
 
 
+
+# ---------------------------
+# Usuario por CUIT tipado: ?fields= y paginado de cuentas
+# ---------------------------
+CAMPOS_CUENTA = ("cvu", "alias", "numeroCuenta", "idCuenta", "idTipoCuenta")
+CAMPOS_USUARIO = ("idUsuario", "cvu", "alias", "totalCuentas", "cuentas")
+MAX_TAM_PAGINA = 500
+
+class CuentaOut(BaseModel):
+    cvu: Optional[str] = None
+    alias: Optional[str] = None
+    numeroCuenta: Optional[str] = None
+    idCuenta: Optional[str] = None
+    idTipoCuenta: Optional[str] = None
+
+class UsuarioOut(BaseModel):
+    existe: bool
+    idUsuario: Optional[str] = None
+    cvu: Optional[str] = None            # de la primera cuenta
+    alias: Optional[str] = None
+    totalCuentas: Optional[int] = None
+    pagina: Optional[int] = None
+    tamPagina: Optional[int] = None
+    cuentas: Optional[List[CuentaOut]] = None
+
+
+@lru_cache(maxsize=64)
+def _adaptador_sg(campos_cuenta: FrozenSet[str]) -> TypeAdapter:
+    """
+    Esquema de la respuesta de UsuarioByCuit con sólo los campos de cuenta pedidos.
+    Con extra="ignore" pydantic-core saltea el resto del JSON sin crear objetos
+    Python. TypedDict y no BaseModel: con decenas de miles de cuentas crear una
+    instancia de modelo por cuenta cuesta más que el propio parseo.
+    """
+    config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+    cuenta = TypedDict("CuentaSG", {c: Optional[str] for c in campos_cuenta}, total=False)
+    cuenta.__pydantic_config__ = config
+    # SG manda null en vez de [] cuando no hay usuario/cuentas: se normaliza a [] en _usuario_tipado
+    usuario = TypedDict(
+        "UsuarioSG", {"usuario": Optional[List[Optional[str]]], "cuentas": Optional[List[cuenta]]}, total=False
+    )
+    usuario.__pydantic_config__ = config
+    return TypeAdapter(Union[List[usuario], usuario])
+
+def _parse_fields(fields: Optional[str]) -> Tuple[Set[str], Set[str]]:
+    """'idUsuario,cuentas.cvu' -> ({idUsuario, cuentas}, {cvu}). Sin fields: todo."""
+    if not fields:
+        return set(CAMPOS_USUARIO), set(CAMPOS_CUENTA)
+    campos_u, campos_c = set(), set()
+    for f in (x.strip() for x in fields.split(",") if x.strip()):
+        if f.startswith("cuentas."):
+            sub = f[len("cuentas."):]
+            if sub not in CAMPOS_CUENTA:
+                raise HTTPException(400, f"Campo de cuenta desconocido: {sub}. Válidos: {', '.join(CAMPOS_CUENTA)}")
+            campos_u.add("cuentas")
+            campos_c.add(sub)
+        elif f in CAMPOS_USUARIO:
+            campos_u.add(f)
+        else:
+            raise HTTPException(400, f"Campo desconocido: {f}. Válidos: {', '.join(CAMPOS_USUARIO)} o cuentas.<campo>")
+    if "cuentas" in campos_u and not campos_c:
+        campos_c = set(CAMPOS_CUENTA)
+    return campos_u, campos_c
+
+async def _usuario_tipado(estado: EstadoEntidad, cuit: str, campos_cuenta: FrozenSet[str]) -> Optional[Tuple[Optional[str], list]]:
+    """(idUsuario, cuentas) parseando sólo `campos_cuenta`; None si SG no lo conoce."""
+    headers = {"Authorization": f"Bearer {await _token(estado)}"}
+    r = await _llamar_sg(estado, "GET", f"/Usuarios/{cuit}/UsuarioByCuit", headers, timeout=30)
+    if r.status_code == 404:
+        return None
+    if r.status_code >= 400:
+        try:
+            detail = r.json()
+        except Exception:
+            detail = r.text
+        raise HTTPException(status_code=r.status_code, detail=detail)
+
+    adaptador = _adaptador_sg(campos_cuenta)
+    try:
+        if len(r.content) >= sg_config().json_hilo_bytes:
+            data = await asyncio.to_thread(adaptador.validate_json, r.content)
+        else:
+            data = adaptador.validate_json(r.content)
+    except ValidationError:
+        raise HTTPException(status_code=502, detail="Respuesta de SG con formato inesperado")
+
+    items = data if isinstance(data, list) else [data]
+    if not items:
+        return None
+    first = items[0]
+    usuario = first.get("usuario") or []
+    return (usuario[0] if usuario else None), first.get("cuentas") or []
+
+
+@router.get("/usuarios/{cuit}", response_model=UsuarioOut, response_model_exclude_unset=True)
+async def usuario_por_cuit(
+    cuit: str,
+    entidad_id: Optional[str] = Query(None, description="GUID entidad opcional"),
+    fields: Optional[str] = Query(None, description="Ej: idUsuario,cvu o cuentas.cvu,cuentas.alias,totalCuentas"),
+    pagina: int = Query(1, ge=1),
+    tamPagina: int = Query(50, ge=1, le=MAX_TAM_PAGINA),
+):
+    """
+    Vista tipada y recortada de UsuarioByCuit: sólo los campos pedidos y una
+    página de cuentas. `cvu`/`alias` de primer nivel son los de la primera cuenta.
+    """
+    campos_u, campos_c = _parse_fields(fields)
+    necesarios = set(campos_c) if "cuentas" in campos_u else set()
+    necesarios |= {c for c in ("cvu", "alias") if c in campos_u}
+    res = await _usuario_tipado(_entidad(entidad_id), cuit, frozenset(necesarios))
+    if res is None:
+        return UsuarioOut(existe=False)
+    id_usuario, cuentas = res
+
+    out: Dict[str, Any] = {"existe": bool(id_usuario or cuentas)}
+    primera = cuentas[0] if cuentas else None
+    if "idUsuario" in campos_u:
+        out["idUsuario"] = id_usuario
+    for c in ("cvu", "alias"):
+        if c in campos_u:
+            out[c] = primera.get(c) if primera is not None else None
+    if "totalCuentas" in campos_u:
+        out["totalCuentas"] = len(cuentas)
+    if "cuentas" in campos_u:
+        inicio = (pagina - 1) * tamPagina
+        out["pagina"], out["tamPagina"] = pagina, tamPagina
+        out["cuentas"] = [CuentaOut(**{k: c.get(k) for k in campos_c}) for c in cuentas[inicio:inicio + tamPagina]]
+    return UsuarioOut(**out)
+
 # ---------------------------
 # 1) Usuarios por CUIT (RAW)
 # ---------------------------
 @router.get("/usuarios/{cuit}/by-cuit")
 async def usuario_by_cuit(cuit: str, entidad_id: Optional[str] = Query(None, description="GUID entidad opcional")):
-    return await _usuario_by_cuit_core(cuit, entidad_id)
+    data = await _usuario_by_cuit_core(cuit, entidad_id)
+    return await _respuesta_json(data, len(data["cuentas"]) >= ITEMS_HILO)
 
 @router.get("/usuarios/{cuit}/raw")
 async def usuario_raw(cuit: str, entidad_id: Optional[str] = Query(None, description="GUID entidad opcional")):
-    from os import getenv
-    SG_BASE_URL = getenv("SG_BASE_URL", "").rstrip("/")
-    token = await get_or_refresh_token(entidad_id)
-    url = f"{SG_BASE_URL}/Usuarios/{cuit}/UsuarioByCuit"
-    headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=30) as cli:
-        r = await cli.get(url, headers=headers)
+    estado = _entidad(entidad_id)
+    headers = {"Authorization": f"Bearer {await _token(estado)}"}
+    r = await _llamar_sg(estado, "GET", f"/Usuarios/{cuit}/UsuarioByCuit", headers, timeout=30)
     try:
-        body = r.json()
+        body = await json_de(r)
     except Exception:
         body = r.text
-    return {"status_code": r.status_code, "content_type": r.headers.get("content-type", ""), "body": body}
+    datos = {"status_code": r.status_code, "content_type": r.headers.get("content-type", ""), "body": body}
+    return await _respuesta_json(datos, len(r.content) >= sg_config().json_hilo_bytes)
 
 
 @router.post("/usuarios", response_model=AltaUsuarioOut)
-async def crear_usuario(req: AltaUsuarioIn):
-    # 0) sanity SG
-    if not SG_BASE_URL:
-        raise HTTPException(500, "Falta SG_BASE_URL")
-    if not (req.idEntidadTipoDocumento or SG_ID_DOC_DNI):
-        raise HTTPException(500, "Falta idEntidadTipoDocumento (en body o en SG_ID_DOC_DNI)")
+async def crear_usuario(
+    req: AltaUsuarioIn,
+    response: Response,
+    entidad_id: Optional[str] = Query(None, description="GUID entidad si difiere del por defecto"),
+    idempotency_key: Optional[str] = Header(None, description="Reintentos con la misma clave no vuelven a llamar a SG"),
+):
+    return await idempotente(
+        idempotency_key, "usuarios", entidad_id, req.model_dump(mode="json"), response,
+        lambda: _crear_usuario_core(req, entidad_id),
+    )
+
+
+async def _crear_usuario_core(req: AltaUsuarioIn, entidad_id: Optional[str]) -> AltaUsuarioOut:
+    # 0) catálogos: body o default de la entidad, validados en memoria (sin ir a SG)
+    estado = _entidad(entidad_id)
+    try:
+        catalogos = await get_catalogos().resolver_alta(estado.cfg, req.model_dump(include=set(CAMPOS_ALTA)))
+    except CatalogoInvalido as e:
+        raise HTTPException(422, detail=str(e))
     # 1) evitar duplicados por CUIT
-    existe = await _usuario_by_cuit_core(str(req.cuit))
-    if existe.get("existe") and existe.get("idUsuario"):
-        return AltaUsuarioOut(idUsuario=existe["idUsuario"], yaExistia=True)
+    #    (sólo interesa el idUsuario: las cuentas no se parsean)
+    existe = await _usuario_tipado(estado, str(req.cuit), frozenset())
+    if existe is not None and existe[0]:
+        return AltaUsuarioOut(idUsuario=existe[0], yaExistia=True)
 
-    token = await get_or_refresh_token()
-    url = f"{SG_BASE_URL}/Usuarios"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    headers = {"Authorization": f"Bearer {await _token(estado)}", "Content-Type": "application/json"}
 
     # Normalizaciones
     def _to_int_cuit(v: Any) -> int:
@@ -226,7 +396,7 @@ async def crear_usuario(req: AltaUsuarioIn):
         "apellido": req.apellido,
         "razonSocial": req.razonSocial,  # puede ser null
         "sexo": req.sexo,
-        "idEntidadTipoDocumento": req.idEntidadTipoDocumento or SG_ID_DOC_DNI,
+        "idEntidadTipoDocumento": catalogos["idEntidadTipoDocumento"],
         "numeroDocumento": req.numeroDocumento,
         "fechaNacimiento": req.fechaNacimiento,   # ISO, SG acepta con hora (como tu ejemplo)
         "cuit": _to_int_cuit(req.cuit),
@@ -234,13 +404,12 @@ async def crear_usuario(req: AltaUsuarioIn):
         "caracteristicaPaisTelefono": req.caracteristicaPaisTelefono,
         "codigoAreaTelefono": req.codigoAreaTelefono,
         "numeroTelefono": req.numeroTelefono,
-        "idTipoPersona": req.idTipoPersona or SG_ID_TIPO_PERSONA,
+        "idTipoPersona": catalogos["idTipoPersona"],
         "numeroCuentaEntidad": req.numeroCuentaEntidad,
-        "idTipoCuenta": req.idTipoCuenta or SG_ID_TIPO_CUENTA,
+        "idTipoCuenta": catalogos["idTipoCuenta"],
     }
 
-    async with httpx.AsyncClient(timeout=30) as cli:
-        r = await cli.post(url, headers=headers, json=payload)
+    r = await _llamar_sg(estado, "POST", "/Usuarios", headers, json=payload, timeout=30)
 
     if r.status_code >= 400:
         try:
@@ -250,4 +419,58 @@ async def crear_usuario(req: AltaUsuarioIn):
         raise HTTPException(status_code=r.status_code, detail=detail)
 
     data = r.json()  # {"idUsuario": "...", "alias": "...", "cvu": "..."}
+    await registrar_desde_sg([{
+        "cvu": data.get("cvu"), "idUsuario": data.get("idUsuario"), "alias": data.get("alias"),
+        "numeroCuentaEntidad": req.numeroCuentaEntidad, "cuit": payload["cuit"], "idEntidad": estado.cfg.id_entidad,
+    }])
     return AltaUsuarioOut(**data, yaExistia=False)
+
+
+# ---------------------------
+# Catálogos de referencia (tipos de documento, persona y cuenta) desde memoria
+# ---------------------------
+@router.get("/catalogos", dependencies=[Depends(requiere_admin)])
+async def catalogos_sg(
+    entidad_id: Optional[str] = Query(None, description="GUID entidad opcional"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Catálogos de la entidad tal como están en memoria de este proceso (ETag + max-age)."""
+    estado = _entidad(entidad_id)
+    cache = get_catalogos()
+    # Sin carga previa (worker no líder, entidad nueva o SG caído): un intento en línea
+    datos = await cache.obtener(estado.cfg.id_entidad)
+    if datos is None:
+        error = cache.resumen().get(estado.cfg.id_entidad, {}).get("error") or "sin cargar"
+        raise HTTPException(503, detail=f"Catálogos de SG no disponibles: {error}", headers={"Retry-After": "30"})
+    headers = {"ETag": datos.etag, "Cache-Control": f"private, max-age={cache.cfg.max_age_segs}"}
+    if if_none_match and datos.etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=datos.cuerpo, media_type="application/json", headers=headers)
+
+@router.post("/catalogos/recargar", dependencies=[Depends(requiere_admin)])
+async def recargar_catalogos(entidad_id: Optional[str] = Query(None, description="GUID entidad opcional")):
+    """Vuelve a pedir los catálogos a SG sin esperar al refresco periódico."""
+    estado = _entidad(entidad_id)
+    try:
+        await get_catalogos().refrescar(estado.cfg.id_entidad)
+    except Exception as e:
+        raise HTTPException(502, detail=f"No se pudieron cargar los catálogos: {e}")
+    return get_catalogos().resumen()
+
+
+# ---------------------------
+# Entidades (multi-mutual)
+# ---------------------------
+@router.get("/entidades", dependencies=[Depends(requiere_admin)])
+async def listar_entidades():
+    """Entidades configuradas con su cupo, requests en vuelo y si tienen token."""
+    return get_registro().listar()
+
+@router.post("/entidades/recargar", dependencies=[Depends(requiere_admin)])
+async def recargar_entidades():
+    """Relee SG_ENTIDADES_PATH sin reiniciar (también se relee solo al cambiar el archivo)."""
+    try:
+        get_registro().cargar()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(400, detail=f"SG_ENTIDADES_PATH inválido: {e}")
+    return get_registro().listar()
@@ -0,0 +1,353 @@
+# sg_fake.py
+'''
+SG falso embebible (sin red) y cassettes de interacciones reales.
+
+- `crear_app_fake(perfil)`: app FastAPI que imita los endpoints que usamos de SG
+  (Account/Login, Usuarios, CVU, transferencias, catálogos y Movimientos con las formas de
+  openapi_agilpagos.yaml) con latencia y fallas configurables.
+- `TransporteCassette`: transporte httpx que graba (contra el SG real) o
+  reproduce interacciones desde un archivo JSONL, sin secretos.
+
+Se activa por entidad desde entidades.py con SG_FAKE=1 o SG_CASSETTE_PATH.
+'''
+import json
+import uuid
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.config import env
+
+# Campos que cambian en cada request o que son secretos: no entran en la
+# clave de matcheo del cassette ni se graban en claro
+VOLATILES = {"nonce", "created", "password"}
+SECRETOS = {"password", "token", "accesstoken", "bearertoken", "refreshtoken", "authorization"}
+
+
+# =========
+# Perfil de latencia / fallas
+# =========
+class PerfilFake:
+    def __init__(
+        self,
+        latencia_ms: float = 0,
+        jitter_ms: float = 0,
+        tasa_5xx: float = 0.0,
+        tasa_429: float = 0.0,
+        ttl_token_segs: int = 3600,
+        semilla: Optional[int] = None,
+    ):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tasa_5xx = tasa_5xx
+        self.tasa_429 = tasa_429
+        self.ttl_token_segs = ttl_token_segs
+        self.rnd = random.Random(semilla)
+
+    @classmethod
+    def desde_env(cls) -> "PerfilFake":
+        semilla = env("SG_FAKE_SEMILLA")
+        return cls(
+            latencia_ms=float(env("SG_FAKE_LATENCIA_MS", "0")),
+            jitter_ms=float(env("SG_FAKE_JITTER_MS", "0")),
+            tasa_5xx=float(env("SG_FAKE_TASA_5XX", "0")),
+            tasa_429=float(env("SG_FAKE_TASA_429", "0")),
+            ttl_token_segs=int(env("SG_FAKE_TTL_TOKEN_SEGS", "3600")),
+            semilla=int(semilla) if semilla else None,
+        )
+
+
+class EstadoFake:
+    """Datos y contadores del SG falso (para aserciones y benchmarks)."""
+
+    def __init__(self):
+        self.tokens: Dict[str, datetime] = {}
+        self.usuarios: Dict[str, Dict[str, Any]] = {}  # cuit -> usuario
+        self.movimientos: List[Dict[str, Any]] = []
+        self.llamadas: Dict[str, int] = {}
+        self.en_vuelo = 0
+        self.max_en_vuelo = 0
+
+    def contar(self, ruta: str) -> None:
+        self.llamadas[ruta] = self.llamadas.get(ruta, 0) + 1
+
+    def agregar_usuario(self, cuit: str, cuentas: int = 1) -> Dict[str, Any]:
+        """
+        Alta directa (sin pasar por POST /Usuarios). La respuesta de UsuarioByCuit
+        queda serializada de antemano: con miles de cuentas el fake no debe
+        ocupar el event loop que se está midiendo.
+        """
+        u = {"idUsuario": str(uuid.uuid4()), "cvu": _cvu_fake(cuit), "alias": f"fake.{cuit[-4:]}.sg"}
+        lista = [{"cvu": _cvu_fake(f"{cuit}-{i}"), "alias": f"fake.{cuit[-4:]}.{i}", "numeroCuenta": f"{i:08d}"}
+                 for i in range(cuentas)]
+        u["crudo"] = json.dumps([{"usuario": [u["idUsuario"]], "cuentas": lista}]).encode("utf-8")
+        self.usuarios[cuit] = u
+        return u
+
+
+def _cvu_fake(semilla: str) -> str:
+    digitos = str(int(hashlib.sha1(semilla.encode()).hexdigest(), 16))
+    return ("0000" + digitos)[:22].ljust(22, "0")
+
+
+def movimiento_fake(rnd: random.Random, fecha: datetime, numero_cuenta: str = "000123") -> Dict[str, Any]:
+    """Movimiento con la forma de TransaccionNotificada (openapi_agilpagos.yaml)."""
+    importe = f"{rnd.randint(100, 500_000) / 100:.2f}"
+    return {
+        "idTransaccion": str(uuid.UUID(int=rnd.getrandbits(128))),
+        "idTransaccionAnulada": None,
+        "idTipoTransaccion": rnd.choice([1, 2]),
+        "numeroCuenta": numero_cuenta,
+        "importe": importe,
+        "idMoneda": 1,
+        "fechaOperacion": fecha.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fechaContable": fecha.strftime("%Y-%m-%dT%H:%M:%S"),
+        "observaciones": "Movimiento fake",
+        "CVU": _cvu_fake(numero_cuenta),
+        "idTransaccionOriginante": None,
+        "total": importe,
+    }
+
+
+# Catálogos de referencia (incluyen los GUID por defecto de SGConfig)
+CATALOGOS_FAKE = {
+    "tiposDocumento": [
+        {"id": "6F0D8A52-1B7E-4C55-9D0B-3C1E7B2A9F10", "descripcion": "DNI"},
+        {"id": "A1C3E5F7-2B4D-4E6F-8A0B-1C2D3E4F5A6B", "descripcion": "PASAPORTE"},
+    ],
+    "tiposPersona": [
+        {"id": "20EB9127-7CA8-49E0-9E0B-CA8293218ACA", "descripcion": "Física"},
+        {"id": "5B7C9D1E-3F5A-4B7C-9D1E-3F5A7B9C1D3E", "descripcion": "Jurídica"},
+    ],
+    "tiposCuenta": [
+        {"id": "D2483A34-78BE-40A2-B8CB-07AD4BCF6F61", "descripcion": "Caja de ahorro"},
+    ],
+}
+
+
+# =========
+# App fake
+# =========
+def crear_app_fake(perfil: Optional[PerfilFake] = None, estado: Optional[EstadoFake] = None) -> FastAPI:
+    perfil = perfil or PerfilFake()
+    estado = estado or EstadoFake()
+    app = FastAPI(title="SG fake")
+    app.state.fake = estado
+    app.state.perfil = perfil
+
+    @app.middleware("http")
+    async def latencia_y_fallas(request: Request, call_next):
+        estado.contar(f"{request.method} {request.url.path}")
+        estado.en_vuelo += 1
+        estado.max_en_vuelo = max(estado.max_en_vuelo, estado.en_vuelo)
+        try:
+            demora = perfil.latencia_ms + perfil.rnd.uniform(0, perfil.jitter_ms)
+            if demora > 0:
+                await asyncio.sleep(demora / 1000)
+            sorteo = perfil.rnd.random()
+            if sorteo < perfil.tasa_429:
+                return JSONResponse({"error": "Too Many Requests"}, status_code=429, headers={"Retry-After": "1"})
+            if sorteo < perfil.tasa_429 + perfil.tasa_5xx:
+                return JSONResponse({"error": "Error interno SG (fake)"}, status_code=503)
+            if request.url.path != "/Account/Login" and not _token_ok(request):
+                return JSONResponse({"error": "Unauthorized"}, status_code=401)
+            return await call_next(request)
+        finally:
+            estado.en_vuelo -= 1
+
+    def _token_ok(request: Request) -> bool:
+        auth = request.headers.get("authorization", "")
+        token = auth.split(" ", 1)[1] if " " in auth else ""
+        vence = estado.tokens.get(token)
+        return vence is not None and vence > datetime.now(timezone.utc)
+
+    @app.post("/Account/Login")
+    async def login(body: Dict[str, Any]):
+        faltan = [k for k in ("userName", "password", "nonce", "created", "idEntidad") if not body.get(k)]
+        if faltan:
+            return JSONResponse({"error": f"Faltan {faltan}"}, status_code=400)
+        token = uuid.uuid4().hex
+        vence = datetime.now(timezone.utc) + timedelta(seconds=perfil.ttl_token_segs)
+        estado.tokens[token] = vence
+        return {"token": token, "expiration": vence.strftime("%Y-%m-%dT%H:%M:%SZ"), "refreshToken": uuid.uuid4().hex}
+
+    @app.get("/Usuarios/{cuit}/UsuarioByCuit")
+    async def usuario_by_cuit(cuit: str):
+        u = estado.usuarios.get(cuit)
+        if u is None:
+            return JSONResponse({"error": "No encontrado"}, status_code=404)
+        return Response(content=u["crudo"], media_type="application/json")
+
+    @app.post("/Usuarios")
+    async def alta_usuario(body: Dict[str, Any]):
+        cuit = str(body.get("cuit", ""))
+        if cuit in estado.usuarios:
+            return JSONResponse({"error": "Usuario existente"}, status_code=409)
+        u = estado.agregar_usuario(cuit)
+        return {"idUsuario": u["idUsuario"], "cvu": u["cvu"], "alias": u["alias"]}
+
+    @app.post(env("SG_ENDPOINT_CVU", "/api/cuentas-pago/cvu"))
+    async def cvu(body: Dict[str, Any]):
+        clave = str(body.get("cuit") or body.get("numeroCuenta") or uuid.uuid4())
+        return {"cvu": _cvu_fake(clave), "alias": f"fake.{clave[-4:]}.cvu"}
+
+    @app.post(env("SG_ENDPOINT_TRANSFER", "/api/transferencias"))
+    async def transferencia(body: Dict[str, Any]):
+        return {"idTransferencia": str(uuid.uuid4()), "estado": "PENDIENTE", "importe": body.get("importe")}
+
+    @app.get(env("SG_ENDPOINT_TIPOS_DOCUMENTO", "/Catalogos/TiposDocumento"))
+    async def tipos_documento():
+        return CATALOGOS_FAKE["tiposDocumento"]
+
+    @app.get(env("SG_ENDPOINT_TIPOS_PERSONA", "/Catalogos/TiposPersona"))
+    async def tipos_persona():
+        return CATALOGOS_FAKE["tiposPersona"]
+
+    @app.get(env("SG_ENDPOINT_TIPOS_CUENTA", "/Catalogos/TiposCuenta"))
+    async def tipos_cuenta():
+        return CATALOGOS_FAKE["tiposCuenta"]
+
+    @app.get(env("SG_ENDPOINT_MOVIMIENTOS", "/Movimientos"))
+    async def movimientos(fechaDesde: str, fechaHasta: str, pagina: int = 1, tamanioPagina: int = 500):
+        desde, hasta = datetime.fromisoformat(fechaDesde), datetime.fromisoformat(fechaHasta)
+        items = [m for m in estado.movimientos if desde <= datetime.fromisoformat(m["fechaOperacion"]) < hasta]
+        total = max(1, -(-len(items) // tamanioPagina))
+        inicio = (pagina - 1) * tamanioPagina
+        return {"items": items[inicio:inicio + tamanioPagina], "totalPaginas": total}
+
+    return app
+
+
+_app_fake: Optional[FastAPI] = None
+
+
+def app_fake() -> FastAPI:
+    """Un SG fake por proceso (compartido por todas las entidades), perfil desde env."""
+    global _app_fake
+    if _app_fake is None:
+        _app_fake = crear_app_fake(PerfilFake.desde_env())
+    return _app_fake
+
+
+def transporte_fake() -> httpx.AsyncBaseTransport:
+    return httpx.ASGITransport(app=app_fake())
+
+
+# =========
+# Cassettes (grabar / reproducir)
+# =========
+def _redactar(valor: Any) -> Any:
+    if isinstance(valor, dict):
+        return {k: ("***" if k.lower() in SECRETOS else _redactar(v)) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_redactar(v) for v in valor]
+    return valor
+
+
+def _cuerpo_json(contenido: bytes) -> Any:
+    if not contenido:
+        return None
+    try:
+        return json.loads(contenido)
+    except ValueError:
+        return contenido.decode("utf-8", "replace")
+
+
+def clave_interaccion(metodo: str, url: httpx.URL, cuerpo: Any) -> str:
+    """método + path + query ordenada + hash del body sin campos volátiles."""
+    if isinstance(cuerpo, dict):
+        cuerpo = {k: v for k, v in cuerpo.items() if k not in VOLATILES}
+    query = "&".join(sorted(f"{k}={v}" for k, v in url.params.multi_items()))
+    huella = hashlib.sha256(json.dumps(cuerpo, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{metodo} {url.path}?{query} {huella}"
+
+
+class TransporteCassette(httpx.AsyncBaseTransport):
+    """
+    modo "grabar": reenvía al SG real y agrega cada interacción al JSONL.
+    modo "reproducir": responde desde el JSONL; interacciones repetidas con la
+    misma clave se devuelven en el orden grabado (la última se repite).
+    Una request sin grabación devuelve 599 para que el faltante sea evidente.
+    """
+
+    def __init__(self, path: str, modo: str = "reproducir", real: Optional[httpx.AsyncBaseTransport] = None):
+        if modo not in ("grabar", "reproducir"):
+            raise ValueError(f"SG_CASSETTE_MODO inválido: {modo}")
+        self.path = path
+        self.modo = modo
+        self._real = real
+        self._grabadas: Dict[str, List[Dict[str, Any]]] = {}
+        self._usos: Dict[str, int] = {}
+        if modo == "reproducir":
+            self._cargar()
+        elif self._real is None:
+            self._real = httpx.AsyncHTTPTransport()
+
+    def _cargar(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip():
+                    i = json.loads(linea)
+                    self._grabadas.setdefault(i["clave"], []).append(i)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cuerpo = _cuerpo_json(await request.aread())
+        clave = clave_interaccion(request.method, request.url, cuerpo)
+        if self.modo == "reproducir":
+            return self._reproducir(clave)
+
+        resp = await self._real.handle_async_request(request)
+        contenido = await resp.aread()
+        interaccion = {
+            "clave": clave,
+            "request": {"metodo": request.method, "path": request.url.path, "body": _redactar(cuerpo)},
+            "response": {
+                "status": resp.status_code,
+                "content_type": resp.headers.get("content-type", ""),
+                "body": _redactar(_cuerpo_json(contenido)),
+            },
+        }
+        await asyncio.to_thread(self._agregar, interaccion)
+        # `contenido` ya viene descomprimido: no se reenvían encoding ni largo originales
+        headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(resp.status_code, headers=headers, content=contenido)
+
+    def _agregar(self, interaccion: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(interaccion, ensure_ascii=False) + "\n")
+
+    def _reproducir(self, clave: str) -> httpx.Response:
+        grabadas = self._grabadas.get(clave)
+        if not grabadas:
+            return httpx.Response(599, json={"error": f"Sin grabación para {clave}"})
+        uso = self._usos.get(clave, 0)
+        self._usos[clave] = uso + 1
+        r = grabadas[min(uso, len(grabadas) - 1)]["response"]
+        body = r["body"]
+        # Un token redactado se reemplaza por uno fake para que el login siga funcionando
+        if isinstance(body, dict):
+            body = {k: (uuid.uuid4().hex if v == "***" else v) for k, v in body.items()}
+        if isinstance(body, (dict, list)) or body is None:
+            return httpx.Response(r["status"], json=body)
+        return httpx.Response(r["status"], text=body, headers={"content-type": r["content_type"]})
+
+    async def aclose(self) -> None:
+        if self._real is not None:
+            await self._real.aclose()
+
+
+def transporte_sg() -> Tuple[Optional[httpx.AsyncBaseTransport], str]:
+    """Transporte para el cliente de cada entidad según env: (transporte, descripción)."""
+    path = env("SG_CASSETTE_PATH", "")
+    if path:
+        modo = env("SG_CASSETTE_MODO", "reproducir")
+        return TransporteCassette(path, modo), f"cassette:{modo}"
+    if env("SG_FAKE", "0") == "1":
+        return transporte_fake(), "fake"
+    return None, "real"
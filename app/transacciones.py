@@ -0,0 +1,138 @@
+# transacciones.py
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+from app.cache_respuestas import CacheConfig, Entrada, calcular_etag, get_cache
+from app.database import get_read_db
+from app.directorio import get_directorio
+from app.models import Transaccion, ESTADO_ANULADA
+from app.reversas import cadena_reversas
+from app.schemas import CadenaReversasOut, TransaccionOut, UsuarioCVUOut
+from app.seguridad import requiere_admin
+
+# Consultas internas sobre transacciones_agilpagos (ERP / Home Mutual)
+router = APIRouter(dependencies=[Depends(requiere_admin)])
+
+_una = TypeAdapter(TransaccionOut)
+_lista = TypeAdapter(List[TransaccionOut])
+MAX_LIMITE = 10000
+
+
+def _respuesta(entrada: Entrada, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": entrada.etag, "Cache-Control": entrada.cache_control}
+    if if_none_match and entrada.etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entrada.cuerpo, media_type="application/json", headers=headers)
+
+
+def _enriquecida(t: Transaccion) -> TransaccionOut:
+    # Lookup en memoria por CVU: no agrega consultas a la BD
+    out = TransaccionOut.model_validate(t)
+    usuario = get_directorio().buscar(t.cvu)
+    if usuario is not None:
+        out.usuario = UsuarioCVUOut(**usuario)
+    return out
+
+
+def _version_directorio() -> str:
+    # El cuerpo cacheado lleva el bloque usuario: si el directorio cambió, la
+    # clave (y por lo tanto el ETag) es otra; las entradas viejas salen por LRU/TTL
+    return f"|dir:{get_directorio().version}"
+
+
+def _clave(request: Request) -> str:
+    return (request.url.path + "?" + "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+            + _version_directorio())
+
+
+@router.get("", response_model=List[TransaccionOut])
+def listar_transacciones(
+    request: Request,
+    desde: datetime = Query(..., description="fecha_operacion desde (inclusive)"),
+    hasta: datetime = Query(..., description="fecha_operacion hasta (exclusive)"),
+    numeroCuenta: Optional[str] = Query(None),
+    limite: int = Query(1000, ge=1, le=MAX_LIMITE),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Transacciones por ventana de fecha_operacion (y cuenta opcional).
+    Con la respuesta en cache no se toca la BD (la sesión no abre conexión
+    hasta la primera consulta) y con If-None-Match se contesta 304.
+    """
+    cache = get_cache()
+    clave = _clave(request)
+    entrada = cache.get(clave)
+    if entrada is None:
+        q = db.query(Transaccion).filter(
+            Transaccion.fecha_operacion >= desde, Transaccion.fecha_operacion < hasta
+        )
+        if numeroCuenta:
+            q = q.filter(Transaccion.numero_cuenta == numeroCuenta)
+        filas = q.order_by(Transaccion.fecha_operacion).limit(limite).all()
+        cuerpo = _lista.dump_json([_enriquecida(t) for t in filas])
+        cfg = CacheConfig()
+        # Ventana cerrada hace más de un día: sólo cambia por notificaciones tardías
+        cerrada = hasta < datetime.now() - timedelta(days=1)
+        entrada = Entrada(
+            etag=calcular_etag(cuerpo),
+            cuerpo=cuerpo,
+            cache_control=f"private, max-age={cfg.ttl}" if cerrada else "private, no-cache",
+            vence=time.monotonic() + cfg.ttl,
+            cuenta=numeroCuenta,
+            rango=(desde, hasta),
+            ids={t.id_transaccion for t in filas},
+        )
+        cache.put(clave, entrada)
+    return _respuesta(entrada, if_none_match)
+
+
+@router.get("/{id_transaccion}", response_model=TransaccionOut)
+def obtener_transaccion(
+    id_transaccion: str,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Detalle de una transacción registrada. Las anuladas ya no cambian: se
+    cachean (y se pueden cachear en el cliente) por más tiempo.
+    """
+    cache = get_cache()
+    clave = f"id:{id_transaccion}" + _version_directorio()
+    entrada = cache.get(clave)
+    if entrada is None:
+        t = db.get(Transaccion, id_transaccion)
+        if t is None:
+            raise HTTPException(404, "Transacción no encontrada")
+        cuerpo = _una.dump_json(_enriquecida(t))
+        final = t.estado == ESTADO_ANULADA
+        cfg = CacheConfig()
+        ttl = cfg.ttl_final if final else cfg.ttl
+        entrada = Entrada(
+            etag=calcular_etag(cuerpo),
+            cuerpo=cuerpo,
+            cache_control=f"private, max-age={ttl}" + (", immutable" if final else ""),
+            vence=time.monotonic() + ttl,
+            cuenta=None,
+            rango=None,
+            ids={id_transaccion},
+        )
+        cache.put(clave, entrada)
+    return _respuesta(entrada, if_none_match)
+
+
+@router.get("/{id_transaccion}/cadena", response_model=CadenaReversasOut)
+def obtener_cadena_reversas(id_transaccion: str, db: Session = Depends(get_read_db)):
+    """
+    Cadena de reversas de una transacción (original y todas sus reversas),
+    resuelta en una sola consulta.
+    """
+    cadena = cadena_reversas(db, id_transaccion)
+    if not cadena:
+        raise HTTPException(404, "Transacción no encontrada")
+    return {"idTransaccion": id_transaccion, "cadena": cadena}
@@ -0,0 +1,48 @@
+# archivo: archivar_transacciones.py
+'''
+Job de archivado de transacciones_agilpagos (programar mensualmente).
+Requiere el layout de scriptPARTICIONADO.sql para --destino tabla.
+Uso (desde la raíz del repo):
+    python -m app.utilidades.archivar_transacciones --meses 12
+    python -m app.utilidades.archivar_transacciones --meses 12 --destino archivo --dir D:\\archivo_agilpagos
+'''
+import sys
+import argparse
+from datetime import datetime
+
+from app.archivo import ArchivoInconsistente, archivar_en_tabla, archivar_en_archivos, mantener_particiones
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Archiva transacciones antiguas")
+    parser.add_argument("--meses", type=int, default=12, help="Se conservan en la tabla los últimos N meses")
+    parser.add_argument("--destino", choices=["tabla", "archivo"], default="tabla")
+    parser.add_argument("--dir", default="archivo", help="Directorio de salida para --destino archivo")
+    parser.add_argument("--lote", type=int, default=50000)
+    parser.add_argument("--sin-particiones", action="store_true", help="Tabla sin particionar (SQL Server 2014 Express)")
+    args = parser.parse_args()
+
+    hoy = datetime.now()
+    mes = hoy.month - args.meses
+    anio = hoy.year + (mes - 1) // 12
+    hasta = datetime(anio, (mes - 1) % 12 + 1, 1)
+
+    if not args.sin_particiones:
+        mantener_particiones()
+
+    if args.destino == "tabla":
+        filas = archivar_en_tabla(hasta, args.lote)
+        print(f"✅ {filas} transacciones anteriores a {hasta:%Y-%m-%d} movidas a transacciones_agilpagos_archivo")
+    else:
+        try:
+            archivados = archivar_en_archivos(hasta, args.dir, args.lote)
+        except ArchivoInconsistente as e:
+            # Ese mes quedó intacto en la tabla (rollback); los anteriores ya están archivados
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        for nombre, filas in archivados.items():
+            print(f"✅ {nombre}: {filas} transacciones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# archivo: benchmark.py
+'''
+Benchmarks livianos de la API (sin red ni SQL Server).
+Uso (desde la raíz del repo):
+    python -m app.utilidades.benchmark            -> corre todos
+    python -m app.utilidades.benchmark firma      -> sólo los indicados
+Cada benchmark imprime el costo por operación para comparar entre versiones.
+'''
+import os, sys, json, time, hmac, hashlib, asyncio, subprocess
+
+ITERACIONES = int(os.getenv("BENCH_ITERACIONES", "20000"))
+
+
+def _reporte(nombre: str, segundos: float, n: int) -> None:
+    print(f"{nombre:<40} {segundos / n * 1e6:>10.2f} µs/op   ({n} ops)")
+
+
+def _notificacion_ejemplo() -> bytes:
+    # Payload con la forma de TransaccionNotificada (openapi_agilpagos.yaml)
+    return json.dumps({
+        "idTransaccion": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+        "idTransaccionAnulada": None,
+        "idTipoTransaccion": 2,
+        "numeroCuenta": "000123",
+        "importe": 1500.50,
+        "idMoneda": 1,
+        "fechaOperacion": "2025-09-20T12:30:00",
+        "fechaContable": "2025-09-20T12:30:00",
+        "observaciones": "Transferencia recibida",
+        "CVU": "0000000000111222334454",
+        "idTransaccionOriginante": None,
+        "idTransaccionEntidad": "E-1",
+        "idEntidad": "ENT-1",
+        "idWebOperacion": "W-1",
+        "cuentaBloqueada": False,
+        "total": 1500.50,
+        "idCoelsa": "123456",
+        "transaccionCuentaContraparte": {
+            "cuentaContraparte": "2850590940090418135201",
+            "cuitContraparte": 20123456789,
+            "titularContraparte": "Juan Perez",
+        },
+        "impuestos": [],
+    }).encode("utf-8")
+
+
+# =========
+# Firma X-Signature
+# =========
+def bench_firma() -> None:
+    os.environ.setdefault("AGIL_FIRMA_CLAVE", "clave-benchmark")
+    from app.firma import FirmaMiddleware, limpiar_cache_claves
+
+    limpiar_cache_claves()
+    body = _notificacion_ejemplo()
+    firma = hmac.new(os.environ["AGIL_FIRMA_CLAVE"].encode(), body, hashlib.sha256).hexdigest()
+    # Body partido en chunks como lo entrega el servidor
+    chunks = [body[i:i + 256] for i in range(0, len(body), 256)]
+
+    async def app_vacia(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/transacciones",
+        "headers": [(b"x-signature", firma.encode()), (b"idwebusuariofinal", b"u1")],
+    }
+
+    async def correr(asgi, n: int) -> float:
+        async def send(message):
+            pass
+
+        t0 = time.perf_counter()
+        for _ in range(n):
+            pendientes = iter(chunks)
+
+            async def receive():
+                chunk = next(pendientes, None)
+                if chunk is None:
+                    return {"type": "http.disconnect"}
+                return {"type": "http.request", "body": chunk, "more_body": chunk is not chunks[-1]}
+
+            await asgi(scope, receive, send)
+        return time.perf_counter() - t0
+
+    base = asyncio.run(correr(app_vacia, ITERACIONES))
+    con_firma = asyncio.run(correr(FirmaMiddleware(app_vacia), ITERACIONES))
+    _reporte("firma: app sin middleware", base, ITERACIONES)
+    _reporte(f"firma: con FirmaMiddleware ({len(body)} B)", con_firma, ITERACIONES)
+    _reporte("firma: overhead", con_firma - base, ITERACIONES)
+
+
+# =========
+# Arranque en frío (import + lifespan)
+# =========
+def bench_arranque() -> None:
+    n = int(os.getenv("BENCH_ARRANQUES", "5"))
+    codigo = "\n".join([
+        "import time, sys, asyncio",
+        "t0 = time.perf_counter()",
+        "import app.main as m",
+        "t1 = time.perf_counter()",
+        "async def f():",
+        "    async with m.app.router.lifespan_context(m.app):",
+        "        pass",
+        "asyncio.run(f())",
+        "t2 = time.perf_counter()",
+        "print(t1 - t0, t2 - t1, 'pyodbc' in sys.modules)",
+    ])
+    imports, lifespans, total = [], [], 0.0
+    pyodbc_cargado = False
+    for _ in range(n):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+        total += time.perf_counter() - t0
+        t_import, t_lifespan, con_pyodbc = out.stdout.split()
+        imports.append(float(t_import))
+        lifespans.append(float(t_lifespan))
+        pyodbc_cargado = pyodbc_cargado or con_pyodbc == "True"
+    _reporte("arranque: proceso completo", total, n)
+    _reporte("arranque: import app.main", sum(imports), n)
+    _reporte("arranque: lifespan startup+shutdown", sum(lifespans), n)
+    print(f"{'arranque: pyodbc cargado':<40} {pyodbc_cargado}")
+
+
+# =========
+# Totales: Decimal vs centavos enteros
+# =========
+def bench_importes() -> None:
+    from decimal import Decimal
+    from app.importes import a_centavos, desde_centavos
+
+    n = ITERACIONES * 50
+    decimales = [Decimal(i % 100000).scaleb(-2) for i in range(n)]
+    centavos = [a_centavos(d) for d in decimales]
+
+    t0 = time.perf_counter()
+    total_dec = sum(decimales, Decimal(0))
+    t1 = time.perf_counter()
+    total_cent = sum(centavos)
+    t2 = time.perf_counter()
+    assert desde_centavos(total_cent) == total_dec
+    _reporte("importes: suma Decimal", t1 - t0, n)
+    _reporte("importes: suma centavos (int)", t2 - t1, n)
+
+
+# =========
+# SG fake: cache de token, pool por entidad y reintentos (sin red)
+# =========
+def bench_sg() -> None:
+    """
+    Corre contra el SG fake embebido (app/sg_fake.py). Perfil por env:
+    SG_FAKE_LATENCIA_MS (default 20), SG_FAKE_JITTER_MS, SG_FAKE_TASA_5XX.
+    """
+    for k, v in {"SG_FAKE": "1", "SG_ID_ENTIDAD": "ENT-BENCH", "SG_USER_NAME": "bench",
+                 "SG_PASSWORD": "bench", "SG_FAKE_LATENCIA_MS": "20"}.items():
+        os.environ.setdefault(k, v)
+    import httpx
+    from app.main import app
+    from app.auth_sg import get_or_refresh_token, cerrar_recursos_sg
+    from app.entidades import get_registro
+    from app.sg_fake import app_fake
+
+    n = int(os.getenv("BENCH_SG_REQUESTS", "200"))
+    fake = app_fake().state.fake
+
+    async def correr():
+        # 1) token: N pedidos concurrentes -> un solo login (single-flight) y después hits en memoria
+        t0 = time.perf_counter()
+        await asyncio.gather(*[get_or_refresh_token() for _ in range(n)])
+        t1 = time.perf_counter()
+        for _ in range(ITERACIONES):
+            await get_or_refresh_token()
+        t2 = time.perf_counter()
+        _reporte("sg: token, primer burst (con login)", t1 - t0, n)
+        _reporte("sg: token, cache hit", t2 - t1, ITERACIONES)
+        print(f"{'sg: logins para el burst':<40} {fake.llamadas.get('POST /Account/Login', 0)}")
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as cli:
+            # 2) pool + cupo de la entidad: N transferencias concurrentes
+            t0 = time.perf_counter()
+            rs = await asyncio.gather(*[cli.post("/sg/transferencias", json={"importe": i}) for i in range(n)])
+            t1 = time.perf_counter()
+            cupo = get_registro().estado().cfg.concurrencia
+            _reporte("sg: transferencia (concurrente)", t1 - t0, n)
+            print(f"{'sg: máx en vuelo en SG / cupo':<40} {fake.max_en_vuelo} / {cupo}   "
+                  f"({sum(r.status_code == 200 for r in rs)} ok, {sum(r.status_code == 503 for r in rs)} sin cupo)")
+
+            # 3) tormenta de reintentos del ERP: 5 intentos por operación, con y sin Idempotency-Key
+            for con_clave in (False, True):
+                antes = sum(v for k, v in fake.llamadas.items() if k.endswith("transferencias"))
+                pedidos = []
+                for op in range(n // 5):
+                    headers = {"Idempotency-Key": f"op-{op}"} if con_clave else {}
+                    pedidos += [cli.post("/sg/transferencias", json={"op": op}, headers=headers) for _ in range(5)]
+                t0 = time.perf_counter()
+                await asyncio.gather(*pedidos)
+                t1 = time.perf_counter()
+                llamadas = sum(v for k, v in fake.llamadas.items() if k.endswith("transferencias")) - antes
+                etiqueta = "con Idempotency-Key" if con_clave else "sin Idempotency-Key"
+                _reporte(f"sg: reintentos {etiqueta}", t1 - t0, len(pedidos))
+                print(f"{'sg:   llamadas a SG':<40} {llamadas} de {len(pedidos)}")
+        await cerrar_recursos_sg()
+
+    asyncio.run(correr())
+
+
+# =========
+# Respuestas enormes de SG vs latencia de los demás /sg (event loop)
+# =========
+def bench_loop() -> None:
+    """
+    Requests chicos a /sg/usuarios/{cuit}/by-cuit mientras otros traen un usuario
+    con BENCH_CUENTAS cuentas. Compara parseo/serialización en el loop vs en hilo.
+    """
+    for k, v in {"SG_FAKE": "1", "SG_ID_ENTIDAD": "ENT-BENCH", "SG_USER_NAME": "bench",
+                 "SG_PASSWORD": "bench", "SG_FAKE_LATENCIA_MS": "5", "SG_CONCURRENCIA": "50"}.items():
+        os.environ.setdefault(k, v)
+    import httpx
+    import app.sg as sg
+    from app.main import app
+    from app.auth_sg import password_digest_b64, nonce_base64, ahora_utc_iso_z, sg_config, cerrar_recursos_sg
+    from app.sg_fake import app_fake
+
+    nonce, created = nonce_base64(), ahora_utc_iso_z()
+    t0 = time.perf_counter()
+    for _ in range(ITERACIONES):
+        password_digest_b64(nonce, created, "una-password-de-prueba")
+    _reporte("loop: password_digest_b64 (inline)", time.perf_counter() - t0, ITERACIONES)
+
+    fake = app_fake().state.fake
+    fake.agregar_usuario("20000000001", cuentas=int(os.getenv("BENCH_CUENTAS", "50000")))
+    fake.agregar_usuario("20000000002")
+    n_chicos = int(os.getenv("BENCH_SG_REQUESTS", "200"))
+
+    async def medir(cli: httpx.AsyncClient) -> list:
+        async def chico(i: int) -> float:
+            await asyncio.sleep(i * 0.002)
+            t = time.perf_counter()
+            r = await cli.get("/sg/usuarios/20000000002/by-cuit")
+            assert r.status_code == 200
+            return (time.perf_counter() - t) * 1000
+
+        async def grande() -> None:
+            r = await cli.get("/sg/usuarios/20000000001/by-cuit")
+            assert r.status_code == 200
+
+        res = await asyncio.gather(*[chico(i) for i in range(n_chicos)], *[grande() for _ in range(4)])
+        return sorted(res[:n_chicos])
+
+    async def correr():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60) as cli:
+            await cli.get("/sg/usuarios/20000000002/by-cuit")  # login + conexiones
+            umbral_bytes, umbral_items = sg_config().json_hilo_bytes, sg.ITEMS_HILO
+            for etiqueta, bytes_, items in (("en el loop", 1 << 62, 1 << 62), ("en hilo", umbral_bytes, umbral_items)):
+                sg_config().json_hilo_bytes, sg.ITEMS_HILO = bytes_, items
+                lat = await medir(cli)
+                p50, p99 = lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+                print(f"{'loop: chicos con grandes ' + etiqueta:<40} p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   máx {lat[-1]:8.1f} ms")
+            sg_config().json_hilo_bytes, sg.ITEMS_HILO = umbral_bytes, umbral_items
+        await cerrar_recursos_sg()
+
+    asyncio.run(correr())
+
+
+# =========
+# UsuarioByCuit: body completo vs proyección tipada (?fields=)
+# =========
+def bench_usuarios() -> None:
+    from app.sg import _adaptador_sg, CAMPOS_CUENTA
+    from app.sg_fake import EstadoFake
+
+    cuentas = int(os.getenv("BENCH_CUENTAS", "50000"))
+    crudo = EstadoFake().agregar_usuario("20000000001", cuentas=cuentas)["crudo"]
+    n = max(1, ITERACIONES // 2000)
+    print(f"{'usuarios: body SG':<40} {len(crudo) / 1024:>10.0f} KiB   ({cuentas} cuentas)")
+
+    def medir(nombre, fn):
+        fn()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            salida = fn()
+        _reporte(nombre, time.perf_counter() - t0, n)
+        return salida
+
+    completo = medir("usuarios: json.loads + dumps completo", lambda: json.dumps(json.loads(crudo)).encode())
+    todos = _adaptador_sg(frozenset(CAMPOS_CUENTA))
+    medir("usuarios: validate_json todos los campos", lambda: todos.validate_json(crudo))
+    solo_cvu = _adaptador_sg(frozenset({"cvu"}))
+    medir("usuarios: validate_json sólo cvu", lambda: solo_cvu.validate_json(crudo))
+    nada = _adaptador_sg(frozenset())
+    medir("usuarios: validate_json sin cuentas", lambda: nada.validate_json(crudo))
+    primera = nada.validate_json(crudo)[0]
+    recortado = json.dumps({"existe": True, "idUsuario": primera["usuario"][0], "cvu": "0" * 22}).encode()
+    print(f"{'usuarios: respuesta completa / ?fields=':<40} {len(completo)} B / {len(recortado)} B")
+
+
+def bench_reportes() -> None:
+    import tempfile
+    from datetime import date
+    try:
+        import duckdb
+    except ImportError:
+        print("reportes: duckdb no instalado, se omite")
+        return
+
+    filas = int(os.getenv("BENCH_FILAS_REPORTES", "2000000"))
+    with tempfile.TemporaryDirectory() as d:
+        os.environ["REPORTES_DIR"] = d
+        from app import reportes
+
+        # Store sintético: `filas` transacciones repartidas en 24 meses
+        con = duckdb.connect()
+        con.execute(
+            f"CREATE TABLE t AS SELECT 't' || i AS id_transaccion, (i % 4)::INTEGER AS tipo, "
+            f"'c' || (i % 5000) AS numero_cuenta, (i * 7919 % 1000000)::BIGINT AS centavos, "
+            f"TIMESTAMP '2024-01-01' + to_seconds((i * 63072000 // {filas})::BIGINT) AS fecha_operacion, "
+            f"TIMESTAMP '2024-01-01' AS fecha_registro, 'registrada' AS estado, NULL::VARCHAR AS id_transaccion_anulada, "
+            f"strftime(fecha_operacion, '%Y-%m') AS mes FROM range({filas}) r(i)"
+        )
+        for (mes,) in con.execute("SELECT DISTINCT mes FROM t").fetchall():
+            destino = reportes._archivo_mes(d, mes)
+            os.makedirs(os.path.dirname(destino))
+            con.execute(
+                f"COPY (SELECT * EXCLUDE (mes) FROM t WHERE mes = '{mes}' ORDER BY fecha_operacion) "
+                f"TO {reportes._literal(destino)} (FORMAT parquet)"
+            )
+        con.close()
+
+        n = max(1, ITERACIONES // 2000)
+        for nombre, agrupar in (("total", []), ("por mes y tipo", ["mes", "tipo"]), ("por cuenta", ["numeroCuenta"])):
+            reportes.totales(date(2024, 1, 1), date(2026, 1, 1), agrupar, limite=100000)
+            t0 = time.perf_counter()
+            for _ in range(n):
+                reportes.totales(date(2024, 1, 1), date(2026, 1, 1), agrupar, limite=100000)
+            _reporte(f"reportes: 24 meses {nombre}", time.perf_counter() - t0, n)
+        print(f"{'reportes: filas en el store':<40} {filas:>10}")
+
+
+# =========
+# Importador histórico: validación (lo que corre en cada proceso)
+# =========
+def bench_backfill() -> None:
+    from app.backfill import validar_bloque
+
+    base = json.loads(_notificacion_ejemplo())
+    lineas = [json.dumps(dict(base, idTransaccion=f"t{i}")) for i in range(ITERACIONES)]
+    t0 = time.perf_counter()
+    filas, _ = validar_bloque(lineas, "jsonl")
+    _reporte("backfill: validar fila jsonl", time.perf_counter() - t0, len(filas))
+
+
+BENCHMARKS = {
+    "firma": bench_firma,
+    "arranque": bench_arranque,
+    "importes": bench_importes,
+    "sg": bench_sg,
+    "loop": bench_loop,
+    "usuarios": bench_usuarios,
+    "reportes": bench_reportes,
+    "backfill": bench_backfill,
+}
+
+if __name__ == "__main__":
+    nombres = sys.argv[1:] or list(BENCHMARKS)
+    for nombre in nombres:
+        BENCHMARKS[nombre]()
@@ -0,0 +1,36 @@
+# archivo: conciliar.py
+'''
+Conciliación manual de transacciones_agilpagos contra los movimientos de SG.
+Las diferencias quedan en conciliacion_agilpagos (ver scriptCONCILIACION.sql).
+Uso (desde la raíz del repo):
+    python -m app.utilidades.conciliar --desde 2025-09-01 --hasta 2025-10-01
+'''
+import argparse
+import asyncio
+import json
+from datetime import datetime
+
+from app.auth_sg import cerrar_recursos_sg
+from app.conciliacion import conciliar
+
+
+async def _correr(desde: datetime, hasta: datetime, entidad_id: str) -> dict:
+    try:
+        return await conciliar(desde, hasta, entidad_id)
+    finally:
+        await cerrar_recursos_sg()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concilia transacciones locales contra SG")
+    parser.add_argument("--desde", required=True, type=datetime.fromisoformat)
+    parser.add_argument("--hasta", required=True, type=datetime.fromisoformat)
+    parser.add_argument("--entidad", default=None, help="GUID de una sola entidad (default: todas las configuradas)")
+    args = parser.parse_args()
+
+    resumen = asyncio.run(_correr(args.desde, args.hasta, args.entidad))
+    print(json.dumps(resumen, indent=2, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
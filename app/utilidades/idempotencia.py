@@ -0,0 +1,46 @@
+# archivo: idempotencia.py
+'''
+Conciliación de Idempotency-Key de los POST a SG (tabla idempotencia_sg).
+Una clave queda "desconocido" cuando SG no respondió (5xx, timeout,
+cancelación): los reintentos del ERP reciben 502 hasta que alguien verifique
+en SG si la operación se hizo y la resuelva acá.
+Uso (desde la raíz del repo):
+    python -m app.utilidades.idempotencia                                  -> lista claves en curso / desconocidas
+    python -m app.utilidades.idempotencia --liberar transferencias "" CLAVE -> no se hizo: el próximo reintento llama a SG
+    python -m app.utilidades.idempotencia --completar usuarios ENT CLAVE --respuesta respuesta.json
+'''
+import sys
+import json
+import argparse
+
+from app.idempotencia import pendientes, resolver
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lista y resuelve Idempotency-Key sin resultado conocido")
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument("--liberar", nargs=3, metavar=("ALCANCE", "ENTIDAD", "CLAVE"),
+                       help="SG no registró la operación: se borra la clave")
+    grupo.add_argument("--completar", nargs=3, metavar=("ALCANCE", "ENTIDAD", "CLAVE"),
+                       help="SG sí la registró: los reintentos repiten --respuesta")
+    parser.add_argument("--respuesta", help="JSON con la respuesta de SG (para --completar)")
+    parser.add_argument("--limite", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.liberar:
+        ok = resolver(*args.liberar)
+    elif args.completar:
+        if not args.respuesta:
+            parser.error("--completar requiere --respuesta")
+        with open(args.respuesta, "r", encoding="utf-8") as f:
+            ok = resolver(*args.completar, respuesta=json.load(f))
+    else:
+        print(json.dumps(pendientes(args.limite), indent=2, ensure_ascii=False))
+        return
+    if not ok:
+        print("Clave no encontrada", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# archivo: importar_historico.py
+'''
+Carga masiva de movimientos históricos de Agilpagos (alta de una entidad
+nueva) directo a transacciones_agilpagos, sin pasar por /transacciones.
+Acepta .json (array), .jsonl (una notificación por línea) o .csv (columnas
+con los nombres de TransaccionNotificada; transaccionCuentaContraparte e
+impuestos como texto JSON). Valida con el mismo schema que el webhook en
+varios procesos y carga por lotes (staging #backfill + MERGE).
+Si se corta, volver a correr lo mismo retoma desde el checkpoint.
+Las filas rechazadas quedan en el dead-letter (ver reprocesar_deadletter).
+Uso (desde la raíz del repo):
+    python -m app.utilidades.importar_historico movimientos_2024.jsonl movimientos_2025.jsonl
+    python -m app.utilidades.importar_historico historico.csv --procesos 8 --lote 50000
+    python -m app.utilidades.importar_historico historico.json --dry-run    -> sólo valida
+'''
+import sys
+import json
+import argparse
+
+from app.backfill import BackfillConfig, importar
+
+
+def _progreso(stats) -> None:
+    print(
+        f"  {stats['leidas']} leídas  nuevas={stats['nuevas']} rechazadas={stats['rechazadas']}  "
+        f"{stats['filas_por_seg']}/s  ({stats['segundos']}s)",
+        file=sys.stderr,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Importa movimientos históricos de Agilpagos")
+    parser.add_argument("archivos", nargs="+", help=".json, .jsonl o .csv")
+    parser.add_argument("--lote", type=int, default=None, help="Filas por lote (default: BACKFILL_LOTE)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos de validación (default: BACKFILL_PROCESOS)")
+    parser.add_argument("--checkpoint", default=None, help="Archivo de checkpoint (default: BACKFILL_CHECKPOINT)")
+    parser.add_argument("--dry-run", action="store_true", help="Valida sin escribir en la BD")
+    args = parser.parse_args()
+
+    cfg = BackfillConfig()
+    if args.lote:
+        cfg.lote = args.lote
+    if args.procesos:
+        cfg.procesos = args.procesos
+    if args.checkpoint:
+        cfg.checkpoint = args.checkpoint
+    resumen = importar(args.archivos, cfg, simular=args.dry_run, progreso=_progreso)
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# archivo: poblar_directorio.py
+'''
+Carga masiva del directorio CVU -> usuario SG (tabla directorio_cvu,
+scriptDIRECTORIO.sql). Dos fuentes:
+  --csv     export con columnas cvu,idUsuario,alias,numeroCuentaEntidad,cuit[,idEntidad]
+  --cuits   un CUIT por línea: se consulta UsuarioByCuit en SG (con el cupo de la entidad)
+Lo que ya está igual en la tabla no se vuelve a escribir.
+Uso (desde la raíz del repo):
+    python -m app.utilidades.poblar_directorio --csv cuentas_sg.csv
+    python -m app.utilidades.poblar_directorio --cuits socios.txt --concurrencia 5 --entidad <guid>
+'''
+import sys
+import csv
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+
+from app.directorio import get_directorio
+
+
+def desde_csv(path: str, lote: int, id_entidad: Optional[str]) -> None:
+    directorio = get_directorio()
+    directorio.cargar()
+    leidas = escritas = 0
+    t0 = time.perf_counter()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        buffer = []
+        for fila in csv.DictReader(f):
+            if id_entidad and not fila.get("idEntidad"):
+                fila["idEntidad"] = id_entidad
+            buffer.append(fila)
+            if len(buffer) >= lote:
+                escritas += directorio.guardar(buffer)
+                leidas += len(buffer)
+                buffer = []
+                print(f"  {leidas} leídas, {escritas} escritas ({leidas / (time.perf_counter() - t0):.0f}/s)", file=sys.stderr)
+        if buffer:
+            escritas += directorio.guardar(buffer)
+            leidas += len(buffer)
+    print(f"✅ {leidas} filas leídas, {escritas} escritas en directorio_cvu")
+
+
+async def desde_sg(cuits: List[str], concurrencia: int, id_entidad: Optional[str]) -> None:
+    from app.auth_sg import cerrar_recursos_sg
+    from app.sg import _usuario_by_cuit_core
+
+    await asyncio.to_thread(get_directorio().cargar)
+    semaforo = asyncio.Semaphore(concurrencia)
+    hechos, cuentas, errores = 0, 0, 0
+
+    async def uno(cuit: str) -> None:
+        nonlocal hechos, cuentas, errores
+        async with semaforo:
+            try:
+                # _usuario_by_cuit_core ya registra las cuentas en el directorio
+                res = await _usuario_by_cuit_core(cuit, id_entidad)
+                cuentas += len(res["cuentas"])
+            except Exception as e:
+                errores += 1
+                print(f"  ⚠️ {cuit}: {getattr(e, 'detail', e)}", file=sys.stderr)
+            hechos += 1
+            if hechos % 100 == 0:
+                print(f"  {hechos}/{len(cuits)} CUIT, {cuentas} cuentas", file=sys.stderr)
+
+    try:
+        await asyncio.gather(*(uno(c) for c in cuits))
+    finally:
+        await cerrar_recursos_sg()
+    print(f"✅ {hechos} CUIT consultados ({errores} con error), {cuentas} cuentas en el directorio")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Carga el directorio CVU -> usuario SG")
+    fuente = parser.add_mutually_exclusive_group(required=True)
+    fuente.add_argument("--csv", help="Export con cvu,idUsuario,alias,numeroCuentaEntidad,cuit[,idEntidad]")
+    fuente.add_argument("--cuits", help="Archivo con un CUIT por línea (consulta SG)")
+    parser.add_argument("--entidad", default=None, help="GUID entidad (default: SG_ID_ENTIDAD)")
+    parser.add_argument("--lote", type=int, default=5000, help="Filas por transacción (--csv)")
+    parser.add_argument("--concurrencia", type=int, default=5, help="Consultas a SG en paralelo (--cuits)")
+    args = parser.parse_args()
+
+    if args.csv:
+        desde_csv(args.csv, args.lote, args.entidad)
+    else:
+        with open(args.cuits, "r", encoding="utf-8-sig") as f:
+            cuits = [linea.strip().replace("-", "") for linea in f if linea.strip()]
+        asyncio.run(desde_sg(cuits, args.concurrencia, args.entidad))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# archivo: reprocesar_deadletter.py
+'''
+Re-ingesta de las notificaciones guardadas en el dead-letter (DEADLETTER_DIR):
+deduplica por idTransaccion, revalida localmente y registra por lotes en
+varios hilos. Lo que vuelve a fallar queda en un dead-letter nuevo; los
+archivos leídos se renombran a .procesado.
+Las filas reprocesadas llegan a SSE/WebSocket/webhooks y a los caches de
+respuestas de la API por la cola de cada worker (a los NOTIF_POLL_MS), no
+desde este proceso.
+Uso (desde la raíz del repo):
+    python -m app.utilidades.reprocesar_deadletter
+    python -m app.utilidades.reprocesar_deadletter --dry-run          -> solo cuenta y valida
+    python -m app.utilidades.reprocesar_deadletter --clase OperationalError --hilos 8
+'''
+import sys
+import json
+import argparse
+
+from app.ingesta import DeadLetterConfig, reprocesar
+
+
+def _progreso(stats) -> None:
+    hechas = stats["ok"] + stats["duplicado"] + stats["error"]
+    tasa = hechas / stats["segundos"] if stats["segundos"] else hechas
+    print(
+        f"  {hechas}/{stats['leidas']}  ok={stats['ok']} dup={stats['duplicado']} "
+        f"err={stats['error']} inv={stats['invalidas']}  ({tasa:.0f}/s)",
+        file=sys.stderr,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reprocesa el dead-letter de notificaciones")
+    parser.add_argument("--dir", default=None, help="Directorio (default: DEADLETTER_DIR)")
+    parser.add_argument("--clase", default=None, help="Solo errores de esta clase (ej. ValidacionSchema)")
+    parser.add_argument("--lote", type=int, default=500, help="Filas por transacción")
+    parser.add_argument("--hilos", type=int, default=4, help="Sesiones de BD en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="No escribe nada")
+    args = parser.parse_args()
+
+    directorio = args.dir or DeadLetterConfig().directorio
+    resumen = reprocesar(
+        directorio, lote=args.lote, hilos=args.hilos, clase=args.clase,
+        simular=args.dry_run, progreso=_progreso,
+    )
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
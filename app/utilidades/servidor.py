@@ -0,0 +1,81 @@
+# archivo: servidor.py
+'''
+Runner de producción: varios procesos uvicorn sobre el mismo puerto.
+El .env se carga y valida una vez en el proceso padre (los workers heredan
+el entorno) y un SIGTERM drena: /ready pasa a 503 enseguida y durante
+--prestop segundos se sigue atendiendo (el balanceador deja de mandar
+tráfico); después se dejan de aceptar conexiones, se terminan los requests
+en vuelo (hasta --drenado segundos) y el lifespan vacía los webhooks
+pendientes y los logs. Los jobs únicos (conciliación, webhooks salientes,
+catálogos, reportes) corren sólo en el worker líder (app/lider.py).
+Uso (desde la raíz del repo):
+    python -m app.utilidades.servidor                      -> API_WORKERS o un worker por CPU
+    python -m app.utilidades.servidor --workers 4 --port 6868
+Probes: GET /live (proceso vivo) y GET /ready (listo para recibir tráfico).
+'''
+import os
+import sys
+import json
+import argparse
+
+import uvicorn
+
+from app.config import cargar_entorno, env
+
+
+def _validar_config() -> list:
+    """Errores de configuración que conviene ver antes de levantar N workers."""
+    errores = []
+    if not env("AUTH_TOKEN"):
+        errores.append("AUTH_TOKEN no definido: POST /transacciones rechazaría todo")
+    if not env("ADMIN_TOKEN"):
+        errores.append("ADMIN_TOKEN no definido: los endpoints internos y /admin rechazarían todo")
+    elif env("ADMIN_TOKEN") == env("AUTH_TOKEN"):
+        errores.append("ADMIN_TOKEN igual a AUTH_TOKEN: el token de Agilpagos daría acceso a los endpoints internos")
+    if env("DB_SERVER") and not env("DB_DRIVER"):
+        errores.append("DB_DRIVER no definido")
+    path = env("SG_ENTIDADES_PATH", "")
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for e in json.load(f).get("entidades", []):
+                    e["id_entidad"]
+        except (OSError, ValueError, KeyError) as e:
+            errores.append(f"SG_ENTIDADES_PATH inválido: {e}")
+    return errores
+
+
+def main() -> None:
+    cargar_entorno()  # precarga: os.environ del padre -> workers
+    parser = argparse.ArgumentParser(description="Levanta la API con varios workers")
+    parser.add_argument("--host", default=env("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("API_PORT", "6868")))
+    parser.add_argument("--workers", type=int, default=int(env("API_WORKERS", "0")) or os.cpu_count() or 1)
+    parser.add_argument("--drenado", type=int, default=int(env("API_DRENADO_SEGS", "30")),
+                        help="Segundos para terminar requests en vuelo tras SIGTERM")
+    parser.add_argument("--prestop", type=float, default=float(env("API_PRESTOP_SEGS", "10")),
+                        help="Segundos con /ready en 503 antes de dejar de aceptar tras SIGTERM")
+    parser.add_argument("--log-level", default=env("API_LOG_LEVEL", "warning"))
+    parser.add_argument("--forzar", action="store_true", help="Arrancar aunque la validación de config falle")
+    args = parser.parse_args()
+
+    errores = _validar_config()
+    for e in errores:
+        print(f"config: {e}", file=sys.stderr)
+    if errores and not args.forzar:
+        sys.exit(1)
+
+    os.environ["API_PRESTOP_SEGS"] = str(args.prestop)  # lo lee el lifespan de cada worker
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.drenado,
+        log_level=args.log_level,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# archivo: sincronizar_reportes.py
+'''
+Export incremental de transacciones_agilpagos al store de reportes
+(Parquet por mes en REPORTES_DIR, consultado por /reportes con DuckDB).
+Programar cada pocos minutos, o usar REPORTES_INTERVALO_MIN en la API.
+Requiere duckdb (pip install duckdb).
+Uso (desde la raíz del repo):
+    python -m app.utilidades.sincronizar_reportes
+    python -m app.utilidades.sincronizar_reportes --completo    -> rehace el store desde cero
+'''
+import os
+import sys
+import json
+import shutil
+import argparse
+
+from app.reportes import ReportesConfig, SincronizacionEnCurso, sincronizar
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sincroniza el store de reportes")
+    parser.add_argument("--completo", action="store_true", help="Borra el store y exporta todo de nuevo")
+    args = parser.parse_args()
+
+    cfg = ReportesConfig()
+    if args.completo and os.path.isdir(cfg.directorio):
+        shutil.rmtree(cfg.directorio)
+    try:
+        resumen = sincronizar(cfg)
+    except SincronizacionEnCurso as e:
+        print(f"⚠️ {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
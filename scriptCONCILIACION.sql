@@ -0,0 +1,31 @@
+/******  Tabla de reporte del worker de conciliación (app/conciliacion.py)  ******/
+USE [AGILPAGOS]
+GO
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE TABLE [dbo].[conciliacion_agilpagos](
+	[id] [int] IDENTITY(1,1) NOT NULL,
+	[id_corrida] [varchar](36) NOT NULL,
+	[fecha_corrida] [datetime] NOT NULL CONSTRAINT [DF_conciliacion_agilpagos_fecha_corrida] DEFAULT (getdate()),
+	[id_transaccion] [varchar](50) NOT NULL,
+	[tipo_diferencia] [varchar](20) NOT NULL,
+	[importe_sg] [decimal](18, 2) NULL,
+	[importe_local] [decimal](18, 2) NULL,
+	[tipo_sg] [int] NULL,
+	[tipo_local] [int] NULL,
+	[fecha_operacion] [datetime] NULL,
+ CONSTRAINT [PK_conciliacion_agilpagos] PRIMARY KEY CLUSTERED ([id] ASC)
+) ON [PRIMARY]
+GO
+CREATE NONCLUSTERED INDEX [IX_conciliacion_agilpagos_id_corrida]
+    ON [dbo].[conciliacion_agilpagos] ([id_corrida])
+GO
+/* La conciliación lee por rango de fecha_operacion: en el layout original
+   (PK por id_transaccion) este índice evita el table scan. */
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_transacciones_agilpagos_fecha_operacion')
+    CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_fecha_operacion]
+        ON [dbo].[transacciones_agilpagos] ([fecha_operacion])
+        INCLUDE ([importe], [tipo])
+GO
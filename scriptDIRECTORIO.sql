@@ -0,0 +1,21 @@
+/******  Directorio local CVU -> usuario SG (app/directorio.py)  ******/
+/* Se completa con las respuestas de SG (alta de usuario, UsuarioByCuit) y con
+   app/utilidades/poblar_directorio.py. La API lo tiene entero en memoria y lo
+   relee en forma incremental por fecha_actualizacion. */
+USE [AGILPAGOS]
+GO
+CREATE TABLE [dbo].[directorio_cvu](
+	[cvu] [varchar](50) NOT NULL,
+	[id_usuario] [varchar](50) NULL,
+	[alias] [varchar](50) NULL,
+	[numero_cuenta_entidad] [varchar](50) NULL,
+	[cuit] [varchar](20) NULL,
+	[id_entidad] [varchar](50) NULL,
+	[fecha_actualizacion] [datetime] NOT NULL CONSTRAINT [DF_directorio_cvu_fecha_actualizacion] DEFAULT (getdate()),
+ CONSTRAINT [PK_directorio_cvu] PRIMARY KEY CLUSTERED ([cvu] ASC)
+) ON [PRIMARY]
+GO
+CREATE NONCLUSTERED INDEX [IX_directorio_cvu_cuit] ON [dbo].[directorio_cvu] ([cuit])
+GO
+CREATE NONCLUSTERED INDEX [IX_directorio_cvu_fecha_actualizacion] ON [dbo].[directorio_cvu] ([fecha_actualizacion])
+GO
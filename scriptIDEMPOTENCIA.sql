@@ -0,0 +1,25 @@
+/******  Idempotency-Key de los POST a SG (app/idempotencia.py)  ******/
+/* Compartida por todos los workers y nodos: la clave se reserva con el INSERT
+   (PK) antes de llamar a SG. Las filas "desconocido" (SG no respondió) quedan
+   hasta conciliarlas con app/utilidades/idempotencia.py; las completadas se
+   purgan al vencer. */
+USE [AGILPAGOS]
+GO
+IF OBJECT_ID(N'dbo.idempotencia_sg', N'U') IS NULL
+    CREATE TABLE [dbo].[idempotencia_sg](
+        [alcance] [varchar](30) NOT NULL,
+        [id_entidad] [varchar](50) NOT NULL,
+        [clave] [varchar](255) NOT NULL,
+        [huella] [char](64) NOT NULL,
+        [estado] [varchar](20) NOT NULL,
+        [status_code] [int] NULL,
+        [respuesta] [nvarchar](max) NULL,
+        [fecha_creacion] [datetime] NOT NULL CONSTRAINT [DF_idempotencia_sg_fecha_creacion] DEFAULT (getdate()),
+        [fecha_fin] [datetime] NULL,
+        [vence] [datetime] NOT NULL,
+     CONSTRAINT [PK_idempotencia_sg] PRIMARY KEY CLUSTERED ([alcance] ASC, [id_entidad] ASC, [clave] ASC)
+    )
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_idempotencia_sg_vence')
+    CREATE NONCLUSTERED INDEX [IX_idempotencia_sg_vence] ON [dbo].[idempotencia_sg] ([vence])
+GO
@@ -0,0 +1,32 @@
+/******  Cursor de notificaciones (app/notificaciones.py)  ******/
+/* El cursor de SSE / WebSocket / webhooks es una columna rowversion: cada
+   INSERT o UPDATE (reversa que anula el original) le da un valor nuevo y
+   creciente en toda la base. A diferencia de fecha_registro, no se repite
+   dentro de un lote y, leyendo sólo por debajo de MIN_ACTIVE_ROWVERSION(),
+   una transacción que commitea tarde no queda detrás de un cursor ya avanzado.
+   Agregar la columna a una tabla grande reescribe todas las filas: correrlo
+   en una ventana de mantenimiento. */
+USE [AGILPAGOS]
+GO
+IF COL_LENGTH(N'dbo.transacciones_agilpagos', N'version') IS NULL
+    ALTER TABLE [dbo].[transacciones_agilpagos] ADD [version] [rowversion] NOT NULL
+GO
+/* Catch-up de suscriptores que reconectan con un cursor viejo: range seek */
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_transacciones_agilpagos_version')
+    CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_version]
+        ON [dbo].[transacciones_agilpagos] ([version])
+GO
+/* Lo siguen usando los reportes por fecha de registro */
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_transacciones_agilpagos_fecha_registro')
+    CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_fecha_registro]
+        ON [dbo].[transacciones_agilpagos] ([fecha_registro])
+GO
+/* Último cursor entregado a cada webhook saliente (lo escribe sólo el líder) */
+IF OBJECT_ID(N'dbo.notif_cursores', N'U') IS NULL
+    CREATE TABLE [dbo].[notif_cursores](
+        [url] [varchar](400) NOT NULL,
+        [cursor] [bigint] NOT NULL,
+        [fecha_actualizacion] [datetime] NOT NULL CONSTRAINT [DF_notif_cursores_fecha] DEFAULT (getdate()),
+     CONSTRAINT [PK_notif_cursores] PRIMARY KEY CLUSTERED ([url] ASC)
+    )
+GO
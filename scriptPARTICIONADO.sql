@@ -0,0 +1,200 @@
+/******  Layout particionado de [transacciones_agilpagos] + archivo histórico  ******/
+/*
+  Opcional. Reemplaza el heap con PK clustered varchar(50) (GUID aleatorio ->
+  page splits en cada insert) por:
+    - clave clustered creciente (fecha_operacion, id) con id bigint IDENTITY
+    - id_transaccion (GUID) como índice UNIQUE nonclustered
+    - particiones mensuales por fecha_operacion
+    - tabla [transacciones_agilpagos_archivo] + usp_agilpagos_archivar
+
+  Requisitos: particiones en SQL Server 2016 SP1+ (cualquier edición) o
+  Enterprise. En SQL Server 2014 Express omitir la sección 1, crear la tabla
+  "ON [PRIMARY]" y usar CREATE PROCEDURE en lugar de CREATE OR ALTER: la clave
+  clustered por fecha y el archivado por lotes funcionan igual, sólo sin MERGE
+  de particiones.
+
+  La app no cambia: el ORM sigue mapeando id_transaccion como identidad y la
+  columna id la completa el IDENTITY. Incluye las columnas de reversas de
+  scriptREVERSAS.sql (id_transaccion_anulada, id_transaccion_originante,
+  estado): correr este script después de aquel.
+*/
+USE [AGILPAGOS]
+GO
+
+/* ===== 1) Función y esquema de partición mensual ===== */
+IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = N'pf_agilpagos_mensual')
+    CREATE PARTITION FUNCTION [pf_agilpagos_mensual] (datetime)
+        AS RANGE RIGHT FOR VALUES ('2025-01-01T00:00:00')
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = N'ps_agilpagos_mensual')
+    CREATE PARTITION SCHEME [ps_agilpagos_mensual]
+        AS PARTITION [pf_agilpagos_mensual] ALL TO ([PRIMARY])
+GO
+
+/* Crea los límites mensuales que falten hasta @meses_adelante meses desde hoy.
+   Ejecutar mensualmente (o desde app/utilidades/archivar_transacciones.py). */
+CREATE OR ALTER PROCEDURE [dbo].[usp_agilpagos_mantener_particiones]
+    @meses_adelante int = 3
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @ultimo datetime, @limite datetime;
+    SELECT @ultimo = MAX(CAST(rv.value AS datetime))
+      FROM sys.partition_range_values rv
+      JOIN sys.partition_functions pf ON pf.function_id = rv.function_id
+     WHERE pf.name = N'pf_agilpagos_mensual';
+    SET @limite = DATEADD(month, @meses_adelante, DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1));
+    WHILE @ultimo < @limite
+    BEGIN
+        SET @ultimo = DATEADD(month, 1, @ultimo);
+        ALTER PARTITION SCHEME [ps_agilpagos_mensual] NEXT USED [PRIMARY];
+        ALTER PARTITION FUNCTION [pf_agilpagos_mensual]() SPLIT RANGE (@ultimo);
+    END
+END
+GO
+
+/* ===== 2) Tabla nueva ===== */
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE TABLE [dbo].[transacciones_agilpagos_p](
+	[id] [bigint] IDENTITY(1,1) NOT NULL,
+	[id_transaccion] [varchar](50) NOT NULL,
+	[tipo] [int] NOT NULL,
+	[numero_cuenta] [varchar](50) NOT NULL,
+	[importe] [decimal](18, 2) NOT NULL,
+	[fecha_operacion] [datetime] NOT NULL,
+	[cvu] [varchar](50) NOT NULL,
+	[observaciones] [varchar](50) NOT NULL,
+	[fecha_registro] [datetime] NOT NULL CONSTRAINT [DF_transacciones_agilpagos_p_fecha_registro] DEFAULT (getdate()),
+	[id_transaccion_anulada] [varchar](50) NULL,
+	[id_transaccion_originante] [varchar](50) NULL,
+	[estado] [varchar](20) NOT NULL CONSTRAINT [DF_transacciones_agilpagos_p_estado] DEFAULT ('registrada'),
+	[version] [rowversion] NOT NULL,
+ CONSTRAINT [PK_transacciones_agilpagos_p] PRIMARY KEY CLUSTERED
+(
+	[fecha_operacion] ASC,
+	[id] ASC
+) ON [ps_agilpagos_mensual]([fecha_operacion])
+) ON [ps_agilpagos_mensual]([fecha_operacion])
+GO
+/* Unicidad global del GUID. Es un índice NO alineado (no incluye fecha_operacion):
+   por eso el archivado mueve filas por lotes en vez de SWITCH de particiones. */
+CREATE UNIQUE NONCLUSTERED INDEX [UX_transacciones_agilpagos_p_id_transaccion]
+    ON [dbo].[transacciones_agilpagos_p] ([id_transaccion]) ON [PRIMARY]
+GO
+/* Consultas por cuenta y rango de fechas (alineado) */
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_p_cuenta_fecha]
+    ON [dbo].[transacciones_agilpagos_p] ([numero_cuenta], [fecha_operacion])
+    ON [ps_agilpagos_mensual]([fecha_operacion])
+GO
+/* Vinculación de reversas (mismos índices filtrados que scriptREVERSAS.sql) */
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_p_id_transaccion_anulada]
+    ON [dbo].[transacciones_agilpagos_p] ([id_transaccion_anulada])
+    WHERE [id_transaccion_anulada] IS NOT NULL ON [PRIMARY]
+GO
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_p_id_transaccion_originante]
+    ON [dbo].[transacciones_agilpagos_p] ([id_transaccion_originante])
+    WHERE [id_transaccion_originante] IS NOT NULL ON [PRIMARY]
+GO
+/* Cursor de notificaciones (scriptNOTIFICACIONES.sql). La migración le da a
+   cada fila una versión nueva: después de renombrar, adelantar los cursores de
+   webhooks para no reenviar todo el histórico:
+       UPDATE dbo.notif_cursores SET [cursor] = CAST(MIN_ACTIVE_ROWVERSION() AS bigint) - 1 */
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_p_version]
+    ON [dbo].[transacciones_agilpagos_p] ([version]) ON [PRIMARY]
+GO
+
+/* ===== 3) Tabla de archivo ===== */
+CREATE TABLE [dbo].[transacciones_agilpagos_archivo](
+	[id] [bigint] NOT NULL,
+	[id_transaccion] [varchar](50) NOT NULL,
+	[tipo] [int] NOT NULL,
+	[numero_cuenta] [varchar](50) NOT NULL,
+	[importe] [decimal](18, 2) NOT NULL,
+	[fecha_operacion] [datetime] NOT NULL,
+	[cvu] [varchar](50) NOT NULL,
+	[observaciones] [varchar](50) NOT NULL,
+	[fecha_registro] [datetime] NOT NULL,
+	[id_transaccion_anulada] [varchar](50) NULL,
+	[id_transaccion_originante] [varchar](50) NULL,
+	[estado] [varchar](20) NOT NULL,
+	[fecha_archivo] [datetime] NOT NULL CONSTRAINT [DF_transacciones_agilpagos_archivo_fecha_archivo] DEFAULT (getdate()),
+ CONSTRAINT [PK_transacciones_agilpagos_archivo] PRIMARY KEY CLUSTERED
+(
+	[fecha_operacion] ASC,
+	[id] ASC
+)
+) ON [PRIMARY]
+GO
+/* En 2016 SP1+ conviene comprimir el archivo:
+ALTER TABLE [dbo].[transacciones_agilpagos_archivo] REBUILD WITH (DATA_COMPRESSION = PAGE)
+*/
+
+/* ===== 4) Migración desde la tabla actual (ventana de mantenimiento) =====
+EXEC [dbo].[usp_agilpagos_mantener_particiones] @meses_adelante = 3;  -- crea límites hasta hoy + 3 meses
+INSERT INTO [dbo].[transacciones_agilpagos_p] WITH (TABLOCK)
+       ([id_transaccion], [tipo], [numero_cuenta], [importe], [fecha_operacion], [cvu], [observaciones], [fecha_registro],
+        [id_transaccion_anulada], [id_transaccion_originante], [estado])
+SELECT [id_transaccion], [tipo], [numero_cuenta], [importe], [fecha_operacion], [cvu], [observaciones], [fecha_registro],
+       [id_transaccion_anulada], [id_transaccion_originante], [estado]
+  FROM [dbo].[transacciones_agilpagos]
+ ORDER BY [fecha_operacion];
+EXEC sp_rename N'dbo.transacciones_agilpagos', N'transacciones_agilpagos_old';
+EXEC sp_rename N'dbo.transacciones_agilpagos_p', N'transacciones_agilpagos';
+*/
+GO
+
+/* ===== 5) Archivado por lotes (crear después de la migración) =====
+   Mueve a [transacciones_agilpagos_archivo] todo lo anterior a @hasta en lotes
+   de @lote filas (cada lote es una transacción corta: no escala locks ni infla
+   el log). Como la clave clustered empieza por fecha_operacion, cada DELETE es
+   un range seek. Al final hace MERGE de los límites vacíos. */
+CREATE OR ALTER PROCEDURE [dbo].[usp_agilpagos_archivar]
+    @hasta datetime,
+    @lote int = 50000
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @movidas int = 1, @total bigint = 0, @limite datetime;
+    WHILE @movidas > 0
+    BEGIN
+        DELETE TOP (@lote) FROM [dbo].[transacciones_agilpagos]
+        OUTPUT deleted.[id], deleted.[id_transaccion], deleted.[tipo], deleted.[numero_cuenta],
+               deleted.[importe], deleted.[fecha_operacion], deleted.[cvu], deleted.[observaciones],
+               deleted.[fecha_registro], deleted.[id_transaccion_anulada],
+               deleted.[id_transaccion_originante], deleted.[estado]
+          INTO [dbo].[transacciones_agilpagos_archivo]
+               ([id], [id_transaccion], [tipo], [numero_cuenta], [importe], [fecha_operacion],
+                [cvu], [observaciones], [fecha_registro], [id_transaccion_anulada],
+                [id_transaccion_originante], [estado])
+        WHERE [fecha_operacion] < @hasta;
+        SET @movidas = @@ROWCOUNT;
+        SET @total += @movidas;
+    END
+
+    /* Particiones ya vacías: se eliminan sus límites */
+    DECLARE limites CURSOR LOCAL FAST_FORWARD FOR
+        SELECT CAST(rv.value AS datetime)
+          FROM sys.partition_range_values rv
+          JOIN sys.partition_functions pf ON pf.function_id = rv.function_id
+         WHERE pf.name = N'pf_agilpagos_mensual' AND CAST(rv.value AS datetime) < @hasta
+         ORDER BY 1;
+    OPEN limites;
+    FETCH NEXT FROM limites INTO @limite;
+    WHILE @@FETCH_STATUS = 0
+    BEGIN
+        /* Se conserva siempre el primer límite (la función necesita al menos uno) */
+        IF (SELECT COUNT(*) FROM sys.partition_range_values rv
+              JOIN sys.partition_functions pf ON pf.function_id = rv.function_id
+             WHERE pf.name = N'pf_agilpagos_mensual') > 1
+            ALTER PARTITION FUNCTION [pf_agilpagos_mensual]() MERGE RANGE (@limite);
+        FETCH NEXT FROM limites INTO @limite;
+    END
+    CLOSE limites;
+    DEALLOCATE limites;
+
+    SELECT @total AS filas_archivadas;
+END
+GO
@@ -0,0 +1,20 @@
+/******  Vinculación de reversas en [transacciones_agilpagos]  ******/
+/* idTransaccionAnulada / idTransaccionOriginante se persisten e indexan para
+   vincular una reversa con su original en un solo index seek, y estado refleja
+   si la transacción fue anulada. */
+USE [AGILPAGOS]
+GO
+ALTER TABLE [dbo].[transacciones_agilpagos] ADD
+	[id_transaccion_anulada] [varchar](50) NULL,
+	[id_transaccion_originante] [varchar](50) NULL,
+	[estado] [varchar](20) NOT NULL CONSTRAINT [DF_transacciones_agilpagos_estado] DEFAULT ('registrada')
+GO
+/* Filtrados: sólo las reversas ocupan lugar en el índice */
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_id_transaccion_anulada]
+    ON [dbo].[transacciones_agilpagos] ([id_transaccion_anulada])
+    WHERE [id_transaccion_anulada] IS NOT NULL
+GO
+CREATE NONCLUSTERED INDEX [IX_transacciones_agilpagos_id_transaccion_originante]
+    ON [dbo].[transacciones_agilpagos] ([id_transaccion_originante])
+    WHERE [id_transaccion_originante] IS NOT NULL
+GO